@@ -0,0 +1,104 @@
+# bench/bus_pipeline.py
+"""The whole hub pipeline in one process on an in-memory bus, without a broker.
+
+Archived telemetry is published on a ``hub.bus.Bus`` with the memory
+transport; the saver, the analyzer and the AI dashboard subscribe to it as
+they would in a co-located deployment.  Runs twice: once publishing decoded
+records (zero serialization, as co-located components do) and once handing
+the bus encoded payloads as the MQTT transport would, each in a fresh
+interpreter so analyzer state does not carry over.  Checks every record was
+archived and analysed, and every emitted alert reached the dashboard.
+
+    PYTHONPATH=. python bench/bus_pipeline.py data/2025-08-13 [records]
+"""
+import contextlib
+import io
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+# Every record should be analysed: the ingest queue applies backpressure instead of shedding
+os.environ.setdefault("ANALYZER_OVERLOAD", "block")
+
+from hub import archive, telemetry
+from hub.bus import Bus
+
+def load(source, n):
+    files = archive.device_files(os.path.dirname(os.path.abspath(source)), days=[os.path.basename(source)])
+    streams = [archive.read_records(sorted(paths)) for paths in files.values()]
+    records = []
+    for d in archive.merge_by_ts(streams):
+        records.append(d)
+        if len(records) >= n:
+            break
+    return records
+
+def run(records, encoded):
+    from hub import analyzer, saver
+    from hub.ai_dashboard import AIDashboard, ai_dashboard
+
+    bus = Bus()
+    saver.base = pathlib.Path("data")
+    saver.base.mkdir(exist_ok=True)
+    ai_dashboard.dashboard = AIDashboard()
+    analyzer.alert_counts.clear()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        saver.attach(bus)
+        ai_dashboard.start(bus)
+        subscription = analyzer.start(bus)
+        start = time.perf_counter()
+        for d in records:
+            topic = f"lab/device/{d['device']}/telemetry"
+            if encoded:
+                bus.receive(topic, telemetry.dumps(d))
+            else:
+                bus.publish(topic, d)
+        bus.unsubscribe(subscription)  # drains into the ingest queue
+        analyzer.stop()                # drains the ingest queue through the pipeline
+        bus.flush()
+        elapsed = time.perf_counter() - start
+        ai_dashboard.stop()
+        bus.close()
+
+    saved = sum(1 for path in archive.device_files("data").values() for _ in archive.read_records(path))
+    emitted = sum(analyzer.alert_counts.values())
+    return {
+        'elapsed': elapsed,
+        'saved': saved,
+        'analysed': analyzer.ingest.processed,
+        'emitted': emitted,
+        'dashboard': ai_dashboard.dashboard.version,
+        'rejected': bus.rejected
+    }
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    if len(sys.argv) < 4:
+        results = [subprocess.run([sys.executable, __file__, sys.argv[1], str(n), mode]).returncode
+                   for mode in ("decoded", "encoded")]
+        sys.exit(max(results))
+    encoded = sys.argv[3] == "encoded"
+    records = load(sys.argv[1], n)
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)  # saver archive, alert log/store and state snapshot go under tmp/data
+        try:
+            r = run(records, encoded)
+        finally:
+            os.chdir(cwd)
+    label = "encoded payloads" if encoded else "decoded objects"
+    complete = r['saved'] == r['analysed'] == len(records) and r['dashboard'] == r['emitted']
+    print(f"{label:<17} {len(records)} records in {r['elapsed']:.1f} s ({len(records) / r['elapsed']:,.0f}/s)  "
+          f"saved {r['saved']}  analysed {r['analysed']}  alerts emitted {r['emitted']}, "
+          f"on dashboard {r['dashboard']}  rejected {r['rejected']}  complete: {complete}")
+    sys.exit(0 if complete else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# bench/chat_load.py
+"""/chat under load against a mock LLM, and what it does to telemetry endpoint latency.
+
+Starts a local OpenAI-compatible mock (every completion takes ``latency``
+seconds) and the API under uvicorn pointed at it.  Measures ``/latest``
+latency idle, then again while ``clients`` threads keep chatting, half of
+them asking the same question in one shared session (which the API
+coalesces).  Reports chat
+outcomes, upstream LLM calls per chat and the /chat/metrics counters.
+
+    PYTHONPATH=. python bench/chat_load.py [clients] [seconds] [latency]
+"""
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockLLM(BaseHTTPRequestHandler):
+    latency = 2.0
+    calls = 0
+    lock = threading.Lock()
+
+    reply = "Signal looks stable; check the probe ground."
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with MockLLM.lock:
+            MockLLM.calls += 1
+        if request.get("stream"):
+            return self.stream()
+        time.sleep(self.latency)
+        body = json.dumps({
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": "gpt-4",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self.reply}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self):
+        """The same reply as server-sent chunks, one word at a time spread over ``latency``"""
+        words = self.reply.split(" ")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, word in enumerate(words):
+            time.sleep(self.latency / len(words))
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": "gpt-4", "choices": [{"index": 0, "finish_reason": None,
+                                                    "delta": {"content": word + (" " if i < len(words) - 1 else "")}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def request(url, body=None, timeout=120.0):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return r.status, json.loads(r.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+def probe(base, stop, samples):
+    while not stop.is_set():
+        t = time.perf_counter()
+        request(f"{base}/latest")
+        samples.append(time.perf_counter() - t)
+        time.sleep(0.05)
+
+def chatter(base, i, stop, outcomes):
+    n = 0
+    while not stop.is_set():
+        # Even clients all ask the same thing in one session; odd ones ask something new each time
+        if i % 2 == 0:
+            body = {"message": "How is the lab doing?", "session_id": "bench-shared"}
+        else:
+            body = {"message": f"What about run {i}-{n}?"}
+        t = time.perf_counter()
+        status, _ = request(f"{base}/chat", body)
+        outcomes.append((status, time.perf_counter() - t))
+        n += 1
+
+def latency_line(label, samples):
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return f"  /latest {label:<11} p50 {q[49] * 1e3:7.1f} ms  p99 {q[98] * 1e3:7.1f} ms  max {max(samples) * 1e3:7.1f} ms"
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    MockLLM.latency = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+
+    mock = ThreadingHTTPServer(("127.0.0.1", free_port()), MockLLM)
+    threading.Thread(target=mock.serve_forever, daemon=True).start()
+    port = free_port()
+    env = dict(os.environ, OPENAI_API_KEY="mock-key",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{mock.server_address[1]}/v1")
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (os.getcwd(), env.get("PYTHONPATH")) if p)
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "hub.api:app", "--port", str(port),
+                            "--log-level", "warning"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(300):
+            try:
+                request(f"{base}/latest", timeout=1)
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        idle, loaded, outcomes = [], [], []
+        stop = threading.Event()
+        t = threading.Thread(target=probe, args=(base, stop, idle))
+        t.start()
+        time.sleep(min(seconds, 3.0))
+        stop.set()
+        t.join()
+
+        stop = threading.Event()
+        threads = [threading.Thread(target=probe, args=(base, stop, loaded))]
+        threads += [threading.Thread(target=chatter, args=(base, i, stop, outcomes)) for i in range(clients)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        status, metrics = request(f"{base}/chat/metrics")
+    finally:
+        api.terminate()
+        api.wait()
+        mock.shutdown()
+
+    ok = [d for s, d in outcomes if s == 200]
+    busy = sum(1 for s, _ in outcomes if s == 503)
+    print(f"{clients} chat clients for {seconds:.0f} s, mock LLM latency {MockLLM.latency:.1f} s")
+    print(f"  chats: {len(ok)} ok (mean {statistics.mean(ok) if ok else 0:.2f} s), {busy} busy (503), "
+          f"{len(outcomes) - len(ok) - busy} other; {MockLLM.calls} LLM calls")
+    if status == 200:
+        print(f"  /chat/metrics: {metrics}")
+    print(latency_line("idle", idle))
+    print(latency_line("under load", loaded))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# bench/chat_stream.py
+"""Time to first text: /chat against /chat/stream, with a streaming mock LLM.
+
+Uses the mock from chat_load.py, which sends its reply a word at a time
+spread over ``latency`` seconds when asked to stream.  ``clients`` threads
+each ask ``rounds`` questions, first all on /chat and then all on
+/chat/stream; for each request it records when the first reply text
+arrived and when the reply was complete, and checks the streamed text
+matches the mock's reply.
+
+    PYTHONPATH=. python bench/chat_stream.py [clients] [rounds] [latency]
+"""
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from chat_load import MockLLM, free_port, request
+
+def ask(port, path, question):
+    """(seconds to first reply text, seconds to complete reply, reply text) for one chat"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    start = time.perf_counter()
+    conn.request("POST", path, json.dumps({"message": question}), {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    if path == "/chat":
+        text = json.loads(response.read())["response"]
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed, text
+    first, parts, event = None, [], "message"
+    for line in response:
+        line = line.decode().rstrip("\n")
+        if line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: ") and event == "message":
+            first = first or time.perf_counter() - start
+            parts.append(json.loads(line[6:]))
+        elif not line:
+            if event != "message":
+                break
+    conn.close()
+    return first, time.perf_counter() - start, "".join(parts)
+
+def run(port, path, clients, rounds):
+    results = []
+    def client(i):
+        for n in range(rounds):
+            results.append(ask(port, path, f"What about run {i}-{n}?"))
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    MockLLM.latency = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+
+    mock = ThreadingHTTPServer(("127.0.0.1", free_port()), MockLLM)
+    threading.Thread(target=mock.serve_forever, daemon=True).start()
+    port = free_port()
+    env = dict(os.environ, OPENAI_API_KEY="mock-key",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{mock.server_address[1]}/v1")
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (os.getcwd(), env.get("PYTHONPATH")) if p)
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "hub.api:app", "--port", str(port),
+                            "--log-level", "warning"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(300):
+            try:
+                request(f"http://127.0.0.1:{port}/latest", timeout=1)
+                break
+            except OSError:
+                time.sleep(0.1)
+        results = {path: run(port, path, clients, rounds) for path in ("/chat", "/chat/stream")}
+    finally:
+        api.terminate()
+        api.wait()
+        mock.shutdown()
+
+    print(f"{clients} clients x {rounds} chats per endpoint, mock LLM reply over {MockLLM.latency:.1f} s")
+    ok = True
+    for path, rows in results.items():
+        first = [r[0] for r in rows]
+        total = [r[1] for r in rows]
+        # The assistant may append an action hint after the model's text
+        complete = sum(1 for r in rows if r[2].startswith(MockLLM.reply))
+        ok = ok and complete == len(rows)
+        print(f"  {path:<13} first text p50 {statistics.median(first) * 1e3:7.0f} ms  max {max(first) * 1e3:7.0f} ms"
+              f"  complete p50 {statistics.median(total) * 1e3:7.0f} ms  replies intact {complete}/{len(rows)}")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
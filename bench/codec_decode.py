@@ -0,0 +1,61 @@
+# bench/codec_decode.py
+"""Telemetry decode throughput per hub/telemetry.py backend.
+
+Decodes archived payloads (as the bytes MQTT would deliver) with each backend
+that is installed, plus a run of malformed payloads to show rejection cost.
+
+    PYTHONPATH=. python bench/codec_decode.py [data/<day>/<device>.ndjson] [n]
+"""
+import importlib.util
+import sys
+import time
+
+from hub import telemetry
+
+BLOCKED = {"msgspec": (), "orjson": ("msgspec",), "json": ("msgspec", "orjson")}
+MALFORMED = [b"{'ts': 1.0, 'voltage': 3.3}", b'{"ts": NaN}', b'{"voltage": 3.3}', b'{"ts": 1, "v": [1, 2]}', b"\xff"]
+
+def load_backend(name):
+    """A private copy of hub.telemetry with faster backends hidden from it"""
+    saved = {mod: sys.modules.get(mod) for mod in BLOCKED[name]}
+    try:
+        for mod in BLOCKED[name]:
+            sys.modules[mod] = None
+        spec = importlib.util.spec_from_file_location(f"telemetry_{name}", telemetry.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for mod, value in saved.items():
+            if value is None:
+                sys.modules.pop(mod, None)
+            else:
+                sys.modules[mod] = value
+    return module if module.BACKEND == name else None
+
+def rate(fn, payloads):
+    start = time.perf_counter()
+    for p in payloads:
+        try:
+            fn(p, "lab/device/scope1/telemetry")
+        except ValueError:  # each backend copy has its own DecodeError subclass
+            pass
+    return len(payloads) / (time.perf_counter() - start)
+
+def main(path="data/2025-08-13/scope1.ndjson", n=200_000):
+    with open(path, "rb") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    payloads = (lines * (n // len(lines) + 1))[:n]
+    bad = (MALFORMED * (n // len(MALFORMED) // 10 + 1))[:n // 10]
+    print(f"{len(payloads)} payloads (~{sum(map(len, lines)) // len(lines)} bytes each)")
+    for name in ("msgspec", "orjson", "json"):
+        codec = load_backend(name)
+        if codec is None:
+            print(f"{name:<8} not installed")
+            continue
+        good = rate(codec.decode_telemetry, payloads)
+        rejected = rate(codec.decode_telemetry, bad)
+        print(f"{name:<8} {good:>12,.0f} records/s   {1e6 / good:6.2f} us/record   "
+              f"malformed: {1e6 / rejected:6.2f} us/reject")
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2], *(int(a) for a in sys.argv[2:3]))
@@ -0,0 +1,96 @@
+# bench/dashboard_rehydrate.py
+"""Dashboard rehydration time from the alert store and from NDJSON alert files.
+
+Writes a synthetic day of alerts to a temporary AlertStore and per-day
+alerts.ndjson files, then rebuilds the dashboard from each source as the API
+does at startup, while a reader thread keeps polling the dashboard.  Checks
+that the rebuilt summary matches one built alert-by-alert from the same
+history and reports time against the budget and the worst read latency.
+
+    PYTHONPATH=. python bench/dashboard_rehydrate.py [alerts]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from hub import archive, telemetry
+from hub.ai_dashboard import REHYDRATE_BUDGET, REHYDRATE_LIMIT, REHYDRATE_WINDOW, AIDashboard, ai_dashboard
+from hub.alert_store import AlertStore
+
+TYPES = ("ai_anomaly", "maintenance_recommendation", "drift", "statistical_anomaly")
+
+def make_history(n, now):
+    rng = random.Random(7)
+    history = []
+    for i in range(n):
+        ts = now - REHYDRATE_WINDOW * 1.5 * (n - i) / n  # half a window older than rehydration reads
+        alert = {"type": rng.choice(TYPES), "device": f"scope{rng.randrange(16)}", "ts": ts, "state": "open"}
+        if alert["type"] == "maintenance_recommendation":
+            alert["health_score"] = round(rng.random(), 3)
+        history.append(alert)
+    return history
+
+def write_sources(history, tmp):
+    store = AlertStore(os.path.join(tmp, "alerts.db"), batch_size=5000)
+    files = {}
+    for alert in history:
+        store.add(alert)
+        day = time.strftime("%Y-%m-%d", time.localtime(alert["ts"]))
+        if day not in files:
+            os.makedirs(os.path.join(tmp, day), exist_ok=True)
+            files[day] = open(os.path.join(tmp, day, archive.ALERTS_FILE), "ab")
+        files[day].write(telemetry.dumps(alert) + b"\n")
+    store.flush()
+    for f in files.values():
+        f.close()
+    return store
+
+def reference_summary(history, now):
+    dashboard = AIDashboard()
+    recent = [a for a in history if a["ts"] >= now - REHYDRATE_WINDOW][-REHYDRATE_LIMIT:]
+    for alert in recent:
+        dashboard.add_alert(alert)
+    return dashboard.snapshot.summary
+
+def poll(stop, worst):
+    while not stop.is_set():
+        t = time.perf_counter()
+        ai_dashboard.get_dashboard()
+        worst[0] = max(worst[0], time.perf_counter() - t)
+        time.sleep(0.001)
+
+def run(label, store, data_dir, expected):
+    ai_dashboard.dashboard = AIDashboard()
+    stop, worst = threading.Event(), [0.0]
+    reader = threading.Thread(target=poll, args=(stop, worst))
+    reader.start()
+    ai_dashboard.start_rehydration(store, data_dir).join()
+    stop.set()
+    reader.join()
+    r = ai_dashboard.rehydration
+    match = ai_dashboard.dashboard.snapshot.summary == expected
+    print(f"  {label:<12} {r['alerts']:>6} alerts  read {r['read_ms']:7.1f} ms  apply {r['apply_ms']:6.1f} ms  "
+          f"total {r['total_ms']:7.1f} ms  within budget: {r['within_budget']}  "
+          f"summary matches: {match}  worst read {worst[0] * 1e3:.2f} ms")
+    return match and r['within_budget']
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    now = time.time()
+    history = make_history(n, now)
+    expected = reference_summary(history, now)
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        store = write_sources(history, tmp)
+        print(f"{n} alerts over {REHYDRATE_WINDOW * 1.5 / 3600:.0f} h; reading the newest {REHYDRATE_LIMIT} "
+              f"of the last {REHYDRATE_WINDOW / 3600:.0f} h, budget {REHYDRATE_BUDGET * 1e3:.0f} ms")
+        ok &= run("alert store", store, None, expected)
+        ok &= run("alert files", None, tmp, expected)
+        store.close()
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
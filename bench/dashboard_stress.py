@@ -0,0 +1,111 @@
+# bench/dashboard_stress.py
+"""Dashboard snapshots under concurrent readers and a fast alert writer.
+
+One thread feeds encoded alerts into an in-memory bus as if they came from
+the broker (decoded once, then applied by the dashboard's subscriber
+thread) as fast as it can while reader threads poll
+``get_dashboard``/``get_ai_insights`` and serialize the result, as the API
+handlers do.  Every read checks that its snapshot is self-consistent and
+that versions never go backwards; any exception or mismatch is an error.
+
+    PYTHONPATH=. python bench/dashboard_stress.py [readers] [seconds]
+"""
+import json
+import random
+import sys
+import threading
+import time
+
+from hub import telemetry
+from hub.ai_dashboard import ai_dashboard, opens_episode
+from hub.bus import Bus
+
+DEVICES = [f"scope{i}" for i in range(16)]
+TYPES = ("ai_anomaly", "maintenance_recommendation", "correlation_discovery", "periodic_interference")
+
+def make_alert(i, rng):
+    kind = rng.choice(TYPES)
+    alert = {"type": kind, "device": rng.choice(DEVICES), "ts": time.time(), "seq": i}
+    if kind == "maintenance_recommendation":
+        alert["health_score"] = rng.random()
+        alert["recommendations"] = ["check probe"]
+    elif kind == "correlation_discovery":
+        alert["correlations"] = [{"pair": ["scope0", "scope1"], "strength": rng.choice(("strong", "weak"))}]
+    return alert
+
+def writer(bus, stop, counts):
+    rng = random.Random(1)
+    i = 0
+    while not stop.is_set():
+        bus.receive("lab/alerts", telemetry.dumps(make_alert(i, rng)))
+        i += 1
+    counts["writes"] = i
+
+def check(snapshot):
+    summary = snapshot.summary
+    if summary["total_alerts"] != len(snapshot.alerts):
+        return "summary total_alerts disagrees with the alert window"
+    anomalies = sum(1 for a in snapshot.alerts if a["type"] == "ai_anomaly" and opens_episode(a))
+    if summary["ai_anomalies"] != anomalies:
+        return "summary ai_anomalies disagrees with the alert window"
+    if summary["devices_monitored"] != len(snapshot.device_health):
+        return "summary devices_monitored disagrees with device_health"
+    if snapshot.data()["alerts"] != list(snapshot.alerts[-10:]):
+        return "dashboard data was built from a different version"
+    return None
+
+def reader(stop, results):
+    reads = errors = 0
+    last_version = -1
+    first_error = None
+    while not stop.is_set():
+        try:
+            snapshot = ai_dashboard.dashboard.snapshot
+            problem = check(snapshot)
+            if problem is None and snapshot.version < last_version:
+                problem = f"version went backwards ({last_version} -> {snapshot.version})"
+            last_version = snapshot.version
+            json.dumps(ai_dashboard.get_dashboard())
+            json.dumps(ai_dashboard.get_ai_insights())
+        except Exception as e:
+            problem = f"{type(e).__name__}: {e}"
+        reads += 1
+        if problem is not None:
+            errors += 1
+            first_error = first_error or problem
+    results.append((reads, errors, first_error))
+
+def main():
+    n_readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    bus = Bus()
+    ai_dashboard.start(bus)
+    stop = threading.Event()
+    counts, results = {}, []
+    threads = [threading.Thread(target=writer, args=(bus, stop, counts))]
+    threads += [threading.Thread(target=reader, args=(stop, results)) for _ in range(n_readers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    bus.flush()
+    elapsed = time.perf_counter() - start
+
+    reads = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    print(f"{n_readers} readers, {elapsed:.1f} s")
+    print(f"  writes: {counts['writes']:>9} ({counts['writes'] / elapsed:,.0f}/s), "
+          f"final version {ai_dashboard.dashboard.version}")
+    print(f"  reads:  {reads:>9} ({reads / elapsed:,.0f}/s)")
+    print(f"  errors: {errors:>9}")
+    for _, _, problem in results:
+        if problem:
+            print(f"    e.g. {problem}")
+            break
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# bench/session_load.py
+"""Many assistant sessions: memory stays bounded, persisted sessions survive a restart.
+
+Drives ``LabAssistantAPI.achat`` (demo mode, no LLM) for ``sessions``
+sessions of ``turns`` turns each, every message a pasted log of about
+``size`` bytes, with up to 64 chats in flight.  Each mode runs in a fresh
+interpreter and reports resident memory as the sessions accumulate:
+
+- unbounded: no practical session or memory cap (the old behaviour of
+  keeping every conversation)
+- capped: the default store with a ``cap`` MB history budget
+- persisted: the same cap with SQLite behind it; afterwards a new store on
+  the same file must find a sample of the evicted sessions intact
+
+    PYTHONPATH=. python bench/session_load.py [sessions] [turns] [size] [cap]
+"""
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+async def drive(api, n_sessions, turns, size, ids, report):
+    rng = random.Random(1)
+    line = "2026-10-18 12:00:00 scope1 ERR sample overflow at channel 2\n"
+    slots = asyncio.Semaphore(64)
+
+    async def one(i):
+        async with slots:
+            session = api.session()
+            ids.append(session.id)
+            for t in range(turns):
+                paste = line * (size // len(line))
+                await api.achat(f"Session {i} turn {t}, here is the log:\n{paste}{rng.random()}", session)
+
+    step = max(n_sessions // 5, 1)
+    for start in range(0, n_sessions, step):
+        await asyncio.gather(*(one(i) for i in range(start, min(start + step, n_sessions))))
+        report(start + step)
+
+def run(mode, n_sessions, turns, size, cap_mb):
+    import contextlib
+    import io
+    from hub.sessions import SessionStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.db") if mode == "persisted" else None
+        with contextlib.redirect_stdout(io.StringIO()):  # the demo-mode banner
+            from hub.lab_assistant import LabAssistantAPI
+            api = LabAssistantAPI()
+        if mode == "unbounded":
+            api.sessions = SessionStore(max_sessions=10 ** 9, max_bytes=10 ** 15, path=None)
+        else:
+            api.sessions = SessionStore(max_bytes=int(cap_mb * 1024 * 1024), path=path)
+        base = rss_mb()
+        ids = []
+        start = time.perf_counter()
+
+        def report(done):
+            m = api.sessions.metrics()
+            print(f"  {mode:<10} {min(done, n_sessions):>6} sessions  RSS +{rss_mb() - base:7.1f} MB  "
+                  f"in memory {m['sessions']:>6} ({m['memory_bytes'] / 2 ** 20:6.1f} MB counted)  "
+                  f"evicted {m['evicted']:>6}", flush=True)
+
+        asyncio.run(drive(api, n_sessions, turns, size, ids, report))
+        elapsed = time.perf_counter() - start
+        print(f"  {mode:<10} {n_sessions * turns / elapsed:,.0f} chats/s")
+
+        ok = True
+        if path:
+            api.sessions.close()
+            store = SessionStore(path=path)
+            sample = random.Random(2).sample(ids, min(200, len(ids)))
+            intact = sum(1 for sid in sample if len(store.get(sid).history) == turns)
+            ok = intact == len(sample)
+            print(f"  {mode:<10} after restart: {intact}/{len(sample)} sampled sessions intact "
+                  f"({store.metrics()['loaded']} loaded from SQLite)")
+            store.close()
+        if mode != "unbounded":
+            ok = ok and api.sessions.bytes <= cap_mb * 1024 * 1024
+        return ok
+
+def main():
+    n_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+    cap_mb = float(sys.argv[4]) if len(sys.argv) > 4 else 16.0
+    if len(sys.argv) < 6:
+        print(f"{n_sessions} sessions x {turns} turns of ~{size} B, cap {cap_mb:.0f} MB")
+        results = [subprocess.run([sys.executable, __file__, str(n_sessions), str(turns), str(size), str(cap_mb),
+                                   mode]).returncode for mode in ("unbounded", "capped", "persisted")]
+        sys.exit(max(results))
+    sys.exit(0 if run(sys.argv[5], n_sessions, turns, size, cap_mb) else 1)
+
+if __name__ == "__main__":
+    main()
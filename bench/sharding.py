@@ -0,0 +1,146 @@
+# bench/sharding.py
+"""Sharded analyzer: throughput vs. worker count, and rebalancing on worker restart.
+
+Routes archived payloads for synthetic devices through hub.supervisor
+without a broker; workers write alerts/state to a temporary directory and
+use the ``block`` overload policy so every record is analysed.  The
+rebalance run archives what it routes, as the saver would, and checks that
+after each move every device's owner has seen each of its records exactly
+once and no other worker still holds state for it.
+
+    PYTHONPATH=. python bench/sharding.py data/2025-08-13/scope1.ndjson [devices] [samples_per_device]
+"""
+import os
+import sys
+import tempfile
+import time
+
+# Measure full throughput: workers apply backpressure instead of shedding load
+os.environ.setdefault("ANALYZER_OVERLOAD", "block")
+
+from hub import telemetry
+from hub.archive import read_records
+from hub.supervisor import Supervisor
+
+def make_supervisor(n_workers, tmp):
+    return Supervisor(n_workers, data_dir=os.path.join(tmp, "archive"), alerts_dir=tmp,
+                      alerts_db=os.path.join(tmp, "alerts.db"), state_path=os.path.join(tmp, "state.bin"),
+                      summary_interval=0.5, restart_backoff=0.5)
+
+def processed(supervisor):
+    return sum(s.get('processed', 0) for s in list(supervisor.summaries.values()))
+
+def throughput(n_workers, payloads, tmp):
+    supervisor = make_supervisor(n_workers, tmp)
+    supervisor.start()
+    supervisor.wait_ready()
+    start = time.perf_counter()
+    for topic, payload in payloads:
+        supervisor.route(topic, payload)
+    while processed(supervisor) < len(payloads) and time.perf_counter() - start < 600:
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    supervisor.stop()
+    return len(payloads) / elapsed
+
+def archive_and_route(supervisor, tmp, records, devices):
+    """Append each record to its device's archive file (as the saver would), then route it"""
+    day = os.path.join(tmp, "archive", "bench")
+    os.makedirs(day, exist_ok=True)
+    files = {dev: open(os.path.join(day, f"{dev}.ndjson"), "ab") for dev in devices}
+    for d in records:
+        for dev in devices:
+            record = {k: v for k, v in d.items() if k != "device"}
+            files[dev].write(telemetry.dumps(dict(record, device=dev)) + b"\n")
+            files[dev].flush()
+            supervisor.route(f"lab/device/{dev}/telemetry", telemetry.dumps(record))
+    for f in files.values():
+        f.close()
+
+def settled(supervisor, devices, expected, timeout=120.0):
+    """Wait until every device's owner reports ``expected[dev]`` samples and every live worker
+    holds state for exactly the devices it owns; returns the problems left at the timeout"""
+    deadline = time.time() + timeout
+    while True:
+        owners = supervisor.assignment(devices)
+        problems = []
+        for worker_id in supervisor.ring.nodes:
+            summary = supervisor.summaries.get(worker_id, {})
+            owned = sorted(dev for dev in devices if owners[dev] == worker_id)
+            if summary.get('held') != owned:
+                problems.append(f"worker {worker_id} holds {summary.get('held')}, owns {owned}")
+            for dev in owned:
+                samples = summary.get('devices', {}).get(dev, {}).get('samples')
+                if samples != expected[dev]:
+                    problems.append(f"{dev} on worker {worker_id}: {samples} samples, expected {expected[dev]}")
+        if not problems or time.time() > deadline:
+            return problems
+        time.sleep(0.1)
+
+def report(stage, problems):
+    print(f"  {stage}: {'ok' if not problems else f'{len(problems)} problems, e.g. ' + problems[0]}")
+    return not problems
+
+def rebalance(devices, records, tmp):
+    """Stop a worker, route more, let it come back, route more: each device's owner must
+    report every record exactly once and no other worker may hold state for it"""
+    from hub.analyzer import WARMUP_RECORDS
+    supervisor = Supervisor(3, data_dir=os.path.join(tmp, "archive"), alerts_dir=tmp,
+                            alerts_db=os.path.join(tmp, "alerts.db"), state_path=os.path.join(tmp, "state.bin"),
+                            summary_interval=1.0, restart_backoff=0.5)
+    supervisor.start()
+    supervisor.wait_ready()
+    third = len(records) // 3
+    phases = [records[:third], records[third:2 * third], records[2 * third:]]
+    before = supervisor.assignment(devices)
+    victim = 0
+    ok = True
+
+    archive_and_route(supervisor, tmp, phases[0], devices)
+    ok &= report("before the stop", settled(supervisor, devices, {dev: len(phases[0]) for dev in devices}))
+
+    # A clean stop: the worker snapshots its state, so the replacement restores it (stale by then)
+    supervisor.workers[victim]['inbox'].put(None)
+    while victim in supervisor.ring.nodes:
+        time.sleep(0.05)
+    during = supervisor.assignment(devices)
+    moved = [d for d in devices if before[d] != during[d]]
+    print(f"stopped worker {victim}: moved {len(moved)}/{len(devices)} devices, "
+          f"all from worker {victim}: {all(before[d] == victim for d in moved)}, "
+          f"none left on it: {victim not in during.values()}")
+    archive_and_route(supervisor, tmp, phases[1], devices)
+    # Survivors catch moved devices up from the archive before their first live record
+    ok &= report("moved devices", settled(supervisor, devices, {
+        dev: (min(len(phases[0]), WARMUP_RECORDS) if dev in moved else len(phases[0])) + len(phases[1])
+        for dev in devices}))
+
+    supervisor.wait_ready()
+    after = supervisor.assignment(devices)
+    print(f"worker {victim} restarted ({supervisor.workers[victim]['restarts']} restart): "
+          f"assignment restored: {after == before}")
+    archive_and_route(supervisor, tmp, phases[2], devices)
+    # The restarted worker's snapshot has the first phase; the second comes from the archive
+    ok &= report("devices moved back", settled(supervisor, devices, {
+        dev: (len(phases[0]) + min(len(phases[1]), WARMUP_RECORDS) if dev in moved
+              else len(phases[0]) + len(phases[1])) + len(phases[2])
+        for dev in devices}))
+    supervisor.stop()
+    return ok
+
+def main(path, n_devices=16, per_device=300):
+    records = list(read_records([path]))[:per_device]
+    devices = [f"dev{i:02d}" for i in range(n_devices)]
+    payloads = []
+    for d in records:
+        for dev in devices:
+            payloads.append((f"lab/device/{dev}/telemetry", telemetry.dumps({k: v for k, v in d.items() if k != "device"})))
+    print(f"{len(payloads)} payloads from {n_devices} devices, {os.cpu_count()} CPUs")
+    for n_workers in (1, 2, 4):
+        with tempfile.TemporaryDirectory() as tmp:
+            print(f"{n_workers} worker(s): {throughput(n_workers, payloads, tmp):,.0f} records/s")
+    with tempfile.TemporaryDirectory() as tmp:
+        ok = rebalance(devices, records, tmp)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main(sys.argv[1], *(int(a) for a in sys.argv[2:4]))
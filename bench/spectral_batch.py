@@ -0,0 +1,38 @@
+# bench/spectral_batch.py
+"""Cost of one SpectralMonitor pass vs. series count, against a per-series FFT loop.
+
+    PYTHONPATH=. python bench/spectral_batch.py
+"""
+import time
+
+import numpy as np
+
+from hub.spectral import SpectralMonitor
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(window=128):
+    rng = np.random.default_rng(0)
+    taper = np.hanning(window)
+    print(f"window {window}")
+    for series in (10, 100, 1000, 5000):
+        monitor = SpectralMonitor(window=window)
+        ids = np.arange(4)
+        for dev in range(series // 4):
+            for i, row in enumerate(rng.normal(size=(window, 4))):
+                monitor.append(f"dev{dev}", ids, row, float(i))
+        snapshot = monitor.snapshot()
+        batched = timed(lambda: monitor.analyze(snapshot))
+        looped = timed(lambda: [np.abs(np.fft.rfft((v - v.mean()) * taper)) ** 2 for v in snapshot['values']])
+        n = len(snapshot['keys'])
+        print(f"{n:>5} series  analyze {batched * 1e3:>8.2f} ms ({batched / n * 1e6:>6.1f} us/series)   "
+              f"FFT-only loop {looped * 1e3:>8.2f} ms ({looped / n * 1e6:>6.1f} us/series)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# bench/startup.py
+"""API cold start: ``import hub.api`` time and time until uvicorn answers.
+
+Each measurement runs in a fresh interpreter.  Also lists the slowest
+top-level imports (from ``-X importtime``) so regressions point at a module.
+
+    PYTHONPATH=. python bench/startup.py [runs]
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import hub.api; print(time.perf_counter() - t)"
+
+def child_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (os.getcwd(), env.get("PYTHONPATH")) if p)
+    return env
+
+def import_time() -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], capture_output=True, text=True,
+                         env=child_env(), check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def slowest_imports(n=8):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import hub.api"], capture_output=True,
+                         text=True, env=child_env(), check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:  # imported directly by hub.api
+            rows.append((int(parts[1]), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def time_to_first_response(timeout=60.0) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "hub.api:app", "--port", str(port),
+                             "--log-level", "warning"], env=child_env(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ai/dashboard", timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError("server did not answer")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    imports = [import_time() for _ in range(runs)]
+    served = [time_to_first_response() for _ in range(runs)]
+    print(f"import hub.api:        median {statistics.median(imports) * 1e3:7.0f} ms  "
+          f"(min {min(imports) * 1e3:.0f}, max {max(imports) * 1e3:.0f}, {runs} runs)")
+    print(f"first HTTP response:   median {statistics.median(served) * 1e3:7.0f} ms  "
+          f"(min {min(served) * 1e3:.0f}, max {max(served) * 1e3:.0f}, includes interpreter start)")
+    print("slowest imports under hub.api (cumulative):")
+    for us, name in slowest_imports():
+        print(f"  {us / 1e3:7.1f} ms  {name}")
+
+if __name__ == "__main__":
+    main()
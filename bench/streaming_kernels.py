@@ -0,0 +1,105 @@
+# bench/streaming_kernels.py
+"""Microbenchmarks for hub/streaming.py kernels vs. per-sample window rescans,
+and for DeviceStats against the per-metric OnlineStats objects it replaced.
+
+    PYTHONPATH=. python bench/streaming_kernels.py [n_samples]
+"""
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+from hub.metric_state import VECTOR_METRICS, DeviceStats
+from hub.streaming import Cusum, EWMAVariance, P2Quantile, PageHinkley, WindowedSlope
+
+def bench(name, fn, xs):
+    start = time.perf_counter()
+    for x in xs:
+        fn(x)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<34} {elapsed / len(xs) * 1e9:>10.0f} ns/update")
+
+def rescan(window, reducer):
+    buf = deque(maxlen=window)
+
+    def update(x):
+        buf.append(x)
+        return reducer(np.fromiter(buf, float, len(buf))) if len(buf) > 1 else 0.0
+    return update
+
+class OnlineStats:
+    """Baseline: the analyzer's former per-metric stats (Welford, EMA, endpoint slope)
+    plus the correlator's raw-value deque"""
+
+    def __init__(self, ema_alpha=0.2, slope_window=30, raw_window=50):
+        self.n = 0
+        self.mean = 0.0
+        self.M2 = 0.0
+        self.ema = None
+        self.alpha = ema_alpha
+        self.hist = deque(maxlen=slope_window)
+        self.raw = deque(maxlen=raw_window)
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.M2 += delta * (x - self.mean)
+        self.ema = x if self.ema is None else (self.alpha * x + (1 - self.alpha) * self.ema)
+        self.hist.append(self.ema)
+        self.raw.append(x)
+
+    @property
+    def std(self):
+        return (self.M2 / (self.n - 1)) ** 0.5 if self.n > 1 else 0.0
+
+    def slope(self):
+        if len(self.hist) < 2:
+            return 0.0
+        return (self.hist[-1] - self.hist[0]) / (len(self.hist) - 1)
+
+def per_sample(name, channels, rows, fn):
+    start = time.perf_counter()
+    for row in rows:
+        fn(row)
+    elapsed = time.perf_counter() - start
+    per = elapsed / len(rows)
+    print(f"  {name:<22} {per * 1e6:>8.1f} us/sample {per / channels * 1e9:>8.0f} ns/metric")
+    return per
+
+def main(n=50_000):
+    xs = (np.random.default_rng(0).normal(size=n) + np.linspace(0, 5, n)).tolist()
+    x_idx = np.arange(30)
+
+    print(f"{n} samples, window 30")
+    bench("WindowedSlope", WindowedSlope(30).update, xs)
+    bench("  rescan: np.polyfit", rescan(30, lambda a: np.polyfit(x_idx[:len(a)], a, 1)[0]), xs)
+    bench("EWMAVariance", EWMAVariance(0.05).update, xs)
+    bench("P2Quantile(0.99)", P2Quantile(0.99).update, xs)
+    bench("  rescan: np.quantile", rescan(30, lambda a: np.quantile(a, 0.99)), xs)
+    bench("PageHinkley", PageHinkley().update, xs)
+    bench("Cusum", Cusum().update, xs)
+
+    # One sample's update, std and slope for every metric of a device: the per-metric
+    # objects the analyzer used to keep, and DeviceStats forced onto each of its paths
+    print(f"\nper device sample (update + std + slope), {n // 10} samples; "
+          f"DeviceStats vectorizes above {VECTOR_METRICS} metrics")
+    for channels in (1, 2, 4, 8, 16, 32, 48, 128):
+        ids = np.arange(1000, 1000 + channels)  # high global ids: rows stay per device
+        rows = np.random.default_rng(1).normal(size=(n // 10, channels))
+        print(f"{channels} metrics")
+        objs = [OnlineStats() for _ in range(channels)]
+
+        def baseline(row):
+            for s, x in zip(objs, row.tolist()):
+                s.update(x)
+                s.std, s.slope()
+        base = per_sample("baseline OnlineStats", channels, rows, baseline)
+        for label, vector_min in (("DeviceStats per-metric", 10 ** 9), ("DeviceStats NumPy", 0)):
+            ds = DeviceStats(vector_min=vector_min)
+            per = per_sample(label, channels, rows, lambda row: ds.update(ids, row))
+            print(f"  {'':<22} {base / per:>8.2f}x baseline, {ds.nbytes / channels:.0f} B/metric")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
@@ -0,0 +1,59 @@
+# bench/tiered_detection.py
+"""Tiered vs. full-forest anomaly detection on an archive with injected faults.
+
+Replays one device's NDJSON through two IntelligentAnomalyDetector instances
+(training inline), injecting spikes and level shifts at known positions, and
+reports forest calls, time per sample, event recall and the flag rate on
+clean samples for each mode.
+
+    PYTHONPATH=. python bench/tiered_detection.py data/2025-08-13/scope1.ndjson [n_events]
+"""
+import sys
+import time
+
+import numpy as np
+
+from hub import archive
+from hub.analyzer import IntelligentAnomalyDetector
+from hub.metric_state import RESERVED_FIELDS
+
+def inject(records, n_events, seed=0):
+    """Copies of ``records`` with spike (1 sample) and level-shift (20 samples) faults"""
+    rng = np.random.default_rng(seed)
+    records = [dict(r) for r in records]
+    metrics = [k for k, v in records[0].items() if k not in RESERVED_FIELDS and isinstance(v, float)]
+    spread = {m: np.std([r[m] for r in records]) for m in metrics}
+    starts = np.sort(rng.choice(np.arange(300, len(records) - 40, 40), n_events, replace=False))
+    events = []
+    for i, start in enumerate(starts):
+        metric = metrics[i % len(metrics)]
+        length = 1 if i % 2 == 0 else 20
+        for r in records[start:start + length]:
+            r[metric] += 6 * spread[metric]
+        events.append((int(start), int(start) + length))
+    return records, events
+
+def run(detector, records, events):
+    flagged = np.zeros(len(records), dtype=bool)
+    start = time.perf_counter()
+    for i, d in enumerate(records):
+        flagged[i] = detector.detect_anomaly(d)[0]
+    elapsed = time.perf_counter() - start
+    in_event = np.zeros(len(records), dtype=bool)
+    for a, b in events:
+        in_event[a:b] = True
+    recall = np.mean([flagged[a:b].any() for a, b in events])
+    metrics = detector.tier_metrics()
+    print(f"{metrics['mode']:<7} forest calls {metrics['model_calls']:>5}/{metrics['samples']:<5} "
+          f"{elapsed / len(records) * 1e6:>8.0f} us/sample  event recall {recall:.2f}  "
+          f"clean flag rate {flagged[~in_event].mean():.3f}  screens {metrics['by_screen']}")
+
+def main(path, n_events=40):
+    records = list(archive.read_records([path]))
+    records, events = inject(records, n_events)
+    print(f"{len(records)} samples, {len(events)} injected events")
+    run(IntelligentAnomalyDetector(), records, events)
+    run(IntelligentAnomalyDetector(tiered=True), records, events)
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 40)
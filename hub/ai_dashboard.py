@@ -1,70 +1,208 @@
 # hub/ai_dashboard.py
-import json
+import os
+import threading
 import time
 from collections import defaultdict, deque
-import paho.mqtt.client as mqtt
+from types import MappingProxyType
 from typing import Dict, List, Optional
+from . import archive
+from .alert_histogram import AlertHistogram
+from .bus import Bus, MqttTransport
+
+BROKER = os.getenv("MQTT_BROKER", "localhost")
+PORT = int(os.getenv("MQTT_PORT", "1883"))
+INSIGHTS_BUCKET = 60.0  # seconds; time-relative insight fields are recomputed at most this often
+# Startup rehydration: how far back to read alert history, how much of it, and how long to spend
+REHYDRATE_WINDOW = 24 * 3600.0  # the span of the hour histogram
+REHYDRATE_LIMIT = 5000
+REHYDRATE_BUDGET = float(os.getenv("DASHBOARD_REHYDRATE_BUDGET", "2.0"))  # seconds
+
+def opens_episode(alert) -> bool:
+    """True for a plain alert or the first record of a coalesced episode (not its updates or close)"""
+    return alert.get('state') in (None, 'open')
+
+class DashboardSnapshot:
+    """Immutable dashboard state at one version.
+
+    Published by the single writer as one reference assignment; readers on
+    any thread take a reference and never see a partial update.
+    """
+    
+    __slots__ = ("version", "alerts", "device_health", "correlations", "anomaly_stats", "summary", "histogram",
+                 "_data")
+    
+    def __init__(self, version, alerts, device_health, correlations, anomaly_stats, summary, histogram):
+        self.version = version
+        self.alerts = alerts                # tuple, oldest first
+        self.device_health = device_health  # read-only mapping of never-mutated dicts
+        self.correlations = correlations
+        self.anomaly_stats = anomaly_stats
+        self.summary = summary
+        self.histogram = histogram          # AlertHistogram copy, never recorded into
+        self._data = None
+    
+    def data(self) -> Dict:
+        """API view of this version, built on first use (racing readers build identical dicts)"""
+        data = self._data
+        if data is None:
+            data = {
+                'alerts': list(self.alerts[-10:]),  # Last 10 alerts
+                'device_health': dict(self.device_health),
+                'correlations': self.correlations,
+                'anomaly_stats': dict(self.anomaly_stats),
+                'summary': self.summary
+            }
+            self._data = data
+        return data
+    
+    def trends(self, now: Optional[float] = None) -> Dict:
+        """Rates, trend slopes and peak hour from this version's episode histograms (O(buckets))"""
+        now = time.time() if now is None else now
+        histogram = self.histogram
+        busiest = histogram.busiest(now)
+        return {
+            'alerts_last_hour': int(histogram.minutes(now).sum()),
+            'alert_rate_per_hour': histogram.rate(now),
+            'alert_trend': histogram.trend(now),
+            'anomaly_rate_per_hour': histogram.rate(now, alert_type='ai_anomaly'),
+            'anomaly_trend': histogram.trend(now, alert_type='ai_anomaly'),
+            'peak_hour': histogram.peak_hour(now),
+            'busiest_device': busiest[0] if busiest else None
+        }
 
 class AIDashboard:
-    """Real-time AI insights dashboard"""
+    """Real-time AI insights dashboard.
+
+    The mutable fields set in ``_reset`` belong to the writer (``add_alert``
+    and ``rehydrate``, serialized by ``_write_lock``); every other thread reads ``snapshot``, a copy-on-write
+    DashboardSnapshot replaced after each alert.
+    """
     
     def __init__(self):
+        self._write_lock = threading.Lock()
+        self._reset()
+        self.snapshot = self._publish(0)
+    
+    def _reset(self):
         self.alerts = deque(maxlen=100)  # Last 100 alerts
-        self.device_health = defaultdict(dict)
+        self.device_health = {}
         self.correlations = []
-        self.anomaly_stats = defaultdict(lambda: {'count': 0, 'last_seen': None})
+        self.anomaly_stats = {}  # device -> {'count', 'last_seen'}; entries replaced, never mutated
         self.maintenance_schedule = defaultdict(dict)
+        # Maintained by add_alert so reads never rescan the alert window
+        self.type_counts = defaultdict(int)    # alert type -> episodes opened in the window
+        self.device_counts = defaultdict(int)  # device -> episodes opened in the window
+        self._health_sum = 0.0
+        self._critical = 0
+        self.histogram = AlertHistogram()  # minute/hour episode counts per (device, type)
+        self._published_histogram = None   # copy readers query; replaced when an episode is recorded
+    
+    @property
+    def version(self):
+        return self.snapshot.version
+    
+    def _count(self, alert, delta):
+        if not opens_episode(alert):
+            return
+        self.type_counts[alert.get('type')] += delta
+        if 'device' in alert:
+            self.device_counts[alert['device']] += delta
+    
+    def _set_health(self, device, health):
+        previous = self.device_health.get(device)
+        if previous is not None:
+            score = previous.get('health_score', 1.0)
+            self._health_sum -= score
+            self._critical -= score < 0.5
+        score = health.get('health_score', 1.0)
+        self._health_sum += score
+        self._critical += score < 0.5
+        self.device_health[device] = health
         
     def add_alert(self, alert):
-        """Add new alert to dashboard"""
+        """Add new alert to dashboard and publish the next snapshot"""
+        with self._write_lock:
+            self._apply(alert)
+            self.snapshot = self._publish(self.snapshot.version + 1)
+    
+    def rehydrate(self, history: List[Dict]) -> int:
+        """Rebuild state from history (oldest first) beneath the alerts that arrived live meanwhile.
+
+        History at or after the first live alert is dropped as already seen.
+        Returns the number of history alerts applied.
+        """
+        history = [a for a in history if isinstance(a.get('type'), str)]
+        with self._write_lock:
+            live = list(self.alerts)
+            if live:
+                cutoff = live[0].get('ts')
+                if isinstance(cutoff, (int, float)):
+                    history = [a for a in history if a.get('ts', 0.0) < cutoff]
+            self._reset()
+            for alert in history:
+                self._apply(alert)
+            for alert in live:
+                self._apply(alert)
+            self.snapshot = self._publish(self.snapshot.version + 1)
+        return len(history)
+    
+    def _apply(self, alert):
+        ts = alert.get('ts')
+        if not isinstance(ts, (int, float)):
+            ts = time.time()
+        if len(self.alerts) == self.alerts.maxlen:
+            self._count(self.alerts[0], -1)  # about to fall out of the window
         self.alerts.append(alert)
+        self._count(alert, 1)
+        if opens_episode(alert):
+            self.histogram.record(alert.get('device'), alert['type'], ts)
+            self._published_histogram = None
         
         # Update device health
         if 'device' in alert:
             device = alert['device']
             if alert['type'] == 'maintenance_recommendation':
-                self.device_health[device] = {
+                self._set_health(device, {
                     'health_score': alert.get('health_score', 1.0),
                     'recommendations': alert.get('recommendations', []),
-                    'last_updated': time.time()
-                }
-            elif alert['type'] == 'ai_anomaly':
-                self.anomaly_stats[device]['count'] += 1
-                self.anomaly_stats[device]['last_seen'] = time.time()
+                    'last_updated': ts
+                })
+            elif alert['type'] == 'ai_anomaly' and opens_episode(alert):
+                # Coalesced alerts: count each anomaly episode once
+                previous = self.anomaly_stats.get(device, {'count': 0})
+                self.anomaly_stats[device] = {'count': previous['count'] + 1, 'last_seen': ts}
         
         # Update correlations
         if alert['type'] == 'correlation_discovery':
             self.correlations = alert.get('correlations', [])
     
+    def _publish(self, version) -> DashboardSnapshot:
+        if self._published_histogram is None:
+            # Copied only when an episode was recorded; updates to open episodes share the last copy
+            self._published_histogram = self.histogram.copy()
+        return DashboardSnapshot(version, tuple(self.alerts), MappingProxyType(dict(self.device_health)),
+                                 self.correlations, MappingProxyType(dict(self.anomaly_stats)),
+                                 self._generate_summary(), self._published_histogram)
+    
+    def alert_trends(self, now: Optional[float] = None) -> Dict:
+        """Rates, trend slopes and peak hour of the current snapshot (no lock)"""
+        return self.snapshot.trends(now)
+    
     def get_dashboard_data(self) -> Dict:
-        """Get current dashboard data"""
-        return {
-            'alerts': list(self.alerts)[-10:],  # Last 10 alerts
-            'device_health': dict(self.device_health),
-            'correlations': self.correlations,
-            'anomaly_stats': dict(self.anomaly_stats),
-            'summary': self._generate_summary()
-        }
+        """Get current dashboard data (built once per snapshot)"""
+        return self.snapshot.data()
     
     def _generate_summary(self) -> Dict:
-        """Generate AI insights summary"""
-        total_alerts = len(self.alerts)
-        ai_anomalies = sum(1 for a in self.alerts if a.get('type') == 'ai_anomaly')
-        maintenance_alerts = sum(1 for a in self.alerts if a.get('type') == 'maintenance_recommendation')
-        correlation_discoveries = sum(1 for a in self.alerts if a.get('type') == 'correlation_discovery')
-        
-        # Calculate average health score
-        health_scores = [h.get('health_score', 1.0) for h in self.device_health.values()]
-        avg_health = sum(health_scores) / len(health_scores) if health_scores else 1.0
-        
+        """Generate AI insights summary from the running counters"""
+        devices = len(self.device_health)
         return {
-            'total_alerts': total_alerts,
-            'ai_anomalies': ai_anomalies,
-            'maintenance_alerts': maintenance_alerts,
-            'correlation_discoveries': correlation_discoveries,
-            'average_device_health': avg_health,
-            'devices_monitored': len(self.device_health),
-            'critical_issues': sum(1 for h in self.device_health.values() if h.get('health_score', 1.0) < 0.5)
+            'total_alerts': len(self.alerts),
+            'ai_anomalies': self.type_counts['ai_anomaly'],
+            'maintenance_alerts': self.type_counts['maintenance_recommendation'],
+            'correlation_discoveries': self.type_counts['correlation_discovery'],
+            'average_device_health': self._health_sum / devices if devices else 1.0,
+            'devices_monitored': devices,
+            'critical_issues': self._critical
         }
 
 class AIDashboardAPI:
@@ -72,46 +210,115 @@ class AIDashboardAPI:
     
     def __init__(self):
         self.dashboard = AIDashboard()
-        self.mqtt_client = None
-        self._setup_mqtt()
+        self._insights = (None, None)  # ((version, time bucket), insights)
+        self.rehydration = {'state': 'pending'}
+        self.bus = None
+        self._subscription = None
+        self._own_bus = False
     
-    def _setup_mqtt(self):
-        """Setup MQTT client to receive alerts"""
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_client.on_connect = self._on_connect
-        self.mqtt_client.on_message = self._on_message
-        
-        try:
-            self.mqtt_client.connect("localhost", 1883, 60)
-            self.mqtt_client.loop_start()
-        except Exception as e:
-            print(f"[AI Dashboard] MQTT connection failed: {e}")
+    def start(self, bus: Optional[Bus] = None):
+        """Begin receiving alerts from ``bus``, or from the broker on a bus of our own.
+
+        The MQTT connect (and any retries) runs on paho's network thread.
+        """
+        if self._subscription is not None:
+            return
+        self._own_bus = bus is None
+        self.bus = Bus(MqttTransport(BROKER, PORT)) if bus is None else bus
+        # Alert rates are low and every alert moves the counters, so back-pressure rather than shed
+        self._subscription = self.bus.subscribe("lab/alerts", self._on_alert, block=True)
     
-    def _on_connect(self, client, userdata, flags, rc):
-        print("[AI Dashboard] Connected to MQTT")
-        client.subscribe("lab/alerts")
+    def stop(self):
+        if self._subscription is None:
+            return
+        self.bus.unsubscribe(self._subscription)
+        if self._own_bus:
+            self.bus.close()
+        self.bus = self._subscription = None
     
-    def _on_message(self, client, userdata, msg):
+    def start_rehydration(self, store=None, data_dir: Optional[str] = "data") -> threading.Thread:
+        """Rebuild the dashboard from recent alert history on a background thread.
+
+        Requests are served (from live alerts only) until it finishes.
+        """
+        thread = threading.Thread(target=self._rehydrate, args=(store, data_dir),
+                                  name="dashboard-rehydrate", daemon=True)
+        thread.start()
+        return thread
+    
+    def _rehydrate(self, store, data_dir):
+        start = time.perf_counter()
+        deadline = start + REHYDRATE_BUDGET
+        self.rehydration = {'state': 'running'}
         try:
-            alert = json.loads(msg.payload.decode("utf-8"))
-            self.dashboard.add_alert(alert)
+            history, source = self._read_history(store, data_dir, deadline)
+            read = time.perf_counter()
+            applied = self.dashboard.rehydrate(history)
         except Exception as e:
-            print(f"[AI Dashboard] Error processing alert: {e}")
+            print(f"[AI Dashboard] Rehydration failed: {e}")
+            self.rehydration = {'state': 'failed', 'error': str(e)}
+            return
+        done = time.perf_counter()
+        self.rehydration = {
+            'state': 'done', 'source': source, 'alerts': applied,
+            'read_ms': (read - start) * 1e3, 'apply_ms': (done - read) * 1e3,
+            'total_ms': (done - start) * 1e3, 'budget_ms': REHYDRATE_BUDGET * 1e3,
+            'within_budget': done <= deadline
+        }
+        print(f"[AI Dashboard] Rehydrated {applied} alerts from {source} in {(done - start) * 1e3:.0f} ms"
+              + ("" if done <= deadline else f" (over the {REHYDRATE_BUDGET:.1f} s budget)"))
+    
+    def _read_history(self, store, data_dir, deadline):
+        """Newest REHYDRATE_LIMIT alerts of the last REHYDRATE_WINDOW, oldest first.
+
+        Pages the indexed store newest-first and stops at the deadline; falls
+        back to tailing the per-day NDJSON alert files.
+        """
+        since = time.time() - REHYDRATE_WINDOW
+        history = []
+        if store is not None:
+            cursor = None
+            while len(history) < REHYDRATE_LIMIT and time.perf_counter() < deadline:
+                page = store.query(since=since, limit=min(1000, REHYDRATE_LIMIT - len(history)), cursor=cursor)
+                history.extend(page['alerts'])
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+            if history:
+                history.reverse()
+                return history, 'alert store'
+        if data_dir:
+            return archive.tail_alerts(data_dir, REHYDRATE_LIMIT, since), 'alert files'
+        return [], 'nothing'
+    
+    def _on_alert(self, topic, alert):
+        # Alerts arrive decoded and validated (hub.telemetry.decode_alert)
+        self.dashboard.add_alert(alert)
     
     def get_dashboard(self):
         """Get dashboard data for API endpoint"""
         return self.dashboard.get_dashboard_data()
     
     def get_ai_insights(self):
-        """Get AI insights and recommendations"""
-        data = self.dashboard.get_dashboard_data()
+        """Get AI insights and recommendations.
+
+        Memoized on the dashboard version plus an INSIGHTS_BUCKET time bucket
+        (trends are relative to now), so polling between alerts is a lookup.
+        """
+        snapshot = self.dashboard.snapshot
+        key = (snapshot.version, int(time.time() // INSIGHTS_BUCKET))
+        cached_key, insights = self._insights
+        if cached_key == key:
+            return insights
+        data = snapshot.data()
         
         insights = {
             'system_health': self._assess_system_health(data),
             'recommendations': self._generate_recommendations(data),
-            'trends': self._analyze_trends(data),
+            'trends': self._analyze_trends(data, snapshot.trends()),
             'anomaly_analysis': self._analyze_anomalies(data)
         }
+        self._insights = (key, insights)
         
         return insights
     
@@ -172,22 +379,29 @@ class AIDashboardAPI:
         
         return recommendations
     
-    def _analyze_trends(self, data):
-        """Analyze trends in the data"""
-        recent_alerts = [a for a in data['alerts'] if time.time() - a.get('ts', 0) < 3600]  # Last hour
-        
+    def _analyze_trends(self, data, trends):
+        """Analyze trends from the alert histograms"""
         trend_analysis = {
-            'alert_frequency': len(recent_alerts),
-            'anomaly_trend': 'increasing' if len(recent_alerts) > 5 else 'stable',
-            'most_active_device': self._get_most_active_device(data),
-            'peak_activity_time': self._get_peak_activity_time(data)
+            'alert_frequency': trends['alerts_last_hour'],
+            'alert_rate_per_hour': trends['alert_rate_per_hour'],
+            'alert_trend_per_hour': trends['alert_trend'],
+            'anomaly_rate_per_hour': trends['anomaly_rate_per_hour'],
+            'anomaly_trend': self._classify_trend(trends['anomaly_rate_per_hour'], trends['anomaly_trend']),
+            'most_active_device': trends['busiest_device'] or self._get_most_active_device(data),
+            'peak_activity_time': self._get_peak_activity_time(trends['peak_hour'])
         }
         
         return trend_analysis
     
+    def _classify_trend(self, rate, slope):
+        """Call a trend only when the hourly rate moves by a quarter of itself (and at least 1/h) per hour"""
+        if abs(slope) < max(1.0, 0.25 * rate):
+            return 'stable'
+        return 'increasing' if slope > 0 else 'decreasing'
+    
     def _analyze_anomalies(self, data):
-        """Analyze anomaly patterns"""
-        ai_anomalies = [a for a in data['alerts'] if a.get('type') == 'ai_anomaly']
+        """Analyze anomaly patterns (one per episode, like the counters)"""
+        ai_anomalies = [a for a in data['alerts'] if a.get('type') == 'ai_anomaly' and opens_episode(a)]
         
         if not ai_anomalies:
             return {'pattern': 'no_anomalies', 'confidence': 'high'}
@@ -211,13 +425,12 @@ class AIDashboardAPI:
         return max(data['device_health'].keys(), 
                   key=lambda d: data['device_health'][d].get('last_updated', 0))
     
-    def _get_peak_activity_time(self, data):
-        """Get peak activity time from alerts"""
-        if not data['alerts']:
+    def _get_peak_activity_time(self, peak_hour):
+        """Local start of the busiest hour in the last day, e.g. '14:00'"""
+        if peak_hour is None:
             return None
         
-        # Simple analysis - could be enhanced with more sophisticated time analysis
-        return "recent" if any(time.time() - a.get('ts', 0) < 300 for a in data['alerts']) else "historical"
+        return time.strftime("%H:00", time.localtime(peak_hour['start']))
 
-# Global instance for API integration
+# Global instance for API integration; the API's lifespan handler starts it
 ai_dashboard = AIDashboardAPI()
@@ -0,0 +1,149 @@
+# hub/alert_coalescer.py
+from typing import Dict, List, Optional, Set, Tuple
+
+class AlertPolicy:
+    """Hysteresis and re-notification settings for one alert type.
+
+    An episode opens when the magnitude reaches ``open_at``, stays open while it
+    is at least ``close_at``, and closes after ``clear_samples`` consecutive
+    samples below ``close_at``.  While open, an ``ongoing`` update is emitted at
+    most every ``renotify`` seconds.
+    """
+
+    __slots__ = ("open_at", "close_at", "clear_samples", "renotify")
+
+    def __init__(self, open_at: float, close_at: float, clear_samples: int = 5, renotify: float = 300.0):
+        self.open_at = open_at
+        self.close_at = close_at
+        self.clear_samples = clear_samples
+        self.renotify = renotify
+
+DEFAULT_POLICIES = {
+    'drift': AlertPolicy(open_at=0.002, close_at=0.0015),               # |slope| per sample
+    'statistical_anomaly': AlertPolicy(open_at=3.0, close_at=2.0),      # z-score
+    'ai_anomaly': AlertPolicy(open_at=1e-9, close_at=1e-9, clear_samples=10),  # -score while flagged, else 0
+    # Spectral findings arrive once per spectral pass, not per sample
+    'periodic_interference': AlertPolicy(open_at=25.0, close_at=12.0, clear_samples=2),  # peak / median bin power
+    'mains_pickup': AlertPolicy(open_at=25.0, close_at=12.0, clear_samples=2),           # 50/60 Hz line / median
+    'noise_floor_change': AlertPolicy(open_at=4.0, close_at=2.0, clear_samples=2),       # floor vs baseline, either way
+}
+
+class Episode:
+    """One open alert episode for a (device, metric, type)"""
+
+    __slots__ = ("id", "device", "metric", "type", "started", "last_ts", "last_notified",
+                 "count", "peak", "clear_count", "detail")
+
+    def __init__(self, episode_id: str, device: str, metric: Optional[str], alert_type: str,
+                 ts: float, magnitude: float, detail: Dict):
+        self.id = episode_id
+        self.device = device
+        self.metric = metric
+        self.type = alert_type
+        self.started = ts
+        self.last_ts = ts
+        self.last_notified = ts
+        self.count = 1
+        self.peak = magnitude
+        self.clear_count = 0
+        self.detail = detail
+
+    def record(self, state: str, ts: float) -> Dict:
+        alert = dict(self.detail)
+        alert.update({
+            "ts": ts, "device": self.device, "type": self.type, "state": state,
+            "episode_id": self.id, "started": self.started, "duration": self.last_ts - self.started,
+            "count": self.count, "peak": self.peak
+        })
+        if self.metric is not None:
+            alert["metric"] = self.metric
+        return alert
+
+class AlertCoalescer:
+    """Turns per-sample detector hits into open/ongoing/closed episode records"""
+
+    def __init__(self, policies: Optional[Dict[str, AlertPolicy]] = None, stale_after: float = 600.0):
+        self.policies = dict(DEFAULT_POLICIES if policies is None else policies)
+        self.stale_after = stale_after
+        self.episodes: Dict[Tuple, Episode] = {}
+        self._active: Dict[Tuple[str, str], Set] = {}  # (device, type) -> metrics with open episodes
+        self.observed = 0
+        self.emitted = 0
+
+    def policy(self, alert_type: str) -> AlertPolicy:
+        return self.policies[alert_type]
+
+    def active(self, device: str, alert_type: str) -> Set:
+        """Metrics of a device with an open episode of this type"""
+        return self._active.get((device, alert_type), ())
+
+    def observe(self, device: str, metric: Optional[str], alert_type: str, ts: float,
+                magnitude: float, detail: Optional[Dict] = None) -> Optional[Dict]:
+        """Feed one sample's magnitude; returns a record to emit, if any"""
+        self.observed += 1
+        policy = self.policies[alert_type]
+        key = (device, metric, alert_type)
+        ep = self.episodes.get(key)
+        if ep is None:
+            if magnitude < policy.open_at:
+                return None
+            episode_id = f"{device}/{metric or '-'}/{alert_type}@{int(ts * 1000)}"
+            ep = Episode(episode_id, device, metric, alert_type, ts, magnitude, detail or {})
+            self.episodes[key] = ep
+            self._active.setdefault((device, alert_type), set()).add(metric)
+            return self._emit(ep.record("open", ts))
+
+        if magnitude >= policy.close_at:
+            ep.clear_count = 0
+            ep.last_ts = ts
+            if magnitude >= policy.open_at:
+                ep.count += 1
+            if magnitude > ep.peak:
+                ep.peak = magnitude
+                ep.detail = detail or ep.detail
+            if ts - ep.last_notified >= policy.renotify:
+                ep.last_notified = ts
+                return self._emit(ep.record("ongoing", ts))
+            return None
+
+        ep.clear_count += 1
+        if ep.clear_count >= policy.clear_samples:
+            return self._emit(self._close(key, ts))
+        return None
+
+    def sweep(self, now: float) -> List[Dict]:
+        """Close episodes whose device has gone quiet for ``stale_after`` seconds"""
+        stale = [key for key, ep in self.episodes.items() if now - ep.last_ts >= self.stale_after]
+        return [self._emit(self._close(key, now)) for key in stale]
+
+    def drop(self, device: str) -> int:
+        """Forget a device's episodes without closing them (it is analysed elsewhere now)"""
+        keys = [key for key in self.episodes if key[0] == device]
+        for key in keys:
+            ep = self.episodes.pop(key)
+            self._active[(ep.device, ep.type)].discard(ep.metric)
+        return len(keys)
+
+    def open_episodes(self) -> List[Dict]:
+        return [ep.record("ongoing", ep.last_ts) for ep in list(self.episodes.values())]
+
+    def get_state(self) -> List[Dict]:
+        return [{f: getattr(ep, f) for f in Episode.__slots__} for ep in self.episodes.values()]
+
+    def set_state(self, state: List[Dict]):
+        for fields in state:
+            ep = Episode(fields["id"], fields["device"], fields["metric"], fields["type"],
+                         fields["started"], fields["peak"], fields["detail"])
+            for f in Episode.__slots__:
+                setattr(ep, f, fields[f])
+            self.episodes[(ep.device, ep.metric, ep.type)] = ep
+            self._active.setdefault((ep.device, ep.type), set()).add(ep.metric)
+
+    def _close(self, key: Tuple, ts: float) -> Dict:
+        ep = self.episodes.pop(key)
+        self._active[(ep.device, ep.type)].discard(ep.metric)
+        return ep.record("closed", ts)
+
+    def _emit(self, record: Dict) -> Dict:
+        self.emitted += 1
+        return record
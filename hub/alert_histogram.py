@@ -0,0 +1,150 @@
+# hub/alert_histogram.py
+"""Minute and hour alert counts per (device, alert type).
+
+Each resolution is a ring of ``n`` fixed-width buckets per series, stored as
+one matrix (a row per series).  A slot remembers which absolute bucket it
+holds, so stale slots read as zero without ever being swept, and memory is
+``series x buckets`` however many alerts arrive.  Queries touch at most one
+ring's worth of buckets.
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+class BucketRing:
+    """``n`` buckets of ``width`` seconds per row, indexed by absolute bucket number"""
+
+    def __init__(self, width: float, n: int):
+        self.width = width
+        self.n = n
+        self.counts = np.zeros((0, n), dtype=np.int64)
+        self.stamps = np.full((0, n), -1, dtype=np.int64)  # absolute bucket held by each slot
+
+    def copy(self) -> "BucketRing":
+        ring = BucketRing.__new__(BucketRing)
+        ring.width, ring.n = self.width, self.n
+        ring.counts = self.counts.copy()
+        ring.stamps = self.stamps.copy()
+        return ring
+
+    def add_rows(self, extra: int):
+        self.counts = np.vstack([self.counts, np.zeros((extra, self.n), dtype=np.int64)])
+        self.stamps = np.vstack([self.stamps, np.full((extra, self.n), -1, dtype=np.int64)])
+
+    def add(self, row: int, ts: float, count: int = 1):
+        bucket = int(ts // self.width)
+        slot = bucket % self.n
+        held = self.stamps[row, slot]
+        if held > bucket:
+            return  # older than the ring reaches
+        if held < bucket:
+            self.stamps[row, slot] = bucket
+            self.counts[row, slot] = 0
+        self.counts[row, slot] += count
+
+    def window(self, rows: np.ndarray, now: float) -> np.ndarray:
+        """Counts per row for the n buckets ending with the current one, oldest first"""
+        current = int(now // self.width)
+        buckets = np.arange(current - self.n + 1, current + 1)
+        slots = buckets % self.n
+        live = self.stamps[np.ix_(rows, slots)] == buckets
+        return self.counts[np.ix_(rows, slots)] * live
+
+class AlertHistogram:
+    """Incremental alert histograms backing dashboard rates, trends and peak hours.
+
+    Not thread-safe on its own; the dashboard calls ``record`` under its
+    writer lock and queries a ``copy`` published with its snapshot.
+    """
+
+    def __init__(self, minutes: int = 60, hours: int = 24):
+        self.minute = BucketRing(60.0, minutes)
+        self.hour = BucketRing(3600.0, hours)
+        self.keys: List[Tuple[str, str]] = []          # row -> (device, type)
+        self.rows: Dict[Tuple[str, str], int] = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def copy(self) -> "AlertHistogram":
+        """Independent copy, for readers while the original keeps recording"""
+        histogram = AlertHistogram.__new__(AlertHistogram)
+        histogram.minute = self.minute.copy()
+        histogram.hour = self.hour.copy()
+        histogram.keys = list(self.keys)
+        histogram.rows = dict(self.rows)
+        return histogram
+
+    def record(self, device: Optional[str], alert_type: str, ts: float):
+        """Count one alert at its own timestamp (so replayed alerts land in the right bucket)"""
+        key = (device or "", alert_type)
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.keys)
+            self.keys.append(key)
+            self.minute.add_rows(1)
+            self.hour.add_rows(1)
+        self.minute.add(row, ts)
+        self.hour.add(row, ts)
+
+    def _select(self, device: Optional[str], alert_type: Optional[str]) -> np.ndarray:
+        return np.array([row for row, (d, t) in enumerate(self.keys)
+                         if (device is None or d == device) and (alert_type is None or t == alert_type)],
+                        dtype=np.intp)
+
+    def minutes(self, now: Optional[float] = None, device: Optional[str] = None,
+                alert_type: Optional[str] = None) -> np.ndarray:
+        """Per-minute counts across the minute ring, oldest first"""
+        rows = self._select(device, alert_type)
+        return self.minute.window(rows, time.time() if now is None else now).sum(axis=0)
+
+    def hours(self, now: Optional[float] = None, device: Optional[str] = None,
+              alert_type: Optional[str] = None) -> np.ndarray:
+        """Per-hour counts across the hour ring, oldest first"""
+        rows = self._select(device, alert_type)
+        return self.hour.window(rows, time.time() if now is None else now).sum(axis=0)
+
+    def rate(self, now: Optional[float] = None, device: Optional[str] = None,
+             alert_type: Optional[str] = None) -> float:
+        """Alerts per hour over the minute ring (the last hour by default)"""
+        counts = self.minutes(now, device, alert_type)
+        return float(counts.sum()) * 60.0 / self.minute.n
+
+    def trend(self, now: Optional[float] = None, device: Optional[str] = None,
+              alert_type: Optional[str] = None) -> float:
+        """Least-squares slope of the per-minute counts, as change in alerts/hour per hour.
+
+        The current minute is still filling, so only completed minutes are fitted.
+        """
+        counts = self.minutes(now, device, alert_type)[:-1].astype(float)
+        if len(counts) < 2:
+            return 0.0
+        x = np.arange(len(counts)) - (len(counts) - 1) / 2.0
+        slope = float((x * (counts - counts.mean())).sum() / (x * x).sum())  # alerts/min per minute
+        return slope * 3600.0
+
+    def peak_hour(self, now: Optional[float] = None, device: Optional[str] = None,
+                  alert_type: Optional[str] = None) -> Optional[Dict]:
+        """Busiest hour bucket in the hour ring: its start time and count, or None without alerts"""
+        now = time.time() if now is None else now
+        counts = self.hours(now, device, alert_type)
+        if not counts.any():
+            return None
+        i = int(counts.argmax())  # earliest of equal peaks
+        start = (int(now // self.hour.width) - self.hour.n + 1 + i) * self.hour.width
+        return {'start': start, 'count': int(counts[i])}
+
+    def busiest(self, now: Optional[float] = None, alert_type: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """(device, alerts in the last hour) for the device with the most, or None"""
+        rows = self._select(None, alert_type)
+        per_row = self.minute.window(rows, time.time() if now is None else now).sum(axis=1)
+        totals: Dict[str, int] = {}
+        for row, count in zip(rows, per_row):
+            device = self.keys[row][0]
+            if device and count:
+                totals[device] = totals.get(device, 0) + int(count)
+        if not totals:
+            return None
+        device = max(totals, key=totals.get)
+        return device, totals[device]
@@ -0,0 +1,126 @@
+# hub/alert_store.py
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+ALERTS_DB = os.path.join("data", "alerts.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id         INTEGER PRIMARY KEY,
+    ts         REAL NOT NULL,
+    device     TEXT,
+    metric     TEXT,
+    type       TEXT NOT NULL,
+    state      TEXT,
+    episode_id TEXT,
+    payload    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+CREATE INDEX IF NOT EXISTS alerts_device_ts ON alerts (device, ts);
+CREATE INDEX IF NOT EXISTS alerts_type_ts ON alerts (type, ts);
+"""
+
+def parse_cursor(cursor: str) -> Tuple[float, int]:
+    """Split a ``next_cursor`` into (ts, row id); ValueError if it isn't one"""
+    parts = cursor.split(":")
+    if len(parts) != 2:
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    try:
+        ts, row_id = float(parts[0]), int(parts[1])
+    except ValueError:
+        raise ValueError(f"invalid cursor: {cursor!r}") from None
+    if not math.isfinite(ts):
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    return ts, row_id
+
+class AlertStore:
+    """Indexed local alert history (SQLite in WAL mode).
+
+    Writers call ``add()``, which buffers; rows are inserted in one
+    transaction per ``flush()`` (or when ``batch_size`` is reached).
+    Readers page newest-first with a keyset cursor, so every page is an
+    index range scan regardless of how deep it is.
+    """
+
+    def __init__(self, path: str = ALERTS_DB, batch_size: int = 200):
+        self.path = path
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+
+    def add(self, alert: Dict):
+        """Queue an alert for the next batched insert"""
+        row = (alert.get("ts", time.time()), alert.get("device"), alert.get("metric"), alert.get("type", "unknown"),
+               alert.get("state"), alert.get("episode_id"), json.dumps(alert))
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Insert all queued alerts in one transaction; returns rows written"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO alerts (ts, device, metric, type, state, episode_id, payload) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def query(self, device: Optional[str] = None, alert_type: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              limit: int = 100, cursor: Optional[str] = None) -> Dict:
+        """Alerts newest-first, filtered by device, type and [since, until).
+
+        Returns ``{"alerts": [...], "next_cursor": str | None}``; pass
+        ``next_cursor`` back to get the following page.  Raises ValueError
+        for a malformed cursor.
+        """
+        clauses, params = [], []
+        if device is not None:
+            clauses.append("device = ?")
+            params.append(device)
+        if alert_type is not None:
+            clauses.append("type = ?")
+            params.append(alert_type)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        if cursor:
+            ts, row_id = parse_cursor(cursor)
+            clauses.append("(ts < ? OR (ts = ? AND id < ?))")
+            params.extend([ts, ts, row_id])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        limit = max(1, min(int(limit), 1000))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, ts, payload FROM alerts {where} ORDER BY ts DESC, id DESC LIMIT ?",
+                params + [limit]).fetchall()
+        next_cursor = f"{rows[-1][1]!r}:{rows[-1][0]}" if len(rows) == limit else None
+        return {"alerts": [json.loads(payload) for _, _, payload in rows], "next_cursor": next_cursor}
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
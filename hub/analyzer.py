@@ -1,131 +1,317 @@
 # hub/analyzer.py
-import json, os, time
+import argparse, glob, json, os, time, threading, multiprocessing
 from collections import defaultdict, deque
-import paho.mqtt.client as mqtt
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 import warnings
+import yaml
+from hub.alert_coalescer import AlertCoalescer
+from hub.alert_store import ALERTS_DB, AlertStore
+from hub.bus import Bus, MqttTransport
+from hub.calibration import CalibrationRegistry
+from hub.ingest import IngestQueue
+from hub.metric_state import DeviceStats, MetricRegistry, SampleScreen
+from hub.scheduler import JobScheduler
+from hub.spectral import SpectralMonitor
+from hub.state_store import save_snapshot, load_snapshot
+from hub import archive
 warnings.filterwarnings('ignore')
 
-BROKER = "localhost"
+BROKER = os.getenv("MQTT_BROKER", "localhost")
 ALERT_TOPIC = "lab/alerts"
 SUB_TOPIC = "lab/device/+/telemetry"
-OUTDIR = os.path.join("data", time.strftime("%Y-%m-%d"))
-
-os.makedirs(OUTDIR, exist_ok=True)
-alerts_path = os.path.join(OUTDIR, "alerts.ndjson")
-
-class OnlineStats:
-    # Welford online mean/std + EMA slope
-    def __init__(self, ema_alpha=0.2, slope_window=30):
-        self.n = 0
-        self.mean = 0.0
-        self.M2 = 0.0
-        self.ema = None
-        self.alpha = ema_alpha
-        self.hist = deque(maxlen=slope_window)
-
-    def update(self, x):
-        # Welford
-        self.n += 1
-        delta = x - self.mean
-        self.mean += delta / self.n
-        self.M2 += delta * (x - self.mean)
-        # EMA + slope buffer
-        self.ema = x if self.ema is None else (self.alpha * x + (1-self.alpha) * self.ema)
-        self.hist.append(self.ema)
+STATUS_TOPIC = "lab/analyzer/status"
+CORRELATION_INTERVAL = 30.0  # seconds between correlation passes
+SPECTRAL_INTERVAL = 60.0     # seconds between batched FFT passes
+SPECTRAL_WINDOW = 128        # samples per series in each spectrum
+STATUS_INTERVAL = 60.0       # seconds between job-metrics publishes
+RETRAIN_INTERVAL = 300.0     # seconds between per-device model retrains
+TRAIN_WORKERS = 2
+STATE_PATH = os.getenv("ANALYZER_STATE", os.path.join("data", "analyzer_state.bin"))
+STATE_VERSION = 7
+SNAPSHOT_INTERVAL = 120.0    # seconds between state snapshots
+WARMUP_RECORDS = 200         # per device, replayed from the archives when no snapshot exists
+EPISODE_SWEEP_INTERVAL = 60.0  # seconds between closing episodes of silent devices
+MAINTENANCE_INTERVAL = 60.0  # seconds between maintenance evaluations per device
+ALERT_FLUSH_INTERVAL = 2.0   # seconds between batched alert-store inserts
+DATA_DIR = "data"
+INGEST_CAPACITY = int(os.getenv("ANALYZER_QUEUE", "2000"))     # records buffered between MQTT and analysis
+INGEST_POLICY = os.getenv("ANALYZER_OVERLOAD", "downsample")  # block | drop_oldest | downsample
+DETECTION_MODE = os.getenv("ANALYZER_DETECTION", "tiered")  # "tiered" screens samples before the forest, "full" scores all
+SAMPLE_EVERY = 20            # tiered mode still sends 1 in N screened-out samples to the forest
 
-    @property
-    def std(self):
-        return (self.M2 / (self.n - 1))**0.5 if self.n > 1 else 0.0
+alerts_dir = DATA_DIR  # alerts go to <alerts_dir>/<day of alert ts>/alerts.ndjson
+
+def _fit_device_model(features, contamination):
+    """Fit a scaler + isolation forest on one device's window (runs in a worker process)"""
+    start = time.perf_counter()
+    scaler = StandardScaler()
+    features_scaled = scaler.fit_transform(features)
+    forest = IsolationForest(contamination=contamination, random_state=42)
+    forest.fit(features_scaled)
+    return scaler, forest, time.perf_counter() - start
 
-    def slope(self):
-        if len(self.hist) < 2: return 0.0
-        return (self.hist[-1] - self.hist[0]) / (len(self.hist) - 1)
+class DeviceModel:
+    """A fitted per-device model; never mutated after it is swapped in"""
+    
+    def __init__(self, scaler, forest, version, n_samples, train_duration):
+        self.scaler = scaler
+        self.isolation_forest = forest
+        self.version = version
+        self.n_samples = n_samples
+        self.train_duration = train_duration
+        self.trained_at = time.time()
 
 class IntelligentAnomalyDetector:
-    """Enhanced anomaly detection using isolation forests and multivariate analysis"""
+    """Enhanced anomaly detection using per-device isolation forests.
+
+    In tiered mode each sample first goes through O(1) screens (z-score,
+    CUSUM, rate of change; see SampleScreen) and only candidates, plus one in
+    ``sample_every`` of the rest, pay for a forest call.  With ``shadow`` the
+    forest also scores every sample so ``tier_metrics()`` can report how the
+    tiered decisions compare with the full-forest ones.
+    """
     
-    def __init__(self, contamination=0.1):
-        self.isolation_forest = IsolationForest(contamination=contamination, random_state=42)
-        self.scaler = StandardScaler()
-        self.is_fitted = False
-        self.feature_buffer = deque(maxlen=100)  # Keep last 100 samples for training
-        
-    def extract_features(self, data_point):
-        """Extract features from a data point for anomaly detection"""
-        features = []
-        
-        # Basic statistical features
-        if 'voltage' in data_point:
-            features.extend([
-                data_point['voltage'],
-                data_point.get('voltage_avg', data_point['voltage']),
-                data_point.get('voltage_std', 0.0)
-            ])
-        
-        if 'current' in data_point:
-            features.extend([
-                data_point['current'],
-                data_point.get('current_avg', data_point['current']),
-                data_point.get('current_std', 0.0)
-            ])
-        
-        # Temporal features
-        features.extend([
-            data_point.get('ts', time.time()) % 86400,  # Time of day
-            data_point.get('ts', time.time()) % 3600,   # Minute of hour
-        ])
-        
-        # Device-specific features
-        device_hash = hash(data_point.get('device', 'unknown')) % 1000
-        features.append(device_hash)
+    def __init__(self, contamination=0.1, window=100, min_samples=50, executor=None,
+                 tiered=False, sample_every=SAMPLE_EVERY, shadow=False):
+        self.contamination = contamination
+        self.window = window
+        self.min_samples = min_samples
+        self.executor = executor  # None trains inline; a ProcessPoolExecutor trains in the background
+        self.models = {}  # device -> DeviceModel, replaced wholesale on retrain
+        self.feature_buffers = defaultdict(lambda: deque(maxlen=self.window))
+        self.pending = set()  # devices with a training job in flight
+        self._lock = threading.Lock()
+        self.tiered = tiered
+        self.sample_every = sample_every
+        self.shadow = shadow
+        self.shadow_result = (False, 0.0)  # full-forest decision for the last sample (shadow mode)
+        self.screens = defaultdict(SampleScreen)
+        self._unscored = defaultdict(int)  # device -> screened-out samples since the last forest call
+        self.tier_counts = defaultdict(int)
+    
+    @property
+    def is_fitted(self):
+        return bool(self.models)
         
-        return np.array(features)
+    def extract_features(self, data_point, values=None):
+        """Extract features from a data point for anomaly detection.
+
+        ``values`` are the sample's metric values in metric-id order (see
+        MetricRegistry.extract); any ``<metric>_avg``/``<metric>_std`` fields
+        a driver reports are metrics in their own right.
+        """
+        if values is None:
+            _, values = registry.extract(data_point)
+        # Metric values only: the training window spans minutes, so time-of-day
+        # features always fell outside it and flagged nearly every sample
+        return values
     
-    def detect_anomaly(self, data_point):
-        """Detect anomalies using isolation forest"""
-        features = self.extract_features(data_point)
+    def detect_anomaly(self, data_point, values=None, ids=None):
+        """Detect anomalies using the device's current isolation forest"""
+        self.shadow_result = (False, 0.0)  # early returns must not leave the previous record's verdict
+        device = data_point.get('device', 'unknown')
+        if values is None or ids is None:
+            ids, values = registry.extract(data_point)
+        features = self.extract_features(data_point, values)
         
         if len(features) == 0:
             return False, 0.0
         
-        # Add to buffer for training
-        self.feature_buffer.append(features)
+        # Add to the device's window for (re)training
+        with self._lock:
+            buffer = self.feature_buffers[device]
+            buffer.append(features)
+            ready = len(buffer) >= self.min_samples
+        # Screens see every sample so they are warm by the time a model exists
+        reason = self.screens[device].screen(ids, values) if self.tiered else "full"
+        
+        model = self.models.get(device)
+        if model is None:
+            # First model for this device; inference never waits for it
+            if ready:
+                self._submit_training(device, self._window_array(device))
+            return False, 0.0
+        
+        if len(features) != model.scaler.n_features_in_:
+            # Payload shape changed; keep serving nothing until the next retrain
+            return False, 0.0
         
-        # Train model if we have enough data
-        if len(self.feature_buffer) >= 50 and not self.is_fitted:
-            self._train_model()
+        counts = self.tier_counts
+        counts['samples'] += 1
+        if not reason:
+            self._unscored[device] += 1
+            if self._unscored[device] >= self.sample_every:
+                reason = "sampled"
+        if not reason:
+            if not self.shadow:
+                return False, 0.0
+            self.shadow_result = self._score(model, features)
+            counts['shadow_calls'] += 1
+            self._count_shadow(False, self.shadow_result[0])
+            return False, 0.0
         
-        if self.is_fitted:
-            # Predict anomaly
-            features_scaled = self.scaler.transform([features])
-            prediction = self.isolation_forest.predict(features_scaled)[0]
-            score = self.isolation_forest.score_samples(features_scaled)[0]
-            
-            # prediction = -1 for anomaly, 1 for normal
-            is_anomaly = prediction == -1
-            return is_anomaly, score
+        self._unscored[device] = 0
+        counts['model_calls'] += 1
+        counts[f'screen_{reason}'] += 1
+        is_anomaly, score = self._score(model, features)
+        if self.shadow:
+            self.shadow_result = (is_anomaly, score)
+            self._count_shadow(is_anomaly, is_anomaly)
+        return is_anomaly, score
+    
+    def _score(self, model, features):
+        features_scaled = model.scaler.transform([features])
+        prediction = model.isolation_forest.predict(features_scaled)[0]
+        score = model.isolation_forest.score_samples(features_scaled)[0]
         
-        return False, 0.0
+        # prediction = -1 for anomaly, 1 for normal
+        is_anomaly = prediction == -1
+        return is_anomaly, score
+    
+    def _count_shadow(self, tiered, full):
+        key = {(True, True): 'tp', (True, False): 'fp', (False, True): 'fn', (False, False): 'tn'}[(bool(tiered), bool(full))]
+        self.tier_counts[key] += 1
+    
+    def tier_metrics(self):
+        """Forest call counts, which screen let samples through, and shadow agreement"""
+        counts = dict(self.tier_counts)
+        samples = counts.get('samples', 0)
+        calls = counts.get('model_calls', 0)
+        metrics = {
+            'mode': 'tiered' if self.tiered else 'full',
+            'samples': samples,
+            'model_calls': calls,
+            'call_fraction': calls / samples if samples else 0.0,
+            'by_screen': {k[len('screen_'):]: v for k, v in counts.items() if k.startswith('screen_')}
+        }
+        if self.shadow:
+            tp, fp, fn = counts.get('tp', 0), counts.get('fp', 0), counts.get('fn', 0)
+            metrics['shadow'] = {
+                'calls': counts.get('shadow_calls', 0),
+                'tp': tp, 'fp': fp, 'fn': fn, 'tn': counts.get('tn', 0),
+                'precision': tp / (tp + fp) if tp + fp else 1.0,
+                'recall': tp / (tp + fn) if tp + fn else 1.0
+            }
+        return metrics
+    
+    def snapshot(self):
+        """Copy each device's training window (for the scheduled retrain job)"""
+        with self._lock:
+            devices = [dev for dev, buf in self.feature_buffers.items() if len(buf) >= self.min_samples]
+        return {dev: self._window_array(dev) for dev in devices}
     
-    def _train_model(self):
-        """Train the isolation forest model"""
-        if len(self.feature_buffer) < 50:
+    def retrain(self, snapshot=None):
+        """Retrain every device with enough samples from its latest window"""
+        windows = self.snapshot() if snapshot is None else snapshot
+        for device, features in windows.items():
+            self._submit_training(device, features)
+    
+    def model_info(self):
+        """Model versions and training durations per device"""
+        return {
+            dev: {
+                'version': m.version,
+                'n_samples': m.n_samples,
+                'train_duration': m.train_duration,
+                'trained_at': m.trained_at,
+                'training': dev in self.pending
+            }
+            for dev, m in list(self.models.items())
+        }
+    
+    def drop(self, device):
+        """Forget a device's model, window and screens"""
+        with self._lock:
+            self.feature_buffers.pop(device, None)
+        self.models.pop(device, None)
+        self.screens.pop(device, None)
+        self._unscored.pop(device, None)
+    
+    def get_state(self):
+        """Fitted models and training windows, for snapshotting"""
+        with self._lock:
+            buffers = {dev: list(buf) for dev, buf in self.feature_buffers.items()}
+        models = {
+            dev: {
+                'scaler': m.scaler, 'forest': m.isolation_forest, 'version': m.version,
+                'n_samples': m.n_samples, 'train_duration': m.train_duration, 'trained_at': m.trained_at
+            }
+            for dev, m in list(self.models.items())
+        }
+        screens = {dev: screen.get_state() for dev, screen in self.screens.items()}
+        return {'models': models, 'buffers': buffers, 'screens': screens}
+    
+    def set_state(self, state):
+        with self._lock:
+            for dev, rows in state['buffers'].items():
+                self.feature_buffers[dev].extend(rows)
+        for dev, screen in state['screens'].items():
+            self.screens[dev].set_state(screen)
+        for dev, m in state['models'].items():
+            model = DeviceModel(m['scaler'], m['forest'], m['version'], m['n_samples'], m['train_duration'])
+            model.trained_at = m['trained_at']
+            self.models[dev] = model
+    
+    def _window_array(self, device):
+        with self._lock:
+            rows = list(self.feature_buffers[device])
+        # Only keep rows matching the latest feature layout
+        width = len(rows[-1])
+        return np.array([r for r in rows if len(r) == width])
+    
+    def _submit_training(self, device, features):
+        with self._lock:
+            if device in self.pending or len(features) < self.min_samples:
+                return
+            self.pending.add(device)
+        if self.executor is None:
+            self._install(device, len(features), _fit_device_model(features, self.contamination))
+            return
+        try:
+            future = self.executor.submit(_fit_device_model, features, self.contamination)
+        except Exception as e:
+            print(f"[AI] Could not schedule training for {device}: {e}")
+            self.pending.discard(device)
+            return
+        future.add_done_callback(lambda f: self._on_trained(device, len(features), f))
+    
+    def _on_trained(self, device, n_samples, future):
+        if future.cancelled():  # executor shut down first
+            self.pending.discard(device)
             return
-            
-        features_array = np.array(list(self.feature_buffer))
-        features_scaled = self.scaler.fit_transform(features_array)
-        self.isolation_forest.fit(features_scaled)
-        self.is_fitted = True
-        print(f"[AI] Trained anomaly detection model with {len(features_array)} samples")
+        try:
+            self._install(device, n_samples, future.result())
+        except Exception as e:
+            print(f"[AI] Training failed for {device}: {e}")
+            self.pending.discard(device)
+    
+    def _install(self, device, n_samples, result):
+        scaler, forest, duration = result
+        previous = self.models.get(device)
+        version = previous.version + 1 if previous else 1
+        # Single reference assignment: readers see either the old or the new model
+        self.models[device] = DeviceModel(scaler, forest, version, n_samples, duration)
+        self.pending.discard(device)
+        print(f"[AI] Trained {device} model v{version} with {n_samples} samples in {duration*1000:.1f} ms")
+
+def health_status(score):
+    """Bucket a 0..1 health score the same way the dashboard does"""
+    if score > 0.8:
+        return "excellent"
+    if score > 0.6:
+        return "good"
+    if score > 0.4:
+        return "fair"
+    return "poor"
 
 class PredictiveMaintenance:
     """Predictive maintenance using drift analysis and trend prediction"""
     
-    def __init__(self):
+    def __init__(self, calibrations=None, eval_interval=60.0):
         self.device_health = defaultdict(lambda: {
             'drift_rate': 0.0,
             'last_calibration': None,
@@ -138,14 +324,19 @@ class PredictiveMaintenance:
             'power_supply': 180,
             'default': 60
         }
+        self.calibrations = calibrations if calibrations is not None else CalibrationRegistry()
+        self.eval_interval = eval_interval
+        self.next_eval = {}     # device -> ts of its next evaluation
+        self.last_emitted = {}  # device -> (status, recommendations) last published
     
-    def update_health(self, device, data_point, stats):
-        """Update device health metrics"""
+    def update_health(self, device, n, slope):
+        """Update device health metrics from the sample counts and slopes of the metrics in a sample"""
         health = self.device_health[device]
         
-        # Calculate drift rate
-        if 'voltage' in data_point and stats['voltage'].n > 10:
-            current_drift = abs(stats['voltage'].slope())
+        # Calculate drift rate from the fastest-drifting metric
+        warm = n > 10
+        if warm.any():
+            current_drift = float(np.abs(slope[warm]).max())
             health['drift_rate'] = 0.9 * health['drift_rate'] + 0.1 * current_drift
         
         # Predict failure probability based on drift
@@ -154,12 +345,30 @@ class PredictiveMaintenance:
         else:
             health['failure_probability'] = max(0.0, health['failure_probability'] - 0.005)
         
-        # Generate recommendations
-        health['recommendations'] = self._generate_recommendations(device, health)
+        return health
+    
+    def evaluate(self, device, ts):
+        """Rebuild recommendations on the device's timer.
+
+        Returns the health record only when its status or recommendations
+        changed since the last one returned, otherwise None.
+        """
+        if ts < self.next_eval.get(device, 0.0):
+            return None
+        self.next_eval[device] = ts + self.eval_interval
         
+        self.calibrations.refresh()
+        health = self.device_health[device]
+        health['last_calibration'] = self.calibrations.last_calibration(device)
+        health['recommendations'] = self._generate_recommendations(device, health, ts)
+        
+        signature = (health_status(1.0 - health['failure_probability']), tuple(health['recommendations']))
+        if self.last_emitted.get(device) == signature:
+            return None
+        self.last_emitted[device] = signature
         return health
     
-    def _generate_recommendations(self, device, health):
+    def _generate_recommendations(self, device, health, now):
         """Generate maintenance recommendations"""
         recommendations = []
         
@@ -169,39 +378,52 @@ class PredictiveMaintenance:
         if health['drift_rate'] > 0.005:
             recommendations.append(f"Significant drift detected. Calibration recommended.")
         
-        days_since_cal = (time.time() - (health['last_calibration'] or 0)) / 86400
-        cal_interval = self.calibration_intervals.get(device, self.calibration_intervals['default'])
+        days_since_cal = (now - (health['last_calibration'] or 0)) / 86400
+        cal_interval = self.calibrations.get(device).get(
+            'interval_days', self.calibration_intervals.get(device, self.calibration_intervals['default']))
         
         if days_since_cal > cal_interval:
             recommendations.append(f"Calibration overdue by {int(days_since_cal - cal_interval)} days.")
         
         return recommendations
+    
+    def drop(self, device):
+        self.device_health.pop(device, None)
+        self.next_eval.pop(device, None)
+        self.last_emitted.pop(device, None)
+    
+    def get_state(self):
+        return {
+            'health': {dev: dict(health) for dev, health in self.device_health.items()},
+            'emitted': {dev: [status, list(recs)] for dev, (status, recs) in self.last_emitted.items()}
+        }
+    
+    def set_state(self, state):
+        for dev, health in state['health'].items():
+            self.device_health[dev].update(health)
+        for dev, (status, recs) in state['emitted'].items():
+            self.last_emitted[dev] = (status, tuple(recs))
 
 class CrossInstrumentCorrelator:
     """Analyze correlations between different instruments"""
     
     def __init__(self):
-        self.correlation_data = defaultdict(lambda: defaultdict(list))
         self.correlation_threshold = 0.7
         self.significant_correlations = []
     
-    def add_data_point(self, device, metric, value, timestamp):
-        """Add data point for correlation analysis"""
-        self.correlation_data[device][metric].append({
-            'value': value,
-            'timestamp': timestamp
-        })
-    
-    def analyze_correlations(self):
-        """Analyze correlations between all devices and metrics"""
+    def analyze_correlations(self, data):
+        """Analyze correlations between all devices and metrics.
+
+        ``data`` maps device -> metric -> recent values (see correlation_snapshot).
+        """
         correlations = []
         
-        devices = list(self.correlation_data.keys())
+        devices = list(data.keys())
         for i, dev1 in enumerate(devices):
             for dev2 in devices[i+1:]:
-                for metric1 in self.correlation_data[dev1]:
-                    for metric2 in self.correlation_data[dev2]:
-                        corr = self._calculate_correlation(dev1, metric1, dev2, metric2)
+                for metric1, values1 in data[dev1].items():
+                    for metric2, values2 in data[dev2].items():
+                        corr = self._calculate_correlation(values1, values2)
                         if abs(corr) > self.correlation_threshold:
                             correlations.append({
                                 'device1': dev1,
@@ -215,18 +437,11 @@ class CrossInstrumentCorrelator:
         self.significant_correlations = correlations
         return correlations
     
-    def _calculate_correlation(self, dev1, metric1, dev2, metric2):
-        """Calculate correlation between two metrics"""
-        data1 = self.correlation_data[dev1][metric1]
-        data2 = self.correlation_data[dev2][metric2]
-        
-        if len(data1) < 10 or len(data2) < 10:
+    def _calculate_correlation(self, values1, values2):
+        """Calculate correlation between two metric windows"""
+        if len(values1) < 10 or len(values2) < 10:
             return 0.0
         
-        # Align timestamps and calculate correlation
-        values1 = [d['value'] for d in data1[-50:]]  # Last 50 points
-        values2 = [d['value'] for d in data2[-50:]]
-        
         if len(values1) != len(values2):
             return 0.0
         
@@ -236,110 +451,510 @@ class CrossInstrumentCorrelator:
             return 0.0
 
 # Initialize AI components
-anomaly_detector = IntelligentAnomalyDetector()
-maintenance_predictor = PredictiveMaintenance()
+anomaly_detector = IntelligentAnomalyDetector(tiered=DETECTION_MODE == "tiered")
+maintenance_predictor = PredictiveMaintenance(eval_interval=MAINTENANCE_INTERVAL)
 correlation_analyzer = CrossInstrumentCorrelator()
+spectral = SpectralMonitor(window=SPECTRAL_WINDOW)
+coalescer = AlertCoalescer()
+shadow_coalescer = None  # full-forest ai_anomaly episodes, only while a replay runs in shadow mode
+episode_log = {'tiered': [], 'full': []}
+scheduler = JobScheduler()
+
+def _configured_metrics(config_dir="config"):
+    """Metric names declared under ``metrics:`` in device configs"""
+    names = []
+    for path in sorted(glob.glob(os.path.join(config_dir, "*.yaml"))):
+        try:
+            with open(path, "r") as f:
+                cfg = yaml.safe_load(f) or {}
+        except Exception:
+            continue
+        names.extend(m for m in cfg.get("metrics", []) if m not in names)
+    return names
+
+registry = MetricRegistry(_configured_metrics())
+stats = defaultdict(DeviceStats)
+last_ts = {}  # device -> ts of the newest record processed for it
 
-stats = defaultdict(lambda: {"voltage": OnlineStats(), "current": OnlineStats()})
+bus = None  # hub.bus.Bus alerts and status are published on; set by start()
+ingest = None  # IngestQueue between paho's network thread and the analysis worker, live mode only
+alert_store = None  # AlertStore, opened by run()/replay()
+alert_counts = defaultdict(int)
+_alert_file = None
+_replay_ts = None  # record time while replaying archives, else wall clock
+_alert_lock = threading.Lock()
+_state_lock = threading.Lock()  # held while a record mutates per-device state
 
 def log_alert(alert):
-    with open(alerts_path, "a") as f:
-        f.write(json.dumps(alert) + "\n")
+    global _alert_file
+    day = time.strftime("%Y-%m-%d", time.localtime(alert.get("ts", time.time())))
+    path = os.path.join(alerts_dir, day, archive.ALERTS_FILE)
+    with _alert_lock:
+        # Keep the day's log open; roll over when the alert's day changes
+        if _alert_file is None or _alert_file.name != path:
+            if _alert_file is not None:
+                _alert_file.close()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _alert_file = open(path, "a", buffering=1)
+        _alert_file.write(json.dumps(alert) + "\n")
+        alert_counts[alert.get("type", "unknown")] += 1
+    if alert_store is not None:
+        alert_store.add(alert)
 
-def on_connect(c, u, f, rc):
-    print("[AI Analyzer] connected", rc)
-    c.subscribe(SUB_TOPIC)
+def _now():
+    return time.time() if _replay_ts is None else _replay_ts
 
-def on_message(c, u, msg):
-    try:
-        payload = msg.payload.decode("utf-8")
-        # Try to parse as JSON first
-        try:
-            d = json.loads(payload)
-        except json.JSONDecodeError:
-            # If JSON fails, try to eval the Python dict string (for backward compatibility)
-            try:
-                d = eval(payload)
-            except:
-                print(f"[AI Analyzer] Failed to parse message: {payload[:100]}")
-                return
-        
-        dev = d.get("device", "unknown")
-        
-        # Update basic statistics
-        for key in ("voltage", "current"):
-            val = d.get(key)
-            if val is None: continue
-            s = stats[dev][key]
-            s.update(val)
-            
-            # Add to correlation analysis
-            correlation_analyzer.add_data_point(dev, key, val, d.get("ts", time.time()))
-            
-            # Basic anomaly detection (legacy)
-            st = s.std
-            if s.n > 20 and st > 1e-9:
-                z = abs(val - s.mean) / st
-                if z >= 3.0:
-                    alert = {
-                        "ts": d["ts"], "device": dev, "metric": key,
-                        "type": "statistical_anomaly", "value": val, "mean": s.mean, "std": st, "z": z
-                    }
-                    c.publish(ALERT_TOPIC, json.dumps(alert))
-                    log_alert(alert)
-            
-            # Drift detection
-            sl = s.slope()
-            if s.n > 30 and abs(sl) > 0.002:
-                alert = {
-                    "ts": d["ts"], "device": dev, "metric": key,
-                    "type": "drift", "slope": sl, "ema": s.ema
-                }
-                c.publish(ALERT_TOPIC, json.dumps(alert))
-                log_alert(alert)
-        
-        # AI-powered anomaly detection
-        is_anomaly, anomaly_score = anomaly_detector.detect_anomaly(d)
-        if is_anomaly:
-            alert = {
-                "ts": d["ts"], "device": dev,
-                "type": "ai_anomaly", "score": float(anomaly_score),
-                "message": f"AI detected unusual pattern in {dev} data"
-            }
-            c.publish(ALERT_TOPIC, json.dumps(alert))
-            log_alert(alert)
-        
-        # Predictive maintenance
-        device_health = maintenance_predictor.update_health(dev, d, stats[dev])
-        if device_health['recommendations']:
-            alert = {
-                "ts": d["ts"], "device": dev,
-                "type": "maintenance_recommendation",
-                "health_score": 1.0 - device_health['failure_probability'],
-                "recommendations": device_health['recommendations']
+def emit_alert(alert):
+    """Publish an alert and record it in the alert log and store"""
+    if bus is not None:
+        bus.publish(ALERT_TOPIC, alert)
+    log_alert(alert)
+
+def sweep_episodes():
+    """Close alert episodes for devices that stopped reporting"""
+    with _state_lock:
+        records = coalescer.sweep(_now())
+    for alert in records:
+        emit_alert(alert)
+
+def _episode_spans(records):
+    """(device, start, end) per ai_anomaly episode from its open/ongoing/closed records"""
+    spans = {}
+    for r in records:
+        spans[r['episode_id']] = (r['device'], r['started'], r['ts'])
+    return list(spans.values())
+
+def episode_agreement(tiered, full):
+    """Episode-level precision/recall of tiered alerts against the full-forest path.
+
+    A tiered episode counts as a true positive when it overlaps a full-forest
+    episode on the same device; recall is the share of full-forest episodes
+    overlapped by at least one tiered episode.
+    """
+    a, b = _episode_spans(tiered), _episode_spans(full)
+    overlaps = lambda x, y: x[0] == y[0] and x[1] <= y[2] and y[1] <= x[2]
+    matched = sum(any(overlaps(x, y) for y in b) for x in a)
+    found = sum(any(overlaps(y, x) for x in a) for y in b)
+    return {
+        'tiered_episodes': len(a),
+        'full_episodes': len(b),
+        'precision': matched / len(a) if a else 1.0,
+        'recall': found / len(b) if b else 1.0
+    }
+
+def warm_device(dev, data_dir=DATA_DIR, before=None):
+    """Catch one device up from its archive tail without alerting; returns records replayed.
+
+    Replays the archived records newer than the last one processed here (the
+    whole tail for a device with no state) and older than ``before``.  Used by
+    sharded workers when a rebalance hands them a device, including one whose
+    state in their snapshot has gone stale while another worker owned it.
+    """
+    with _state_lock:
+        since = last_ts.get(dev)
+    records = [d for d in archive.tail_records(data_dir, WARMUP_RECORDS, devices=[dev])
+               if (since is None or d["ts"] > since) and (before is None or d["ts"] < before)]
+    for d in records:
+        process_record(d, emit=False)
+    return len(records)
+
+def held_devices():
+    """Devices with statistics or open alert episodes in this process"""
+    with _state_lock:
+        return set(stats) | {ep.device for ep in coalescer.episodes.values()}
+
+def drop_devices(devices):
+    """Forget devices now analysed by another sharded worker.
+
+    Their open episodes go without a closing record; the episode sweep would
+    otherwise close them here while the new owner still reports the device.
+    """
+    with _state_lock:
+        for dev in devices:
+            stats.pop(dev, None)
+            last_ts.pop(dev, None)
+            coalescer.drop(dev)
+            spectral.drop(dev)
+            anomaly_detector.drop(dev)
+            maintenance_predictor.drop(dev)
+
+def device_summaries(devices):
+    """Compact per-device summaries (recent values and headline stats) for a coordinator"""
+    with _state_lock:
+        out = {}
+        for dev in devices:
+            ds = stats.get(dev)
+            if ds is None:
+                continue
+            ids, n, mean, std = ds.moments()
+            names = [registry.names[mid] for mid in ids]
+            health = maintenance_predictor.device_health.get(dev, {})
+            out[dev] = {
+                'recent': {name: ds.recent(mid) for name, mid in zip(names, ids)},
+                'mean': dict(zip(names, mean.tolist())),
+                'std': dict(zip(names, std.tolist())),
+                'samples': int(n.max()) if len(n) else 0,
+                'failure_probability': health.get('failure_probability', 0.0)
             }
-            c.publish(ALERT_TOPIC, json.dumps(alert))
-            log_alert(alert)
+        return out
+
+def correlation_snapshot():
+    """Recent raw values per device and metric, copied out for the correlation job"""
+    with _state_lock:
+        return {dev: {registry.names[mid]: ds.recent(mid) for mid in ds.metric_ids()}
+                for dev, ds in stats.items()}
+
+def run_correlation_job(snapshot):
+    """Scheduled cross-instrument correlation pass over a buffer snapshot"""
+    correlations = correlation_analyzer.analyze_correlations(snapshot)
+    if correlations:
+        emit_alert({
+            "ts": _now(),
+            "type": "correlation_discovery",
+            "correlations": correlations[:5]  # Top 5 correlations
+        })
+
+def spectral_snapshot():
+    """Full spectral windows, copied out for the spectral job"""
+    with _state_lock:
+        return spectral.snapshot()
+
+def run_spectral_job(snapshot):
+    """Scheduled spectral pass: one FFT over all series, findings fed to the coalescer"""
+    findings = spectral.analyze(snapshot)
+    alerts = []
+    with _state_lock:
+        spectral.update_floors(findings)
+        for f in findings:
+            dev, metric = f['device'], registry.names[f['metric_id']]
+            base = {"sample_rate_hz": f['sample_rate_hz'], "noise_floor": f['noise_floor']}
+            prominence = f['prominence']
+            observations = [
+                ("noise_floor_change", max(f['floor_ratio'], 1.0 / f['floor_ratio']),
+                 {"floor_ratio": f['floor_ratio']}),
+            ]
+            if f['mains']:
+                hz, ratio = max(f['mains'].items(), key=lambda item: item[1])
+                observations.append(("mains_pickup", ratio, {"mains_hz": hz, "line_ratio": ratio}))
+                # A mains line is reported as mains pickup, not as generic periodic interference
+                if abs(f['dominant_hz'] - hz) <= 1.5 * f['sample_rate_hz'] / SPECTRAL_WINDOW:
+                    prominence = 0.0
+            observations.append(("periodic_interference", prominence,
+                                 {"frequency_hz": f['dominant_hz'], "prominence": f['prominence']}))
+            for alert_type, magnitude, detail in observations:
+                detail.update(base)
+                alert = coalescer.observe(dev, metric, alert_type, _now(), magnitude, detail)
+                if alert:
+                    alerts.append(alert)
+    for alert in alerts:
+        emit_alert(alert)
+
+def publish_status():
+    """Publish analyzer job timing metrics (retained)"""
+    status = {
+        "ts": time.time(),
+        "jobs": scheduler.metrics(),
+        "models": anomaly_detector.model_info(),
+        "detection": anomaly_detector.tier_metrics(),
+        "metrics": list(registry.names),
+        "alerts": {"observed": coalescer.observed, "emitted": coalescer.emitted,
+                   "open_episodes": len(coalescer.episodes), "by_type": dict(alert_counts)},
+        "state_bytes": {dev: ds.nbytes for dev, ds in list(stats.items())},
+        "spectral_series": len(spectral),
+        "ingest": ingest.metrics() if ingest is not None else None
+    }
+    if bus is not None:
+        bus.publish(STATUS_TOPIC, status, retain=True)
+
+def capture_state():
+    """Copy all analyzer state; only blocks the message path for the copy"""
+    with _state_lock:
+        return {
+            'metrics': list(registry.names),
+            'stats': {dev: ds.get_state() for dev, ds in stats.items()},
+            'health': maintenance_predictor.get_state(),
+            'detector': anomaly_detector.get_state(),
+            'episodes': coalescer.get_state(),
+            'spectral': spectral.get_state(),
+            'last_ts': dict(last_ts)
+        }
+
+def write_state(state):
+    """Persist a captured state snapshot to STATE_PATH"""
+    size = save_snapshot(STATE_PATH, state, STATE_VERSION)
+    print(f"[AI Analyzer] Saved state snapshot ({size} bytes, {len(state['stats'])} devices)")
+
+def restore_state(replay_archive=True):
+    """Warm-start from the last snapshot, or replay the archive tail without one"""
+    start = time.perf_counter()
+    state = load_snapshot(STATE_PATH, STATE_VERSION)
+    if state is not None:
+        with _state_lock:
+            for name in state['metrics']:
+                registry.id_for(name)
+            for dev, ds in state['stats'].items():
+                stats[dev].set_state(ds)
+            maintenance_predictor.set_state(state['health'])
+            anomaly_detector.set_state(state['detector'])
+            coalescer.set_state(state.get('episodes', []))
+            spectral.set_state(state['spectral'])
+            last_ts.update(state.get('last_ts', {}))
+        print(f"[AI Analyzer] Restored {len(state['stats'])} devices from {STATE_PATH} "
+              f"in {(time.perf_counter() - start)*1000:.1f} ms")
+        return
+    if not replay_archive:
+        return
+    records = archive.tail_records(DATA_DIR, WARMUP_RECORDS)
+    for d in records:
+        process_record(d, emit=False)
+    print(f"[AI Analyzer] No snapshot; replayed {len(records)} archived records "
+          f"in {(time.perf_counter() - start)*1000:.1f} ms")
+
+scheduler.add_job("correlation", CORRELATION_INTERVAL, run_correlation_job,
+                  snapshot=correlation_snapshot)
+scheduler.add_job("spectral", SPECTRAL_INTERVAL, run_spectral_job, snapshot=spectral_snapshot)
+scheduler.add_job("snapshot", SNAPSHOT_INTERVAL, write_state, snapshot=capture_state)
+scheduler.add_job("retrain", RETRAIN_INTERVAL, anomaly_detector.retrain,
+                  snapshot=anomaly_detector.snapshot)
+scheduler.add_job("alert_flush", ALERT_FLUSH_INTERVAL, lambda: alert_store and alert_store.flush())
+scheduler.add_job("episode_sweep", EPISODE_SWEEP_INTERVAL, sweep_episodes)
+scheduler.add_job("status", STATUS_INTERVAL, publish_status)
+
+def process_record(d, emit=True):
+    """Run one decoded telemetry record through the detection pipeline.
+
+    With ``emit`` false (warm-up replay) only the statistics, models and
+    health numbers are updated: no alert episodes are opened and no
+    maintenance signature is recorded, so the first live alerts are neither
+    suppressed as repeats nor closes of episodes that never opened.
+    """
+    with _state_lock:
+        _process_record(d, emit_alert if emit else None)
+
+def _observe_metrics(emit_alert, dev, alert_type, ts, ids, magnitude, detail):
+    """Feed per-metric magnitudes to the coalescer; only candidates and open episodes cost Python"""
+    candidates = set(np.flatnonzero(magnitude >= coalescer.policy(alert_type).close_at).tolist())
+    active = coalescer.active(dev, alert_type)
+    if active:
+        candidates.update(i for i, mid in enumerate(ids) if registry.names[mid] in active)
+    for i in sorted(candidates):
+        alert = coalescer.observe(dev, registry.names[ids[i]], alert_type, ts, float(magnitude[i]), detail(i))
+        if alert:
+            emit_alert(alert)
+
+def _process_record(d, emit_alert):
+    dev = d.get("device", "unknown")
+    ids, values = registry.extract(d)
+    if len(ids) == 0:
+        return
+    
+    # Update basic statistics for every metric in the sample at once
+    ds = stats[dev]
+    last_ts[dev] = d["ts"]
+    n, mean, std, slope, ema = ds.update(ids, values)
+    spectral.append(dev, ids, values, d["ts"])
+    live = emit_alert is not None  # warm-up replay updates state only
+    
+    if live:
+        # Basic anomaly detection (legacy)
+        z = np.abs(values - mean) / np.where(std > 1e-9, std, np.inf)
+        z[n <= 20] = 0.0
+        _observe_metrics(emit_alert, dev, "statistical_anomaly", d["ts"], ids, z, lambda i: {
+            "value": float(values[i]), "mean": float(mean[i]), "std": float(std[i]), "z": float(z[i])
+        })
         
-        # Cross-instrument correlation analysis (run every 100 messages)
-        if sum(len(correlation_analyzer.correlation_data[d][m]) for d in correlation_analyzer.correlation_data for m in correlation_analyzer.correlation_data[d]) % 100 == 0:
-            correlations = correlation_analyzer.analyze_correlations()
-            if correlations:
-                alert = {
-                    "ts": d["ts"],
-                    "type": "correlation_discovery",
-                    "correlations": correlations[:5]  # Top 5 correlations
-                }
-                c.publish(ALERT_TOPIC, json.dumps(alert))
-                log_alert(alert)
-                
-    except Exception as e:
-        print(f"[AI Analyzer] Error processing message: {e}")
-        print(f"[AI Analyzer] Payload: {msg.payload.decode('utf-8', errors='ignore')[:100]}")
-
-client = mqtt.Client()
-client.on_connect = on_connect
-client.on_message = on_message
-print("[AI Analyzer] subscribing to", SUB_TOPIC)
-client.connect(BROKER, 1883, 60)
-client.loop_forever()
+        # Drift detection
+        drift = np.abs(slope)
+        drift[n <= 30] = 0.0
+        _observe_metrics(emit_alert, dev, "drift", d["ts"], ids, drift, lambda i: {
+            "slope": float(slope[i]), "ema": float(ema[i])
+        })
+    
+    # AI-powered anomaly detection
+    is_anomaly, anomaly_score = anomaly_detector.detect_anomaly(d, values, ids)
+    if live and (is_anomaly or coalescer.active(dev, "ai_anomaly")):
+        alert = coalescer.observe(dev, None, "ai_anomaly", d["ts"], -float(anomaly_score) if is_anomaly else 0.0, {
+            "score": float(anomaly_score),
+            "message": f"AI detected unusual pattern in {dev} data"
+        })
+        if alert:
+            emit_alert(alert)
+            if shadow_coalescer is not None:
+                episode_log['tiered'].append(alert)
+    if live and shadow_coalescer is not None:
+        full_anomaly, full_score = anomaly_detector.shadow_result
+        if full_anomaly or shadow_coalescer.active(dev, "ai_anomaly"):
+            alert = shadow_coalescer.observe(dev, None, "ai_anomaly", d["ts"], -float(full_score) if full_anomaly else 0.0)
+            if alert:
+                episode_log['full'].append(alert)
+    
+    # Predictive maintenance: cheap numeric update per sample, recommendations on a timer
+    maintenance_predictor.update_health(dev, n, slope)
+    if not live:
+        return
+    device_health = maintenance_predictor.evaluate(dev, d["ts"])
+    if device_health is not None:
+        health_score = 1.0 - device_health['failure_probability']
+        emit_alert({
+            "ts": d["ts"], "device": dev,
+            "type": "maintenance_recommendation",
+            "health_score": health_score,
+            "status": health_status(health_score),
+            "recommendations": device_health['recommendations']
+        })
+    # Cross-instrument correlation runs on the scheduler, not per message
+
+def on_telemetry(topic, d):
+    # Analysis runs on the ingest worker; the bus thread only queues the decoded record
+    ingest.put(d["device"], d)
+
+def ingest_worker():
+    """Drain the ingest queue through the pipeline until it is closed"""
+    while True:
+        item = ingest.get(timeout=1.0)
+        if item is None:
+            if ingest.closed:
+                return
+            continue
+        try:
+            process_record(item[1])
+        except Exception as e:
+            print(f"[AI Analyzer] Error processing record from {item[0]}: {e}")
+
+def replay(sources, out_dir, devices=None, limit=None, detection=DETECTION_MODE, shadow=False):
+    """Stream archived NDJSON through the pipeline as fast as possible, without a broker.
+
+    ``sources`` are day directories (data/<day>) and/or device NDJSON files;
+    devices are merged by ts. Scheduled jobs run inline on record time and
+    models train synchronously, so the same input always gives the same alerts.
+    ``shadow`` runs tiered detection and also scores every sample with the
+    forest, reporting sample- and episode-level agreement in the summary.
+    """
+    global alerts_dir, alert_store, _replay_ts, shadow_coalescer
+    files = defaultdict(list)
+    for src in map(os.path.abspath, sources):
+        if os.path.isfile(src):
+            files[os.path.basename(src)[:-len(".ndjson")]].append(src)
+            continue
+        for dev, paths in archive.device_files(os.path.dirname(src), days=[os.path.basename(src)]).items():
+            files[dev].extend(paths)
+    if devices:
+        files = {dev: paths for dev, paths in files.items() if dev in devices}
+    
+    # Replay output mirrors the data/ layout; previous output in out_dir is replaced
+    os.makedirs(out_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(out_dir, "*", archive.ALERTS_FILE)) + glob.glob(os.path.join(out_dir, "alerts.db*")):
+        os.remove(stale)
+    alerts_dir = out_dir
+    alert_store = AlertStore(os.path.join(out_dir, "alerts.db"), batch_size=1000)
+    alert_counts.clear()
+    anomaly_detector.executor = None
+    anomaly_detector.tiered = shadow or detection == "tiered"
+    anomaly_detector.shadow = shadow
+    shadow_coalescer = AlertCoalescer() if shadow else None
+    for name in ("snapshot", "status"):
+        scheduler.remove_job(name)
+    
+    streams = [archive.read_records(sorted(paths)) for paths in files.values()]
+    n = 0
+    start = time.perf_counter()
+    try:
+        for d in archive.merge_by_ts(streams):
+            if limit is not None and n >= limit:
+                break
+            if "ts" not in d:
+                continue
+            _replay_ts = d["ts"]
+            with _state_lock:
+                _process_record(d, emit_alert)
+            scheduler.run_pending(now=d["ts"])
+            n += 1
+    finally:
+        _replay_ts = None
+        alert_store.flush()
+    elapsed = time.perf_counter() - start
+    
+    summary = {
+        'samples': n,
+        'devices': sorted(files),
+        'elapsed_s': elapsed,
+        'samples_per_sec': n / elapsed if elapsed > 0 else 0.0,
+        'alerts': dict(alert_counts),
+        'alerts_dir': out_dir,
+        'jobs': scheduler.metrics(),
+        'models': anomaly_detector.model_info(),
+        'detection': anomaly_detector.tier_metrics()
+    }
+    if shadow:
+        summary['detection']['episodes'] = episode_agreement(episode_log['tiered'], episode_log['full'])
+    with open(os.path.join(out_dir, "replay_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+_worker = None
+
+def start(bus_: Bus):
+    """Start the live pipeline on ``bus_``: telemetry in, alerts and status out"""
+    global bus, alert_store, ingest, _worker
+    alert_store = AlertStore(ALERTS_DB)
+    ingest = IngestQueue(INGEST_CAPACITY, INGEST_POLICY)
+    # Spawned workers keep training away from the bus's and the scheduler's threads
+    anomaly_detector.executor = ProcessPoolExecutor(
+        max_workers=TRAIN_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    restore_state()
+    scheduler.start()
+    _worker = threading.Thread(target=ingest_worker, name="ingest-worker", daemon=True)
+    _worker.start()
+    bus = bus_
+    print("[AI Analyzer] subscribing to", SUB_TOPIC)
+    # Blocking hand-off: the ingest queue's overload policy decides what to shed
+    return bus.subscribe(SUB_TOPIC, on_telemetry, maxlen=64, block=True)
+
+def stop():
+    """Drain queued records, then snapshot state and close the alert store"""
+    ingest.close()
+    _worker.join(timeout=10.0)
+    scheduler.stop()
+    write_state(capture_state())
+    alert_store.close()
+    anomaly_detector.executor.shutdown(wait=False)
+
+def run():
+    """Live mode: consume telemetry from the MQTT broker"""
+    own_bus = Bus(MqttTransport(BROKER))
+    subscription = start(own_bus)
+    try:
+        own_bus.run_forever()
+    finally:
+        own_bus.unsubscribe(subscription)
+        stop()
+        own_bus.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lab-OS AI analyzer")
+    sub = parser.add_subparsers(dest="command")
+    rp = sub.add_parser("replay", help="Run archived NDJSON through the pipeline without a broker")
+    rp.add_argument("sources", nargs="+", help="Day directories (data/<day>) or device NDJSON files")
+    rp.add_argument("--out", required=True, help="Directory to write replayed alerts to")
+    rp.add_argument("--device", action="append", help="Only replay this device (repeatable)")
+    rp.add_argument("--limit", type=int, help="Stop after this many samples")
+    rp.add_argument("--detection", choices=("tiered", "full"), default=DETECTION_MODE,
+                    help="Screen samples before the forest (tiered) or score every sample (full)")
+    rp.add_argument("--shadow", action="store_true",
+                    help="Tiered detection plus a full-forest shadow; reports precision/recall")
+    args = parser.parse_args(argv)
+    
+    if args.command == "replay":
+        summary = replay(args.sources, args.out, devices=args.device, limit=args.limit,
+                         detection=args.detection, shadow=args.shadow)
+        detection = summary['detection']
+        print(f"[AI Analyzer] Replayed {summary['samples']} samples in {summary['elapsed_s']:.2f} s "
+              f"({summary['samples_per_sec']:.0f} samples/s), alerts: {summary['alerts']}, "
+              f"forest calls: {detection['model_calls']}/{detection['samples']}")
+        if args.shadow:
+            print(f"[AI Analyzer] Shadow agreement: samples {detection['shadow']}, episodes {detection['episodes']}")
+    else:
+        run()
+
+if __name__ == "__main__":
+    main()
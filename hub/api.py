@@ -1,17 +1,36 @@
 # hub/api.py
 from fastapi import FastAPI, Body
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import glob, json, os, time, subprocess, pathlib, signal, threading
 from collections import deque
+from contextlib import asynccontextmanager
 from typing import Dict, List
 
 from .discovery import visa_scan, quick_lan_sweep
+from .calibration import CalibrationRegistry
+from .alert_store import AlertStore, parse_cursor
 from .ai_dashboard import ai_dashboard
-from .lab_assistant import lab_assistant
+from .lab_assistant import ChatBusy, lab_assistant
 import yaml
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything slow starts in the background, so the server accepts requests
+    # at once (and again straight after each --reload)
+    global alert_store, calibrations
+    alert_store = AlertStore()
+    calibrations = CalibrationRegistry()
+    ai_dashboard.start()
+    ai_dashboard.start_rehydration(alert_store, DATA_DIR)
+    lab_assistant.warm_up()
+    lab_assistant.sessions.start()
+    yield
+    ai_dashboard.stop()
+    alert_store.close()
+    lab_assistant.sessions.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -28,6 +47,12 @@ DATA_DIR = "data"
 _started: Dict[str, subprocess.Popen] = {}
 _registry_lock = threading.Lock()
 
+# --- indexed alert history written by the analyzer; opened by lifespan()
+alert_store: AlertStore | None = None
+
+# --- calibration registry shared with the analyzer via config/calibrations.json; loaded by lifespan()
+calibrations: CalibrationRegistry | None = None
+
 def _latest_file(device: str) -> str | None:
     files = sorted(glob.glob(os.path.join(DATA_DIR, "*", f"{device}.ndjson")))
     return files[-1] if files else None
@@ -114,6 +139,18 @@ def ai_alerts(limit: int = 20):
     alerts = dashboard_data.get('alerts', [])
     return alerts[-limit:] if limit > 0 else alerts
 
+@app.get("/alerts")
+def alerts(device: str | None = None, type: str | None = None, since: float | None = None,
+           until: float | None = None, limit: int = 100, cursor: str | None = None):
+    """Query alert history (newest first); pass next_cursor back as cursor for the next page"""
+    if cursor:
+        try:
+            parse_cursor(cursor)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+    return alert_store.query(device=device, alert_type=type, since=since, until=until,
+                             limit=limit, cursor=cursor)
+
 @app.get("/ai/health")
 def ai_health():
     """Get system health assessment"""
@@ -122,14 +159,63 @@ def ai_health():
 
 # ---------- Lab Assistant Chat Endpoints ----------
 @app.post("/chat")
-def chat(message: dict = Body(...)):
-    """Chat with the lab assistant"""
+async def chat(message: dict = Body(...)):
+    """Chat with the lab assistant (async: waiting on the LLM holds no worker thread).
+
+    Pass the ``session_id`` from a previous reply to continue that conversation.
+    """
     user_message = message.get("message", "")
     if not user_message:
         return {"error": "No message provided"}
     
-    response = lab_assistant.chat(user_message)
-    return {"response": response}
+    session = lab_assistant.session(message.get("session_id"))
+    try:
+        response = await lab_assistant.achat(user_message, session)
+    except ChatBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    return {"response": response, "session_id": session.id}
+
+@app.post("/chat/stream")
+async def chat_stream(message: dict = Body(...)):
+    """Chat with the lab assistant as server-sent events: one ``data:`` event per text
+    fragment (JSON string), then ``event: done`` (or ``event: error``).
+
+    Takes ``session_id`` like /chat; the session is returned in the X-Session-Id header.
+    """
+    user_message = message.get("message", "")
+    if not user_message:
+        return {"error": "No message provided"}
+    
+    session = lab_assistant.session(message.get("session_id"))
+    fragments = lab_assistant.astream(user_message, session)
+    try:
+        first = await fragments.__anext__()  # waits for a slot, so a busy assistant is still a 503
+    except ChatBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    except StopAsyncIteration:
+        first = None
+    
+    async def events():
+        try:
+            if first is not None:
+                yield f"data: {json.dumps(first)}\n\n"
+                async for fragment in fragments:
+                    yield f"data: {json.dumps(fragment)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"[Lab Assistant] Stream failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            await fragments.aclose()  # frees the chat slot if the client went away mid-reply
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                      "X-Session-Id": session.id})
+
+@app.get("/chat/metrics")
+def chat_metrics():
+    """Chat concurrency, queueing and coalescing counters"""
+    return lab_assistant.metrics()
 
 @app.post("/chat/action")
 def execute_action(action: dict = Body(...)):
@@ -207,6 +293,23 @@ def stop_device(body: dict = Body(...)):
     ok = _stop_sidecar(name)
     return {"ok": ok, "name": name}
 
+@app.get("/devices/calibrations")
+def list_calibrations():
+    calibrations.refresh()
+    return calibrations.entries
+
+@app.post("/devices/{name}/calibration")
+def record_calibration(name: str, body: dict = Body(default={})):
+    """
+    Record that a device was calibrated. Both fields are optional:
+    { "ts": 1755107181.2, "interval_days": 30 }
+    """
+    try:
+        entry = calibrations.record(name, ts=body.get("ts"), interval_days=body.get("interval_days"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    return {"ok": True, "name": name, **entry}
+
 # ---------- Enhanced Main Page with AI ----------
 # ---------- Simple Working Version with AI Dashboard Only ---------- # NEW
 @app.get("/", response_class=HTMLResponse)
@@ -633,6 +736,45 @@ function addChatMessage(role, content) {
   messageEl.textContent = content;
   messagesEl.appendChild(messageEl);
   messagesEl.scrollTop = messagesEl.scrollHeight;
+  return messageEl;
+}
+
+// Apply one server-sent event to el; returns true once the reply is complete
+function applyChatEvent(block, el) {
+  const lines = block.split('\\n');
+  const event = (lines.find(l => l.startsWith('event: ')) || 'event: message').slice(7);
+  const data = lines.filter(l => l.startsWith('data: ')).map(l => l.slice(6)).join('\\n');
+  if (event === 'done') return true;
+  if (event === 'error') throw new Error(JSON.parse(data).error);
+  el.textContent += JSON.parse(data);
+  const messagesEl = document.getElementById('chat-messages');
+  messagesEl.scrollTop = messagesEl.scrollHeight;
+  return false;
+}
+
+// Read the /chat/stream event stream, appending each fragment to el as it arrives
+// (all at once when the browser cannot read the body as a stream)
+async function readChatStream(response, el) {
+  if (!response.body) {
+    for (const block of (await response.text()).split('\\n\\n')) {
+      if (block && applyChatEvent(block, el)) return;
+    }
+    return;
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) return;
+    buffer += decoder.decode(value, { stream: true });
+    let end;
+    while ((end = buffer.indexOf('\\n\\n')) >= 0) {
+      const block = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      if (applyChatEvent(block, el)) return;
+    }
+  }
 }
 
 async function sendChatMessage() {
@@ -646,20 +788,33 @@ async function sendChatMessage() {
   addChatMessage('user', message);
   input.value = '';
   
+  const request = {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ message: message, session_id: localStorage.getItem('labSessionId') })
+  };
+  let el = null;
   try {
-    const response = await fetch('/chat', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ message: message })
-    });
-    
+    const response = await fetch('/chat/stream', request);
     console.log('Chat response status:', response.status);
-    const data = await response.json();
-    console.log('Chat response:', data);
-    addChatMessage('assistant', data.response);
+    if (response.status === 503) {
+      addChatMessage('assistant', 'The assistant is busy right now. Please try again in a few seconds.');
+      return;
+    }
+    if (response.headers.get('X-Session-Id')) {
+      localStorage.setItem('labSessionId', response.headers.get('X-Session-Id'));
+    }
+    if (!response.ok) throw new Error('HTTP ' + response.status);
+    el = addChatMessage('assistant', '');
+    await readChatStream(response, el);
   } catch(e) {
     console.error('Chat error:', e);
-    addChatMessage('assistant', 'Sorry, I encountered an error. Please try again.');
+    if (el && el.textContent) {
+      el.textContent += ' [reply interrupted]';
+    } else {
+      if (el) el.remove();
+      addChatMessage('assistant', 'Sorry, I encountered an error. Please try again.');
+    }
   }
 }
 
@@ -671,7 +826,7 @@ document.getElementById('chat-input').onkeypress = function(e) {
 };
 
 // Welcome message - now addChatMessage is defined
-addChatMessage('assistant', 'Hello! I\'m your lab assistant. Ask me anything about your experiments, data, or instruments!');
+addChatMessage('assistant', 'Hello! I\\'m your lab assistant. Ask me anything about your experiments, data, or instruments!');
 </script>
 </body>
 </html>
@@ -0,0 +1,91 @@
+# hub/archive.py
+import glob
+import heapq
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from hub.telemetry import DecodeError, loads
+
+ALERTS_FILE = "alerts.ndjson"
+
+def device_files(data_dir: str = "data", days: Optional[List[str]] = None) -> Dict[str, List[str]]:
+    """Map device name -> its telemetry NDJSON files, oldest day first"""
+    out: Dict[str, List[str]] = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "*", "*.ndjson"))):
+        day = os.path.basename(os.path.dirname(path))
+        name = os.path.basename(path)
+        if name == ALERTS_FILE or (days and day not in days):
+            continue
+        out.setdefault(name[:-len(".ndjson")], []).append(path)
+    return out
+
+def tail_lines(path: str, n: int, block_size: int = 65536) -> List[str]:
+    """Return the last n non-empty lines of a file, reading backwards in blocks"""
+    if n <= 0:
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+    lines = [l for l in buf.split(b"\n") if l.strip()]
+    if pos > 0:
+        lines = lines[1:]  # first line may be cut mid-record
+    return [l.decode("utf-8", errors="ignore") for l in lines[-n:]]
+
+def parse_lines(lines: Iterable[str]) -> Iterator[dict]:
+    """Decode NDJSON lines, skipping anything malformed"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            d = loads(line)
+        except DecodeError:
+            continue
+        if isinstance(d, dict):
+            yield d
+
+def read_records(paths: Iterable[str]) -> Iterator[dict]:
+    """Stream records from files in order"""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from parse_lines(f)
+
+def merge_by_ts(streams: Iterable[Iterable[dict]]) -> Iterator[dict]:
+    """Merge per-device streams (each already in ts order) into one ts-ordered stream"""
+    return heapq.merge(*streams, key=lambda d: d.get("ts", 0.0))
+
+def tail_device(device: str, paths: List[str], n: int) -> List[dict]:
+    """The last n records of one device, reading its newest files first"""
+    lines: List[str] = []
+    for path in reversed(paths):
+        lines = tail_lines(path, n - len(lines)) + lines
+        if len(lines) >= n:
+            break
+    records = list(parse_lines(lines))
+    for d in records:
+        d.setdefault("device", device)
+    return records
+
+def tail_records(data_dir: str = "data", n_per_device: int = 200, devices: Optional[Iterable[str]] = None) -> List[dict]:
+    """The last n records of every device (or just ``devices``), merged by ts"""
+    files = device_files(data_dir)
+    if devices is not None:
+        files = {dev: paths for dev, paths in files.items() if dev in set(devices)}
+    return list(merge_by_ts(tail_device(dev, paths, n_per_device) for dev, paths in files.items()))
+
+def tail_alerts(data_dir: str = "data", n: int = 1000, since: Optional[float] = None) -> List[dict]:
+    """The last n alerts at or after ``since``, oldest first, reading the newest day's file backwards"""
+    out: List[dict] = []
+    for path in reversed(sorted(glob.glob(os.path.join(data_dir, "*", ALERTS_FILE)))):
+        batch = list(parse_lines(tail_lines(path, n - len(out))))
+        recent = batch if since is None else [a for a in batch if a.get("ts", 0.0) >= since]
+        out = recent + out
+        if len(out) >= n or len(recent) < len(batch):
+            break  # filled, or this file already reaches back past the window
+    return out
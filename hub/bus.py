@@ -0,0 +1,293 @@
+# hub/bus.py
+"""In-process publish/subscribe on MQTT topic patterns, with pluggable transports.
+
+Components in one process exchange decoded objects through a Bus without
+serializing them; a message is shared by every subscriber, so handlers
+treat it as read-only.  The transport decides what crosses the process:
+
+- ``MemoryTransport``: nothing; single-process deployments and tests run
+  the whole pipeline without a broker
+- ``MqttTransport``: one paho connection per process.  Local publishes are
+  also sent to the broker; broker messages on subscribed patterns are
+  decoded once (by topic, see ``DECODERS``) and handed to every matching
+  subscriber.  Subscriptions use MQTT 5 no-local, so a process never gets
+  its own publishes back.
+
+Each subscriber has a bounded queue drained into its handler by its own
+thread.  When the queue is full the oldest message is dropped and counted,
+or, for ``block=True`` subscribers, the publisher waits.
+"""
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.subscribeoptions import SubscribeOptions
+
+from hub import telemetry
+
+DEFAULT_QUEUE = 1000
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    """MQTT wildcard match: ``+`` is one level, a trailing ``#`` any number of levels (including none)"""
+    parts = topic.split("/")
+    for i, level in enumerate(pattern.split("/")):
+        if level == "#":
+            return True
+        if i >= len(parts) or (level != "+" and level != parts[i]):
+            return False
+    return len(parts) == i + 1
+
+# How payloads arriving from outside the process are decoded, by topic
+DECODERS: List[Tuple[str, Callable[[bytes, str], object]]] = [
+    ("lab/device/+/telemetry", telemetry.decode_telemetry),
+    ("lab/alerts", lambda payload, topic: telemetry.decode_alert(payload)),
+]
+
+def decode(topic: str, payload: bytes):
+    """Decode one broker payload for ``topic``; raises telemetry.DecodeError"""
+    for pattern, decoder in DECODERS:
+        if topic_matches(pattern, topic):
+            return decoder(payload, topic)
+    return telemetry.loads(payload)
+
+class Subscription:
+    """One subscriber: a topic pattern, a bounded queue and the thread draining it into ``handler``"""
+
+    def __init__(self, pattern: str, handler: Callable[[str, object], None], maxlen: int = DEFAULT_QUEUE,
+                 block: bool = False, raw: bool = False):
+        self.pattern = pattern
+        self.handler = handler
+        self.maxlen = maxlen
+        self.block = block
+        self.raw = raw  # handler gets the encoded payload (bytes) instead of the decoded object
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue = deque()
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"bus {pattern}", daemon=True)
+        self._thread.start()
+
+    def offer(self, topic: str, message):
+        with self._cond:
+            if self.block:
+                while len(self._queue) >= self.maxlen and not self._closed:
+                    self._cond.wait()
+            if self._closed:
+                return
+            if len(self._queue) >= self.maxlen:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((topic, message))
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                # Take everything queued in one go; fewer wake-ups under load
+                batch = list(self._queue)
+                self._queue.clear()
+                self._busy = True
+                self._cond.notify_all()
+            for topic, message in batch:
+                try:
+                    self.handler(topic, message)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[bus] Handler for {self.pattern} failed on {topic}: {e}")
+            self.delivered += len(batch)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued message has been handled"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Handle what is queued, then stop the thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def metrics(self) -> Dict:
+        return {"pattern": self.pattern, "depth": len(self._queue), "delivered": self.delivered,
+                "dropped": self.dropped, "errors": self.errors}
+
+class MemoryTransport:
+    """Keeps every message inside the process"""
+
+    def attach(self, bus: "Bus"):
+        pass
+
+    def subscribe(self, pattern: str):
+        pass
+
+    def unsubscribe(self, pattern: str):
+        pass
+
+    def publish(self, topic: str, message, retain: bool = False):
+        pass
+
+    def close(self):
+        pass
+
+class MqttTransport:
+    """One broker connection shared by every component in the process.
+
+    Connects (and reconnects, with backoff) on paho's network thread, so
+    creating a bus never blocks on the broker.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 1883, keepalive: int = 60):
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.bus = None
+        self.connected = False
+        self._patterns: Dict[str, int] = {}  # pattern -> local subscriptions using it
+        self._lock = threading.Lock()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+
+    def attach(self, bus: "Bus"):
+        self.bus = bus
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        print(f"[bus] Connected to {self.host}:{self.port} rc={reason_code}")
+        self.connected = True
+        with self._lock:
+            patterns = list(self._patterns)
+        for pattern in patterns:
+            client.subscribe(pattern, options=SubscribeOptions(qos=0, noLocal=True))
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        self.connected = False
+
+    def _on_message(self, client, userdata, msg):
+        self.bus.receive(msg.topic, msg.payload)
+
+    def subscribe(self, pattern: str):
+        with self._lock:
+            self._patterns[pattern] = self._patterns.get(pattern, 0) + 1
+            first = self._patterns[pattern] == 1
+        if first and self.connected:
+            self.client.subscribe(pattern, options=SubscribeOptions(qos=0, noLocal=True))
+
+    def unsubscribe(self, pattern: str):
+        with self._lock:
+            self._patterns[pattern] -= 1
+            last = self._patterns[pattern] == 0
+            if last:
+                del self._patterns[pattern]
+        if last and self.connected:
+            self.client.unsubscribe(pattern)
+
+    def publish(self, topic: str, message, retain: bool = False):
+        payload = message if isinstance(message, bytes) else telemetry.dumps(message)
+        self.client.publish(topic, payload, retain=retain)
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+class Bus:
+    """Topic-pattern publish/subscribe shared by the hub components of one process"""
+
+    def __init__(self, transport=None):
+        self.transport = transport if transport is not None else MemoryTransport()
+        self._subs: List[Subscription] = []  # replaced, never mutated, so publishers iterate without the lock
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.published = 0
+        self.received = 0
+        self.rejected = 0
+        self.transport.attach(self)
+
+    def subscribe(self, pattern: str, handler: Callable[[str, object], None], maxlen: int = DEFAULT_QUEUE,
+                  block: bool = False, raw: bool = False) -> Subscription:
+        """Call ``handler(topic, message)`` for every message matching ``pattern``"""
+        sub = Subscription(pattern, handler, maxlen, block, raw)
+        with self._lock:
+            self._subs = self._subs + [sub]
+        self.transport.subscribe(pattern)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            if sub not in self._subs:
+                return
+            self._subs = [s for s in self._subs if s is not sub]
+        self.transport.unsubscribe(sub.pattern)
+        sub.close()
+
+    def publish(self, topic: str, message, retain: bool = False):
+        """Deliver a decoded message to local subscribers and pass it to the transport"""
+        self.published += 1
+        encoded = None
+        for sub in self._subs:
+            if topic_matches(sub.pattern, topic):
+                if sub.raw:
+                    encoded = encoded or telemetry.dumps(message)
+                    sub.offer(topic, encoded)
+                else:
+                    sub.offer(topic, message)
+        self.transport.publish(topic, encoded or message, retain)
+
+    def receive(self, topic: str, payload: bytes):
+        """Hand an encoded payload from outside the process to the matching subscribers, decoding it once"""
+        self.received += 1
+        subs = [sub for sub in self._subs if topic_matches(sub.pattern, topic)]
+        message = None
+        if any(not sub.raw for sub in subs):
+            try:
+                message = decode(topic, payload)
+            except telemetry.DecodeError as e:
+                self.rejected += 1
+                print(f"[bus] Rejected payload on {topic}: {e}")
+        for sub in subs:
+            if sub.raw:
+                sub.offer(topic, payload)
+            elif message is not None:
+                sub.offer(topic, message)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every subscriber has handled its queue (handlers may publish more)"""
+        while True:
+            subs = self._subs
+            if not all(sub.wait_idle(timeout) for sub in subs):
+                return False
+            if all(not sub._queue and not sub._busy for sub in self._subs):
+                return True
+
+    def metrics(self) -> Dict:
+        return {"published": self.published, "received": self.received, "rejected": self.rejected,
+                "subscriptions": [sub.metrics() for sub in self._subs]}
+
+    def run_forever(self):
+        """Block the calling thread until close() (or KeyboardInterrupt)"""
+        while not self._stopped.wait(1.0):
+            pass
+
+    def close(self):
+        """Disconnect the transport, then let every subscriber finish its queue"""
+        self._stopped.set()
+        self.transport.close()
+        with self._lock:
+            subs, self._subs = self._subs, []
+        for sub in subs:
+            sub.close()
@@ -0,0 +1,99 @@
+# hub/calibration.py
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+CALIBRATIONS_PATH = os.path.join("config", "calibrations.json")
+NUMERIC_FIELDS = ("last_calibration", "interval_days")
+
+def is_finite_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def _clean(entries) -> Dict[str, Dict]:
+    """Registry entries with anything malformed dropped, so it reads as missing"""
+    if not isinstance(entries, dict):
+        return {}
+    out = {}
+    for device, entry in entries.items():
+        if not isinstance(entry, dict):
+            continue
+        out[device] = {k: v for k, v in entry.items() if k not in NUMERIC_FIELDS or is_finite_number(v)}
+    return out
+
+class CalibrationRegistry:
+    """Last-calibration times per device, persisted as JSON.
+
+    The API records calibrations; the analyzer calls ``refresh()`` before
+    using the registry and only re-reads the file when its mtime changes.
+    """
+
+    def __init__(self, path: str = CALIBRATIONS_PATH):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Reload if the file changed on disk; returns True when reloaded"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        entries = self._read()
+        if entries is None:
+            return False
+        with self._lock:
+            self.entries = entries
+            self._mtime = mtime
+        return True
+
+    def get(self, device: str) -> Dict:
+        return self.entries.get(device, {})
+
+    def last_calibration(self, device: str) -> Optional[float]:
+        return self.get(device).get("last_calibration")
+
+    def record(self, device: str, ts: Optional[float] = None, interval_days: Optional[float] = None) -> Dict:
+        """Record a calibration (now by default) and persist the registry atomically.
+
+        Raises ValueError unless ``ts`` and ``interval_days`` are finite numbers (or None).
+        """
+        for field, value in (("ts", ts), ("interval_days", interval_days)):
+            if value is not None and not is_finite_number(value):
+                raise ValueError(f"{field} must be a finite number, got {value!r}")
+        with self._lock:
+            current = self._read()  # pick up entries written by another process
+            if current is not None:
+                self.entries = current
+            entry = dict(self.entries.get(device, {}))
+            entry["last_calibration"] = time.time() if ts is None else ts
+            if interval_days is not None:
+                entry["interval_days"] = interval_days
+            entries = dict(self.entries)
+            entries[device] = entry
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".calibrations-", dir=directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+            self.entries = entries
+            self._mtime = os.stat(self.path).st_mtime
+        return entry
+
+    def _read(self) -> Optional[Dict]:
+        try:
+            with open(self.path, "r") as f:
+                return _clean(json.load(f))
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"[calibration] Failed to read {self.path}: {e}")
+            return None
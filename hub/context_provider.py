@@ -0,0 +1,225 @@
+# hub/context_provider.py
+"""Lab context for the assistant's prompt, built in-process.
+
+Reads the newest archived telemetry, the AI dashboard snapshot and the
+device registry (``config/*.yaml`` plus calibrations) directly instead of
+calling the API over HTTP, and condenses them into a short per-device
+digest: recent min/max/mean per metric, health and open alert episodes.
+The digest is built at most once per CONTEXT_TTL and shared by every chat
+in that window, and is cut to CONTEXT_MAX_TOKENS, most urgent devices
+first.
+"""
+import glob
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from hub import archive
+from hub.calibration import CalibrationRegistry
+
+CONTEXT_TTL = float(os.getenv("ASSISTANT_CONTEXT_TTL", "5"))               # seconds a digest is reused
+CONTEXT_MAX_TOKENS = int(os.getenv("ASSISTANT_CONTEXT_MAX_TOKENS", "600"))  # digest budget in the prompt
+CONTEXT_SAMPLES = 120    # newest records per device summarized
+MAX_METRICS = 6          # per device line
+MAX_OPEN_ALERTS = 3      # per device line
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English/number mixes (about four characters a token)"""
+    return (len(text) + 3) // 4
+
+def _ago(seconds: float) -> str:
+    if seconds < 90:
+        return f"{seconds:.0f} s ago"
+    if seconds < 5400:
+        return f"{seconds / 60:.0f} min ago"
+    if seconds < 2 * 86400:
+        return f"{seconds / 3600:.0f} h ago"
+    return f"{seconds / 86400:.0f} d ago"
+
+def summarize_records(records: List[Dict]) -> Dict:
+    """Per-metric min/max/mean/last of numeric fields, plus the time span covered"""
+    stats: Dict[str, List[float]] = {}
+    units: Dict[str, str] = {}
+    for d in records:
+        units.update(d.get("units") or {})
+        for key, value in d.items():
+            if key == "ts" or isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            s = stats.get(key)
+            if s is None:
+                stats[key] = [value, value, value, 1, value]  # min, max, sum, n, last
+            else:
+                if value < s[0]:
+                    s[0] = value
+                if value > s[1]:
+                    s[1] = value
+                s[2] += value
+                s[3] += 1
+                s[4] = value
+    stamps = [d["ts"] for d in records if isinstance(d.get("ts"), (int, float))]
+    return {
+        "metrics": {key: {"min": s[0], "max": s[1], "mean": s[2] / s[3], "last": s[4], "unit": units.get(key, "")}
+                    for key, s in stats.items()},
+        "samples": len(records),
+        "first_ts": min(stamps) if stamps else None,
+        "last_ts": max(stamps) if stamps else None
+    }
+
+def open_episodes(alerts) -> Dict[str, List[Dict]]:
+    """device -> alerts whose episode is still open in this window (newest record per episode)"""
+    latest: Dict[str, Dict] = {}
+    for alert in alerts:
+        episode = alert.get("episode_id")
+        if episode is not None:
+            latest[episode] = alert
+    out: Dict[str, List[Dict]] = {}
+    for alert in latest.values():
+        if alert.get("state") in ("open", "ongoing"):
+            out.setdefault(alert.get("device"), []).append(alert)
+    return out
+
+class ContextProvider:
+    """TTL-cached lab digest for the assistant"""
+
+    def __init__(self, dashboard=None, data_dir: str = "data", config_dir: str = "config",
+                 ttl: float = CONTEXT_TTL, max_tokens: int = CONTEXT_MAX_TOKENS):
+        self.dashboard = dashboard  # AIDashboardAPI; None leaves health and alerts out
+        self.data_dir = data_dir
+        self.config_dir = config_dir
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.calibrations = CalibrationRegistry(os.path.join(config_dir, "calibrations.json"))
+        self._context: Optional[Dict] = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        # path -> ((size, mtime), summary); a device file is only re-read once it has grown
+        self._summaries: Dict[str, Tuple[Tuple[int, float], Dict]] = {}
+        self.hits = 0
+        self.builds = 0
+        self.build_ms = 0.0
+
+    def get(self) -> Dict:
+        """The current context, rebuilt when older than ``ttl`` (one builder at a time)"""
+        context = self._context
+        if context is not None and time.monotonic() < self._expires:
+            self.hits += 1
+            return context
+        with self._lock:
+            if self._context is not None and time.monotonic() < self._expires:
+                self.hits += 1
+                return self._context
+            start = time.perf_counter()
+            try:
+                context = self.build()
+            except Exception as e:
+                print(f"[Lab Assistant] Context build failed: {e}")
+                context = self._context or {"digest": "No lab data available", "devices": [],
+                                            "system_health": "unknown", "tokens": 0}
+            self.build_ms = (time.perf_counter() - start) * 1e3
+            self.builds += 1
+            self._context = context
+            self._expires = time.monotonic() + self.ttl
+            return context
+
+    def invalidate(self):
+        self._expires = 0.0
+
+    def registry(self) -> Dict[str, Dict]:
+        """Configured devices (config/*.yaml) by name"""
+        devices = {}
+        for path in sorted(glob.glob(os.path.join(self.config_dir, "*.yaml"))):
+            try:
+                with open(path, "r") as f:
+                    cfg = yaml.safe_load(f) or {}
+            except Exception:
+                continue
+            if isinstance(cfg, dict) and cfg.get("name"):
+                devices[cfg["name"]] = cfg
+        return devices
+
+    def _summary(self, device: str, paths: List[str]) -> Dict:
+        newest = paths[-1]
+        try:
+            st = os.stat(newest)
+            stamp = (st.st_size, st.st_mtime)
+        except OSError:
+            stamp = None
+        cached = self._summaries.get(newest)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        summary = summarize_records(archive.tail_device(device, paths, CONTEXT_SAMPLES))
+        self._summaries[newest] = (stamp, summary)
+        return summary
+
+    def build(self, now: Optional[float] = None) -> Dict:
+        now = time.time() if now is None else now
+        registry = self.registry()
+        files = archive.device_files(self.data_dir)
+        self._summaries = {path: entry for path, entry in self._summaries.items()
+                           if any(path == paths[-1] for paths in files.values())}
+        self.calibrations.refresh()
+
+        health, episodes, status = {}, {}, "unknown"
+        if self.dashboard is not None:
+            snapshot = self.dashboard.dashboard.snapshot
+            health = snapshot.device_health
+            episodes = open_episodes(snapshot.alerts)
+            status = self.dashboard.get_ai_insights().get("system_health", {}).get("status", "unknown")
+
+        names = set(registry) | set(files) | set(health) | {d for d in episodes if d}
+        entries = []
+        for name in names:
+            summary = self._summary(name, files[name]) if name in files else None
+            score = health.get(name, {}).get("health_score")
+            open_alerts = sorted(episodes.get(name, []), key=lambda a: a.get("ts", 0.0), reverse=True)
+            line = self._device_line(name, registry.get(name), summary, score, open_alerts, now)
+            # Devices needing attention first: open alerts, then poor health
+            entries.append(((-len(open_alerts), score if score is not None else 1.0, name), line))
+        entries.sort(key=lambda e: e[0])
+
+        lines, used = [], 0
+        for i, (_, line) in enumerate(entries):
+            cost = estimate_tokens(line) + 1
+            reserve = 10 if i < len(entries) - 1 else 0  # room for the "more devices" line
+            if used + cost + reserve > self.max_tokens:
+                lines.append(f"- ... {len(entries) - i} more devices not shown")
+                break
+            lines.append(line)
+            used += cost
+        digest = "\n".join(lines) if lines else "No devices registered or recorded yet"
+        return {"digest": digest, "devices": sorted(names), "system_health": status,
+                "tokens": estimate_tokens(digest), "built": now}
+
+    def _device_line(self, name: str, cfg: Optional[Dict], summary: Optional[Dict], score: Optional[float],
+                     open_alerts: List[Dict], now: float) -> str:
+        parts = [f"- {name}"]
+        if cfg and cfg.get("driver"):
+            parts[0] += f" ({cfg['driver']})"
+        if summary and summary["samples"]:
+            window = f"last {summary['samples']} samples"
+            if summary["last_ts"] is not None:
+                span = summary["last_ts"] - summary["first_ts"]
+                window += f" over {span / 60:.0f} min, newest {_ago(now - summary['last_ts'])}"
+            parts.append(window)
+            for metric, m in list(summary["metrics"].items())[:MAX_METRICS]:
+                unit = m["unit"]
+                parts.append(f"{metric} {m['last']:.4g}{unit} (min {m['min']:.4g}, max {m['max']:.4g}, "
+                             f"mean {m['mean']:.4g})")
+        else:
+            parts.append("no telemetry recorded")
+        if score is not None:
+            parts.append(f"health {score:.2f}")
+        calibrated = self.calibrations.last_calibration(name)
+        if calibrated is not None:
+            parts.append(f"calibrated {_ago(now - calibrated)}")
+        if open_alerts:
+            shown = [f"{a.get('type')}{' on ' + a['metric'] if a.get('metric') else ''} since "
+                     f"{_ago(now - a.get('started', a.get('ts', now)))}" for a in open_alerts[:MAX_OPEN_ALERTS]]
+            more = len(open_alerts) - len(shown)
+            parts.append("open alerts: " + ", ".join(shown) + (f" (+{more} more)" if more else ""))
+        else:
+            parts.append("no open alerts")
+        return "; ".join(parts)
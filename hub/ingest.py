@@ -0,0 +1,155 @@
+# hub/ingest.py
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, Optional, Tuple
+
+POLICIES = ("block", "drop_oldest", "downsample")
+
+class IngestQueue:
+    """Bounded hand-off between the MQTT network thread and analysis.
+
+    ``put`` never grows the queue past ``capacity``; what happens when it is
+    full depends on ``policy``:
+
+    - ``block``: the producer waits, so backpressure reaches the broker
+    - ``drop_oldest``: the oldest queued record is discarded
+    - ``downsample``: above ``high_water`` each device keeps only 1 in
+      ``factor`` records; the factor doubles while the queue stays full and
+      halves once it drains below ``low_water``.  A full queue still drops
+      the oldest record, so memory stays bounded.
+
+    Depth, drops and lag (time a record waited in the queue, and record age
+    from its own ``ts``) are reported by ``metrics()``.
+    """
+
+    def __init__(self, capacity: int = 1000, policy: str = "downsample", max_factor: int = 64,
+                 clock: Callable[[], float] = time.time):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overload policy {policy!r}; expected one of {POLICIES}")
+        self.capacity = capacity
+        self.policy = policy
+        self.high_water = capacity // 2
+        self.low_water = capacity // 4
+        self.max_factor = max_factor
+        self.clock = clock
+        self.factor = 1  # downsample: keep 1 in factor records per device
+        self._since_change = 0
+        self._items = deque()  # (received, device, record)
+        self._seen = defaultdict(int)  # device -> records offered while downsampling
+        self._cond = threading.Condition()
+        self._closed = False
+        self.enqueued = 0
+        self.processed = 0
+        self.max_depth = 0
+        self.dropped = defaultdict(int)  # reason -> count
+        self.dropped_by_device = defaultdict(int)
+        self._wait_sum = 0.0
+        self._wait_max = 0.0
+        self._age_max = 0.0
+        self._lag_samples = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, device: str, record: Dict) -> bool:
+        """Queue a record; returns False when it was shed or the queue is closed"""
+        with self._cond:
+            if self._closed:
+                return False
+            depth = len(self._items)
+            if self.policy == "downsample":
+                # Give each factor a quarter queue of arrivals to take effect before changing it again
+                self._since_change += 1
+                if self._since_change >= self.capacity // 4:
+                    if depth >= self.capacity and self.factor < self.max_factor:
+                        self._set_factor(self.factor * 2)
+                    elif depth < self.low_water and self.factor > 1:
+                        self._set_factor(self.factor // 2)
+                if self.factor > 1 and depth >= self.high_water:
+                    self._seen[device] += 1
+                    if self._seen[device] % self.factor:
+                        self._drop("downsampled", device)
+                        return False
+            if depth >= self.capacity:
+                if self.policy == "block":
+                    while len(self._items) >= self.capacity and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return False
+                else:
+                    _, old_device, _ = self._items.popleft()
+                    self._drop("overflow", old_device)
+            self._items.append((self.clock(), device, record))
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[str, Dict]]:
+        """Next (device, record), or None on timeout or once closed and drained"""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            received, device, record = self._items.popleft()
+            self._cond.notify_all()
+            now = self.clock()
+            wait = now - received
+            self._wait_sum += wait
+            self._wait_max = max(self._wait_max, wait)
+            ts = record.get("ts")
+            if isinstance(ts, (int, float)):
+                self._age_max = max(self._age_max, now - ts)
+            self._lag_samples += 1
+            self.processed += 1
+            return device, record
+
+    def close(self):
+        """Stop accepting records and wake every waiter; queued records can still be drained"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def metrics(self, reset_lag: bool = True) -> Dict:
+        """Depth and drop gauges; lag figures cover the period since the last call"""
+        with self._cond:
+            oldest = self.clock() - self._items[0][0] if self._items else 0.0
+            out = {
+                "policy": self.policy,
+                "capacity": self.capacity,
+                "depth": len(self._items),
+                "max_depth": self.max_depth,
+                "oldest_wait": oldest,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "dropped": dict(self.dropped),
+                "dropped_by_device": dict(self.dropped_by_device),
+                "downsample_factor": self.factor,
+                "avg_wait": self._wait_sum / self._lag_samples if self._lag_samples else 0.0,
+                "max_wait": self._wait_max,
+                "max_record_age": self._age_max
+            }
+            if reset_lag:
+                self._wait_sum = self._wait_max = self._age_max = 0.0
+                self._lag_samples = 0
+                self.max_depth = len(self._items)
+            return out
+
+    def _drop(self, reason: str, device: str):
+        self.dropped[reason] += 1
+        self.dropped_by_device[device] += 1
+
+    def _set_factor(self, factor: int):
+        if factor == self.factor:
+            return
+        print(f"[ingest] Backlog {len(self._items)}/{self.capacity}: keeping 1 in {factor} records per device"
+              if factor > 1 else "[ingest] Backlog cleared; keeping every record")
+        self.factor = factor
+        self._since_change = 0
+        self._seen.clear()
@@ -1,26 +1,62 @@
 # hub/lab_assistant.py
+import asyncio
 import os
 import json
+import re
+import threading
 import time
-from typing import Dict, List, Optional
-from collections import deque
-import openai
-from openai import OpenAI
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from hub.ai_dashboard import ai_dashboard
+from hub.context_provider import ContextProvider
+from hub.prompt_budget import PromptBuilder
+from hub.sessions import Session, SessionStore
+
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "4"))         # LLM calls in flight at once
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "10"))  # seconds a chat may wait for a slot
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "60"))              # seconds per LLM request
+DEMO_TOKEN_DELAY = 0.02  # seconds between words when streaming a demo response
+
+# The fixed part of the system prompt, after the lab context
+SYSTEM_INSTRUCTIONS = """
+Your capabilities:
+1. Analyze experiment data and identify issues
+2. Suggest optimal parameters for experiments
+3. Explain technical concepts
+4. Help troubleshoot instrument problems
+5. Provide recommendations for improving measurements
+
+Be helpful, technical, and actionable. If you detect problems, suggest specific solutions. If you can take actions, mention them clearly.
+
+Available actions you can suggest:
+- set_voltage: Adjust voltage settings
+- start_measurement: Begin new measurements
+- check_instrument: Verify instrument status
+- analyze_data: Perform detailed analysis
+
+Always be specific and provide actionable advice based on the lab context."""
+
+class ChatBusy(RuntimeError):
+    """Every chat slot stayed taken for CHAT_QUEUE_TIMEOUT"""
 
 class LabAssistant:
     """Conversational AI assistant for lab experiments"""
     
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self._client = None
+        self._async_client = None
         if self.api_key:
-            self.client = OpenAI(api_key=self.api_key)
             print(f"[Lab Assistant] ✅ Using OpenAI API with key: {self.api_key[:20]}...")
         else:
-            self.client = None
             print("[Lab Assistant] ❌ No OpenAI API key found. Running in demo mode.")
         
-        self.conversation_history = deque(maxlen=50)
+        self.session = Session("default")  # used when a caller brings no session of its own
         self.context_data = {}
+        self.prompt_builder = PromptBuilder()
+        # Token accounting: totals over all LLM requests, and the latest request's prompt breakdown
+        self.token_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                            "evicted_messages": 0, "truncated_messages": 0, "last": None}
         self.available_actions = {
             "set_voltage": self._set_voltage,
             "start_measurement": self._start_measurement,
@@ -28,92 +64,146 @@ class LabAssistant:
             "analyze_data": self._analyze_data
         }
     
+    @property
+    def client(self):
+        """OpenAI client, created on first use (importing openai takes about half a second)"""
+        if self._client is None and self.api_key:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key, timeout=CHAT_TIMEOUT)
+        return self._client
+    
+    @property
+    def async_client(self):
+        """AsyncOpenAI client for the API's event loop, created on first use"""
+        if self._async_client is None and self.api_key:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(api_key=self.api_key, timeout=CHAT_TIMEOUT)
+        return self._async_client
+    
+    @property
+    def conversation_history(self):
+        """History of the default session"""
+        return self.session.history
+    
     def update_context(self, context: Dict):
         """Update the assistant's context with current lab data"""
         self.context_data.update(context)
     
-    def chat(self, user_message: str) -> str:
+    def chat(self, user_message: str, session: Optional[Session] = None) -> str:
         """Process user message and return AI response"""
+        session = session or self.session
         # Add to conversation history
-        self.conversation_history.append({"role": "user", "content": user_message})
+        session.append({"role": "user", "content": user_message})
         
         if not self.client:
             return self._demo_response(user_message)
         
         try:
-            # Build system prompt with lab context
-            system_prompt = self._build_system_prompt()
-            
-            # Create messages for OpenAI
-            messages = [
-                {"role": "system", "content": system_prompt},
-                *list(self.conversation_history)[-10:]  # Last 10 messages
-            ]
-            
             # Get response from OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                max_tokens=500,
-                temperature=0.7
-            )
-            
-            ai_response = response.choices[0].message.content
+            response = self.client.chat.completions.create(**self._completion_request(session))
+            self._record_usage(response.usage)
+            return self._finish(response.choices[0].message.content, session)
             
-            # Add AI response to history
-            self.conversation_history.append({"role": "assistant", "content": ai_response})
-            
-            # Check for actionable items
-            actions = self._extract_actions(ai_response)
-            if actions:
-                ai_response += f"\n\n🤖 I can help with: {', '.join(actions)}"
-            
-            return ai_response
+        except Exception as e:
+            print(f"[Lab Assistant] Error: {e}")
+            return self._demo_response(user_message)
+    
+    async def achat(self, user_message: str, session: Optional[Session] = None) -> str:
+        """chat() for the event loop: the LLM call is awaited instead of holding a thread"""
+        session = session or self.session
+        session.append({"role": "user", "content": user_message})
+        
+        if not self.async_client:
+            return self._demo_response(user_message)
+        
+        try:
+            response = await self.async_client.chat.completions.create(**self._completion_request(session))
+            self._record_usage(response.usage)
+            return self._finish(response.choices[0].message.content, session)
             
         except Exception as e:
             print(f"[Lab Assistant] Error: {e}")
             return self._demo_response(user_message)
     
-    def _build_system_prompt(self) -> str:
-        """Build system prompt with current lab context"""
-        current_time = time.strftime("%Y-%m-%d %H:%M:%S")
+    async def astream(self, user_message: str, session: Optional[Session] = None) -> AsyncIterator[str]:
+        """achat() as a stream of text fragments; history is saved once the reply is complete"""
+        session = session or self.session
+        session.append({"role": "user", "content": user_message})
         
-        # Get current data summary
-        data_summary = "No data available"
-        if self.context_data.get('current_data'):
-            data = self.context_data['current_data']
-            data_summary = f"Current voltage: {data.get('voltage', 'N/A')}V, Current: {data.get('current', 'N/A')}A"
+        if self.async_client:
+            parts = []
+            try:
+                stream = await self.async_client.chat.completions.create(
+                    **self._completion_request(session), stream=True, stream_options={"include_usage": True})
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        self._record_usage(chunk.usage)  # the final chunk, without choices
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+            except Exception as e:
+                print(f"[Lab Assistant] Error: {e}")
+                if parts:
+                    return  # the reader already has part of a reply; don't append a canned one
+            else:
+                text = "".join(parts)
+                hint = self._finish(text, session)[len(text):]
+                if hint:
+                    yield hint
+                return
         
-        # Get AI insights
-        ai_insights = "No insights available"
-        if self.context_data.get('ai_insights'):
-            insights = self.context_data['ai_insights']
-            ai_insights = f"System health: {insights.get('system_health', {}).get('status', 'unknown')}"
+        # Demo mode (or the LLM call failed before any text): stream the canned reply word by word
+        for word in re.findall(r"\S+\s*|\s+", self._demo_response(user_message)):
+            yield word
+            await asyncio.sleep(DEMO_TOKEN_DELAY)
+    
+    def _completion_request(self, session: Session) -> Dict:
+        # System prompt and history fitted to the token budget (hub.prompt_budget)
+        prompt = self.prompt_builder.build(self._system_sections(), list(session.history))
+        m = prompt.metrics
+        self.token_usage["last"] = m
+        self.token_usage["evicted_messages"] += m["evicted_messages"]
+        self.token_usage["truncated_messages"] += m["user_truncated"]
+        print(f"[Lab Assistant] Prompt {m['prompt_tokens']}/{m['budget']} tokens ({m['tokenizer']}): "
+              f"{m['history_messages']} earlier messages, {m['evicted_messages']} evicted"
+              + (", summarized" if m['summarized'] else "") + (", question truncated" if m['user_truncated'] else ""))
+        return {"model": "gpt-4", "messages": prompt.messages, "max_tokens": 500, "temperature": 0.7}
+    
+    def _record_usage(self, usage):
+        """Add the token counts the API reports for one request"""
+        if usage is None:
+            return
+        self.token_usage["requests"] += 1
+        self.token_usage["prompt_tokens"] += usage.prompt_tokens or 0
+        self.token_usage["completion_tokens"] += usage.completion_tokens or 0
+    
+    def _finish(self, ai_response: str, session: Session) -> str:
+        # Add AI response to history
+        session.append({"role": "assistant", "content": ai_response})
+        
+        # Check for actionable items
+        actions = self._extract_actions(ai_response)
+        if actions:
+            ai_response += f"\n\n🤖 I can help with: {', '.join(actions)}"
+        
+        return ai_response
+    
+    def _system_sections(self) -> List[tuple]:
+        """System prompt as (text, required) sections; only the lab digest may be cut to fit the budget"""
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S")
         
-        return f"""You are an intelligent lab assistant for a physics/engineering laboratory. You help scientists with experiments, data analysis, and troubleshooting.
+        # Per-device digest from hub.context_provider (recent stats, health, open alerts)
+        digest = self.context_data.get('digest', "No lab data available")
+        status = self.context_data.get('system_health', "unknown")
+        
+        header = f"""You are an intelligent lab assistant for a physics/engineering laboratory. You help scientists with experiments, data analysis, and troubleshooting.
 
 Current Lab Context:
 - Time: {current_time}
-- Current Data: {data_summary}
-- AI Insights: {ai_insights}
-- Available Instruments: {list(self.context_data.get('instruments', []))}
-
-Your capabilities:
-1. Analyze experiment data and identify issues
-2. Suggest optimal parameters for experiments
-3. Explain technical concepts
-4. Help troubleshoot instrument problems
-5. Provide recommendations for improving measurements
-
-Be helpful, technical, and actionable. If you detect problems, suggest specific solutions. If you can take actions, mention them clearly.
-
-Available actions you can suggest:
-- set_voltage: Adjust voltage settings
-- start_measurement: Begin new measurements
-- check_instrument: Verify instrument status
-- analyze_data: Perform detailed analysis
-
-Always be specific and provide actionable advice based on the lab context."""
+- System health: {status}
+- Instruments (recent readings, health, open alerts):"""
+        return [(header, True), (digest, False), (SYSTEM_INSTRUCTIONS, True)]
     
     def _extract_actions(self, response: str) -> List[str]:
         """Extract potential actions from AI response"""
@@ -221,39 +311,108 @@ class LabAssistantAPI:
     """FastAPI integration for lab assistant"""
     
     def __init__(self):
-        self.assistant = LabAssistant()
-        self.update_context_from_lab()
+        self.assistant = LabAssistant()  # lab context is refreshed per chat message
+        self.context = ContextProvider(ai_dashboard)
+        self.sessions = SessionStore()
+        self._slots = asyncio.Semaphore(CHAT_CONCURRENCY)
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}  # (session id, normalized question) -> shared answer
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.coalesced = 0
+        self.rejected = 0
+    
+    def warm_up(self) -> threading.Thread:
+        """Create the OpenAI client and load the tokenizer in the background so the first chat does not pay for them"""
+        self.assistant.prompt_builder.counter.start_loading()
+        thread = threading.Thread(target=lambda: self.assistant.client, name="assistant-warm-up", daemon=True)
+        thread.start()
+        return thread
     
     def update_context_from_lab(self):
-        """Update assistant context with current lab data"""
-        try:
-            # Get latest data
-            import requests
-            response = requests.get("http://localhost:8001/latest", timeout=2)
-            if response.ok:
-                current_data = response.json()
-                self.assistant.update_context({
-                    'current_data': current_data,
-                    'instruments': ['scope1', 'multimeter1', 'power_supply1']
-                })
-        except:
-            pass
-        
-        try:
-            # Get AI insights
-            response = requests.get("http://localhost:8001/ai/insights", timeout=2)
-            if response.ok:
-                ai_insights = response.json()
-                self.assistant.update_context({
-                    'ai_insights': ai_insights
-                })
-        except:
-            pass
+        """Update assistant context with current lab data (cached for CONTEXT_TTL, no I/O on a hit)"""
+        self.assistant.update_context(self.context.get())
     
-    def chat(self, message: str) -> str:
+    def session(self, session_id: Optional[str] = None) -> Session:
+        """The conversation for ``session_id``, or a new one (check ``.id``) for an unknown or missing id"""
+        return self.sessions.get(session_id)
+    
+    def chat(self, message: str, session: Optional[Session] = None) -> str:
         """Process chat message"""
+        session = session or self.session()
         self.update_context_from_lab()
-        return self.assistant.chat(message)
+        try:
+            return self.assistant.chat(message, session)
+        finally:
+            self.sessions.commit(session)
+    
+    async def achat(self, message: str, session: Optional[Session] = None) -> str:
+        """Async chat: at most CHAT_CONCURRENCY LLM calls at once; a question repeated within
+        one session while the first is still being answered shares that answer.
+
+        Raises ChatBusy when no slot frees up within CHAT_QUEUE_TIMEOUT.
+        """
+        session = session or self.session()
+        # Per session: the answer depends on the conversation so far
+        key = (session.id, " ".join(message.lower().split()))
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self.coalesced += 1
+        else:
+            shared = self._inflight[key] = asyncio.ensure_future(self._achat(message, session))
+            shared.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A disconnecting client must not cancel the answer others are waiting for
+        return await asyncio.shield(shared)
+    
+    async def _achat(self, message: str, session: Session) -> str:
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), CHAT_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ChatBusy(f"all {CHAT_CONCURRENCY} chat slots busy for {CHAT_QUEUE_TIMEOUT:.0f} s") from None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            await asyncio.to_thread(self.update_context_from_lab)
+            return await self.assistant.achat(message, session)
+        finally:
+            self.sessions.commit(session)
+            self.active -= 1
+            self.completed += 1
+            self._slots.release()
+    
+    async def astream(self, message: str, session: Optional[Session] = None) -> AsyncIterator[str]:
+        """Streamed chat under the same concurrency cap; raises ChatBusy before the first fragment"""
+        session = session or self.session()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), CHAT_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ChatBusy(f"all {CHAT_CONCURRENCY} chat slots busy for {CHAT_QUEUE_TIMEOUT:.0f} s") from None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            await asyncio.to_thread(self.update_context_from_lab)
+            async for fragment in self.assistant.astream(message, session):
+                yield fragment
+        finally:
+            self.sessions.commit(session)
+            self.active -= 1
+            self.completed += 1
+            self._slots.release()
+    
+    def metrics(self) -> Dict:
+        return {"concurrency": CHAT_CONCURRENCY, "active": self.active, "waiting": self.waiting,
+                "in_flight_questions": len(self._inflight), "completed": self.completed,
+                "coalesced": self.coalesced, "rejected": self.rejected,
+                "context": {"builds": self.context.builds, "hits": self.context.hits,
+                            "last_build_ms": self.context.build_ms},
+                "tokens": self.assistant.token_usage,
+                "sessions": self.sessions.metrics()}
     
     def execute_action(self, action: str, parameters: Dict = None) -> str:
         """Execute an action"""
@@ -0,0 +1,423 @@
+# hub/metric_state.py
+import math
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Payload fields that are never metrics
+RESERVED_FIELDS = frozenset(("ts", "device", "idn", "units"))
+
+VECTOR_METRICS = 32  # DeviceStats switches to NumPy arrays above this many metrics (the measured crossover)
+
+class MetricRegistry:
+    """Maps metric names to dense ids shared by all devices.
+
+    Metrics come from config (``metrics:`` in a device YAML) or are discovered
+    from numeric payload fields the first time they are seen.
+    """
+
+    def __init__(self, metrics: Iterable[str] = ()):
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self._lock = threading.Lock()
+        for name in metrics:
+            self.id_for(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_for(self, name: str) -> int:
+        mid = self.ids.get(name)
+        if mid is None:
+            with self._lock:
+                mid = self.ids.get(name)
+                if mid is None:
+                    mid = len(self.names)
+                    self.names.append(name)
+                    self.ids[name] = mid
+        return mid
+
+    def extract(self, payload: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        """Metric ids (ascending) and values for the numeric fields of a payload"""
+        pairs = sorted(
+            (self.id_for(k), float(v)) for k, v in payload.items()
+            if k not in RESERVED_FIELDS and isinstance(v, (int, float)) and not isinstance(v, bool)
+        )
+        if not pairs:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        ids, values = zip(*pairs)
+        return np.array(ids, dtype=np.intp), np.array(values)
+
+class MetricIndex:
+    """Dense per-device rows for global metric ids, in the order the device first reports them"""
+
+    __slots__ = ("table", "ids", "ordered")
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.ids: List[int] = [int(mid) for mid in ids]  # row -> global id
+        self.table = np.full(max(self.ids, default=-1) + 1, -1, dtype=np.intp)  # global id -> row, -1 if none
+        self.table[self.ids] = np.arange(len(self.ids))
+        # Rows ascend with ids, so a run of ids in a sample is a run of rows
+        self.ordered = all(a < b for a, b in zip(self.ids, self.ids[1:]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        """Rows for ascending metric ids, adding rows for ids the device has not reported before"""
+        table = self.table
+        if ids[-1] >= len(table):
+            table = np.full(max(int(ids[-1]) + 1, 8), -1, dtype=np.intp)
+            table[:len(self.table)] = self.table
+            self.table = table
+        rows = table[ids]
+        missing = ids[rows < 0]
+        if len(missing):
+            if self.ids and missing[0] < self.ids[-1]:
+                self.ordered = False
+            start = len(self.ids)
+            table[missing] = np.arange(start, start + len(missing))
+            self.ids.extend(missing.tolist())
+            rows = table[ids]
+        return rows
+
+    def span(self, rows: np.ndarray):
+        """A slice for a contiguous run of rows (no gather/scatter copies), else the rows"""
+        if self.ordered and rows[-1] - rows[0] + 1 == len(rows):
+            return slice(int(rows[0]), int(rows[-1]) + 1)
+        return rows
+
+class MetricStats:
+    """Running statistics for one metric; DeviceStats' per-metric path"""
+
+    __slots__ = ("n", "mean", "M2", "ema", "sum_y", "sum_iy", "hist", "raw")
+
+    def __init__(self, slope_window: int, raw_window: int):
+        self.n = 0
+        self.mean = 0.0
+        self.M2 = 0.0
+        self.ema = 0.0
+        self.sum_y = 0.0
+        self.sum_iy = 0.0
+        self.hist = array("d", bytes(8 * slope_window))  # ring buffers indexed by (n - 1) % window
+        self.raw = array("d", bytes(8 * raw_window))
+
+class DeviceStats:
+    """Running statistics for every metric of one device.
+
+    Per metric: Welford mean/M2, an EMA, a ring buffer of recent EMA values
+    with running sums for an O(1) least-squares slope (the recurrence of
+    hub.streaming.WindowedSlope), and a ring buffer of recent raw values (for
+    correlation).  Metrics get dense rows in the order the device first
+    reports them, so a device only holds its own metrics.
+
+    Up to ``vector_min`` metrics, each has a MetricStats updated in plain
+    Python: for a handful of values that beats NumPy's per-call overhead.  A
+    wider device moves to struct-of-arrays storage updated with a few
+    vectorized operations per sample (bench/streaming_kernels.py measures
+    both paths against the old per-metric objects).  Either way a metric
+    holds ``48 + 8 * (slope_window + raw_window)`` bytes of state: six 8-byte
+    scalars plus the two rings.  The per-metric objects add about 500 bytes
+    of Python overhead each; the arrays add spare rows and a row table of 8
+    bytes per global metric id, both counted in ``nbytes``.
+    """
+
+    __slots__ = ("alpha", "slope_window", "raw_window", "vector_min", "terms", "metrics", "index", "capacity",
+                 "n", "mean", "M2", "ema", "hist", "sum_y", "sum_iy", "raw")
+
+    FIELDS = ("n", "mean", "M2", "ema", "hist", "sum_y", "sum_iy", "raw")
+
+    def __init__(self, ema_alpha: float = 0.2, slope_window: int = 30, raw_window: int = 50,
+                 vector_min: int = VECTOR_METRICS):
+        self.alpha = ema_alpha
+        self.slope_window = slope_window
+        self.raw_window = raw_window
+        self.vector_min = vector_min
+        # Least-squares terms by window length: (length, sum of i, length * sum of i^2 - (sum of i)^2)
+        self.terms = [(L, L * (L - 1) / 2, L * L * (L * L - 1) / 12) for L in range(slope_window + 1)]
+        self.metrics: Optional[Dict[int, MetricStats]] = {}  # global id -> stats; None once vectorized
+        self.index: Optional[MetricIndex] = None
+        self.capacity = 0
+
+    def __len__(self):
+        return len(self.metrics) if self.metrics is not None else len(self.index)
+
+    @property
+    def nbytes(self) -> int:
+        if self.metrics is not None:
+            return len(self.metrics) * (48 + 8 * (self.slope_window + self.raw_window))
+        return sum(getattr(self, f).nbytes for f in self.FIELDS) + self.index.table.nbytes
+
+    def update(self, ids: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """Fold one sample (ascending metric ids + values) into the running statistics.
+
+        Returns (n, mean, std, slope, ema) of the sample's metrics after the
+        update; the slope is the per-sample least-squares slope of the EMA
+        over the slope window.
+        """
+        if len(ids) == 0:
+            return (np.empty(0),) * 5
+        metrics = self.metrics
+        if metrics is not None:
+            keys = ids.tolist()
+            if len(metrics) + len(keys) <= self.vector_min or \
+                    len(metrics) + sum(mid not in metrics for mid in keys) <= self.vector_min:
+                return self._update_metrics(keys, values.tolist())
+            self._set_arrays(self.get_state())
+        return self._update_arrays(ids, values)
+
+    def _update_metrics(self, ids: List[int], values: List[float]) -> Tuple[np.ndarray, ...]:
+        alpha, w, rw, terms = self.alpha, self.slope_window, self.raw_window, self.terms
+        metrics = self.metrics
+        k = len(ids)
+        out = [0.0] * (5 * k)  # n, mean, std, slope and ema columns, one after the other
+        for i, (mid, x) in enumerate(zip(ids, values)):
+            m = metrics.get(mid)
+            if m is None:
+                m = metrics[mid] = MetricStats(w, rw)
+            n = m.n + 1
+            # Welford
+            mean = m.mean
+            delta = x - mean
+            mean += delta / n
+            M2 = m.M2 + delta * (x - mean)
+            # EMA (seeded with the first value)
+            ema = m.ema + (x - m.ema) * alpha if n > 1 else x
+            # Slope window: slide the running sums, then overwrite the oldest slot
+            slot = (n - 1) % w
+            hist = m.hist
+            if n > w:
+                oldest = hist[slot]
+                sum_iy = m.sum_iy + (w - 1) * ema - (m.sum_y - oldest)
+                sum_y = m.sum_y + ema - oldest
+            else:
+                sum_iy = m.sum_iy + (n - 1) * ema
+                sum_y = m.sum_y + ema
+            hist[slot] = ema
+            m.raw[(n - 1) % rw] = x
+            if slot == w - 1:
+                # The ring is in age order; rebuild the sums to shed rounding error
+                sum_y = math.fsum(hist)
+                sum_iy = math.fsum(j * y for j, y in enumerate(hist))
+            m.n, m.mean, m.M2, m.ema, m.sum_y, m.sum_iy = n, mean, M2, ema, sum_y, sum_iy
+            length, sum_i, denom = terms[n if n < w else w]
+            out[i] = n
+            out[k + i] = mean
+            out[2 * k + i] = math.sqrt(M2 / (n - 1)) if n > 1 else 0.0
+            out[3 * k + i] = (length * sum_iy - sum_i * sum_y) / denom if denom else 0.0
+            out[4 * k + i] = ema
+        return tuple(np.array(out).reshape(5, k))
+
+    def _update_arrays(self, ids: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, ...]:
+        rows = self.index.rows(ids)
+        if len(self.index) > self.capacity:
+            self._grow(max(len(self.index), 2 * self.capacity))
+        sel = self.index.span(rows)
+        # Welford
+        n = self.n[sel] + 1
+        self.n[sel] = n
+        delta = values - self.mean[sel]
+        mean = self.mean[sel] + delta / n
+        self.mean[sel] = mean
+        M2 = self.M2[sel] + delta * (values - mean)
+        self.M2[sel] = M2
+        # EMA (seeded with the first value)
+        prev = self.ema[sel]
+        ema = prev + (values - prev) * np.maximum(self.alpha, n == 1)
+        self.ema[sel] = ema
+        # Slope window: slide the running sums, then overwrite the oldest slot
+        w = self.slope_window
+        slot = (n - 1) % w
+        full = n > w
+        length = np.minimum(n - 1, w)
+        oldest = self.hist[rows, slot] * full
+        sum_y = self.sum_y[sel]
+        sum_iy = self.sum_iy[sel] + (length - full) * ema - full * (sum_y - oldest)
+        sum_y = sum_y - oldest + ema
+        self.hist[rows, slot] = ema
+        self.raw[rows, (n - 1) % self.raw_window] = values
+        # Once per window the ring is in age order; rebuild the sums to shed rounding error
+        wrapped = slot == w - 1
+        if wrapped.any():
+            hist = self.hist[rows[wrapped]]
+            sum_y[wrapped] = hist.sum(axis=1)
+            sum_iy[wrapped] = hist @ np.arange(w)
+        self.sum_y[sel] = sum_y
+        self.sum_iy[sel] = sum_iy
+        std = np.sqrt(M2 / np.maximum(n - 1, 1)) * (n > 1)
+        length = np.minimum(n, w).astype(float)
+        sum_i = length * (length - 1) / 2
+        denom = length * (length - 1) * length * (2 * length - 1) / 6 - sum_i * sum_i
+        slope = np.where(length >= 2, (length * sum_iy - sum_i * sum_y) / np.where(denom > 0, denom, 1.0), 0.0)
+        return n, mean, std, slope, ema
+
+    def _grow(self, capacity: int):
+        extra = capacity - self.capacity
+        if extra <= 0:
+            return
+        self.n = np.concatenate([self.n, np.zeros(extra, dtype=np.int64)])
+        for f in ("mean", "M2", "ema", "sum_y", "sum_iy"):
+            setattr(self, f, np.concatenate([getattr(self, f), np.zeros(extra)]))
+        self.hist = np.vstack([self.hist, np.zeros((extra, self.slope_window))])
+        self.raw = np.vstack([self.raw, np.zeros((extra, self.raw_window))])
+        self.capacity = capacity
+
+    def _set_arrays(self, state: Dict):
+        self.metrics = None
+        self.index = MetricIndex(state["ids"])
+        size = len(self.index)
+        self.capacity = size
+        for f in self.FIELDS:
+            setattr(self, f, np.array(state[f], dtype=np.int64 if f == "n" else float))
+        self._grow(max(size, 2))
+
+    def metric_ids(self) -> List[int]:
+        """Global ids of the device's metrics"""
+        return list(self.metrics) if self.metrics is not None else list(self.index.ids)
+
+    def moments(self) -> Tuple[List[int], np.ndarray, np.ndarray, np.ndarray]:
+        """(metric ids, n, mean, std) for every metric of the device"""
+        if self.metrics is not None:
+            ms = list(self.metrics.values())
+            n = np.array([m.n for m in ms], dtype=np.int64)
+            mean = np.array([m.mean for m in ms])
+            M2 = np.array([m.M2 for m in ms])
+        else:
+            size = len(self.index)
+            n, mean, M2 = self.n[:size], self.mean[:size].copy(), self.M2[:size]
+        std = np.sqrt(M2 / np.maximum(n - 1, 1)) * (n > 1)
+        return self.metric_ids(), n.copy(), mean, std
+
+    def recent(self, mid: int) -> np.ndarray:
+        """Raw values of one metric, oldest first"""
+        if self.metrics is not None:
+            m = self.metrics[mid]
+            n, raw = m.n, np.frombuffer(m.raw)
+        else:
+            row = self.index.table[mid]
+            n, raw = int(self.n[row]), self.raw[row]
+        count = min(n, self.raw_window)
+        return raw[np.arange(n - count, n) % self.raw_window]
+
+    def get_state(self) -> Dict:
+        """Per-metric state as arrays in row order, the same for both paths"""
+        if self.metrics is None:
+            size = len(self.index)
+            state = {f: getattr(self, f)[:size].copy() for f in self.FIELDS}
+            state["ids"] = np.array(self.index.ids, dtype=np.intp)
+            return state
+        ms = list(self.metrics.values())
+        state = {f: np.array([getattr(m, f) for m in ms], dtype=np.int64 if f == "n" else float)
+                 for f in ("n", "mean", "M2", "ema", "sum_y", "sum_iy")}
+        state["hist"] = np.array([m.hist for m in ms]).reshape(len(ms), self.slope_window)
+        state["raw"] = np.array([m.raw for m in ms]).reshape(len(ms), self.raw_window)
+        state["ids"] = np.array(list(self.metrics), dtype=np.intp)
+        return state
+
+    def set_state(self, state: Dict):
+        if len(state["ids"]) > self.vector_min:
+            self._set_arrays(state)
+            return
+        self.metrics, self.index = {}, None
+        for row, mid in enumerate(state["ids"].tolist()):
+            m = self.metrics[mid] = MetricStats(self.slope_window, self.raw_window)
+            for f in ("mean", "M2", "ema", "sum_y", "sum_iy"):
+                setattr(m, f, float(state[f][row]))
+            m.n = int(state["n"][row])
+            m.hist = array("d", state["hist"][row].tolist())
+            m.raw = array("d", state["raw"][row].tolist())
+
+class SampleScreen:
+    """O(1) per-sample screens that decide whether a sample is worth a model call.
+
+    Per metric (struct-of-arrays on MetricIndex rows): an EWMA mean/variance for
+    a z-score, a two-sided CUSUM on that z-score (hub.streaming.Cusum) and an
+    EWMA of absolute first differences for a rate-of-change test.  Scores are
+    taken against the state *before* the sample is folded in.
+    """
+
+    __slots__ = ("alpha", "z_limit", "cusum_k", "cusum_h", "roc_limit", "warmup", "index", "capacity",
+                 "n", "mean", "var", "last", "absdiff", "pos", "neg")
+
+    FIELDS = ("n", "mean", "var", "last", "absdiff", "pos", "neg")
+
+    def __init__(self, capacity: int = 8, alpha: float = 0.05, z_limit: float = 3.5,
+                 cusum_k: float = 0.5, cusum_h: float = 8.0, roc_limit: float = 6.0, warmup: int = 20):
+        self.alpha = alpha
+        self.z_limit = z_limit
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.roc_limit = roc_limit
+        self.warmup = warmup
+        self.index = MetricIndex()
+        self.capacity = 0
+        for f in self.FIELDS:
+            setattr(self, f, np.zeros(0, dtype=np.int64 if f == "n" else float))
+        self._grow(capacity)
+
+    def _grow(self, capacity: int):
+        extra = capacity - self.capacity
+        if extra <= 0:
+            return
+        for f in self.FIELDS:
+            current = getattr(self, f)
+            setattr(self, f, np.concatenate([current, np.zeros(extra, dtype=current.dtype)]))
+        self.capacity = capacity
+
+    def screen(self, ids: np.ndarray, values: np.ndarray) -> str:
+        """Fold in one sample; returns the first screen that fired ("z", "cusum", "roc") or ""."""
+        if len(ids) == 0:
+            return ""
+        rows = self.index.rows(ids)
+        if len(self.index) > self.capacity:
+            self._grow(max(len(self.index), 2 * self.capacity))
+        n = self.n[rows]
+        warm = n > self.warmup
+        mean, var, last = self.mean[rows], self.var[rows], self.last[rows]
+        std = np.sqrt(var)
+        z = (values - mean) / np.where(std > 1e-12, std, np.inf)
+        diff = np.abs(values - last)
+        absdiff = self.absdiff[rows]
+        roc = diff / np.where(absdiff > 1e-12, absdiff, np.inf)
+
+        # CUSUM accumulates standardized excursions beyond the slack k
+        pos = np.maximum(0.0, self.pos[rows] + z - self.cusum_k) * warm
+        neg = np.maximum(0.0, self.neg[rows] - z - self.cusum_k) * warm
+        shifted = (pos > self.cusum_h) | (neg > self.cusum_h)
+        self.pos[rows] = np.where(shifted, 0.0, pos)
+        self.neg[rows] = np.where(shifted, 0.0, neg)
+
+        # EWMA mean/variance and mean absolute difference, seeded by the first values
+        first = n == 0
+        a = np.maximum(self.alpha, first)
+        delta = values - mean
+        self.mean[rows] = mean + a * delta
+        self.var[rows] = (1.0 - a) * (var + a * delta * delta)
+        self.absdiff[rows] = np.where(n <= 1, diff * (n == 1), absdiff + self.alpha * (diff - absdiff))
+        self.last[rows] = values
+        self.n[rows] = n + 1
+
+        if not warm.any():
+            return ""
+        if (np.abs(z[warm]) > self.z_limit).any():
+            return "z"
+        if shifted[warm].any():
+            return "cusum"
+        if (roc[warm] > self.roc_limit).any():
+            return "roc"
+        return ""
+
+    def get_state(self) -> Dict:
+        size = len(self.index)
+        state = {f: getattr(self, f)[:size].copy() for f in self.FIELDS}
+        state["ids"] = np.array(self.index.ids, dtype=np.intp)
+        return state
+
+    def set_state(self, state: Dict):
+        self.index = MetricIndex(state["ids"])
+        size = len(self.index)
+        self._grow(size)
+        for f in self.FIELDS:
+            getattr(self, f)[:size] = state[f]
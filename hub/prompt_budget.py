@@ -0,0 +1,242 @@
+# hub/prompt_budget.py
+"""Token-budgeted prompt assembly for the lab assistant.
+
+The prompt is filled in priority order until PROMPT_BUDGET tokens are used:
+
+1. required system sections (instructions), always in full
+2. the newest user message, cut in the middle if it alone is too long
+   (pasted logs keep their head and tail)
+3. optional system sections (the lab digest), dropping their last lines
+   first; the digest lists the most urgent devices first
+4. earlier turns, newest first; turns that no longer fit are replaced by
+   a short extractive summary
+
+Token counts come from tiktoken when its encoding can be loaded, else from
+a character estimate, and are cached per message text, so re-assembling a
+long conversation costs dictionary lookups.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+PROMPT_BUDGET = int(os.getenv("ASSISTANT_PROMPT_BUDGET", "6000"))  # prompt tokens; the reply is on top
+SUMMARY_TOKENS = 200     # budget of the summary that replaces evicted turns
+MESSAGE_OVERHEAD = 4     # tokens the chat format adds per message
+REPLY_PRIMING = 3        # tokens the chat format adds per request
+COUNT_CACHE_SIZE = 4096              # distinct texts whose counts are kept...
+COUNT_CACHE_CHARS = 8 * 1024 * 1024  # ...and at most this much text keyed by them
+SNIPPET_WORDS = 16       # words kept per evicted turn in the summary
+
+class TokenCounter:
+    """Counts and truncates text in model tokens, caching counts per text.
+
+    The tiktoken encoding is loaded on a background thread on first use (it
+    may be fetched over the network once); until it is ready, or if that
+    fails, counts are estimated from the text length.
+    """
+
+    def __init__(self, model: str = "gpt-4"):
+        self.model = model
+        self.encoding = None
+        self.name = "estimate"
+        self._loaded = False
+        self._loader: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._cached_chars = 0
+        self.hits = 0
+        self.misses = 0
+
+    def start_loading(self) -> threading.Thread:
+        """Load the model's encoding in the background (once)"""
+        with self._lock:
+            if self._loader is None:
+                self._loader = threading.Thread(target=self._load, name="tokenizer-load", daemon=True)
+                self._loader.start()
+            return self._loader
+
+    def _load(self):
+        encoding = None
+        try:
+            import tiktoken
+            encoding = tiktoken.encoding_for_model(self.model)
+        except Exception as e:
+            print(f"[Lab Assistant] tiktoken unavailable ({type(e).__name__}); estimating token counts")
+        with self._lock:
+            self.encoding = encoding
+            self.name = encoding.name if encoding else "estimate"
+            self._cache.clear()  # estimated and exact counts don't mix
+            self._cached_chars = 0
+            self._loaded = True
+
+    def count(self, text: str) -> int:
+        if not self._loaded:
+            self.start_loading()
+            return (len(text) + 3) // 4
+        with self._lock:
+            n = self._cache.get(text)
+            if n is not None:
+                self.hits += 1
+                self._cache.move_to_end(text)
+                return n
+        encoding = self.encoding
+        n = len(encoding.encode(text, disallowed_special=())) if encoding else (len(text) + 3) // 4
+        with self._lock:
+            self.misses += 1
+            if text not in self._cache:
+                self._cached_chars += len(text)
+            self._cache[text] = n
+            while len(self._cache) > COUNT_CACHE_SIZE or self._cached_chars > COUNT_CACHE_CHARS:
+                evicted, _ = self._cache.popitem(last=False)
+                self._cached_chars -= len(evicted)
+        return n
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keep the head and tail of ``text`` within ``max_tokens``, marking the cut"""
+        total = self.count(text)
+        if total <= max_tokens:
+            return text
+        keep = max(max_tokens - 12, 0)  # room for the marker
+        head = keep // 2
+        tail = keep - head
+        encoding = self.encoding if self._loaded else None
+        if encoding:
+            # Encode only the ends (a token is rarely over 8 characters), not the whole paste
+            first = encoding.decode(encoding.encode(text[:head * 8], disallowed_special=())[:head])
+            tokens = encoding.encode(text[len(text) - tail * 8:], disallowed_special=()) if tail else []
+            last = encoding.decode(tokens[len(tokens) - tail:])
+        else:
+            first = text[:head * 4]
+            last = text[len(text) - tail * 4:] if tail else ""
+        return f"{first}\n[... {total - keep} tokens omitted ...]\n{last}"
+
+    def message(self, message: Dict) -> int:
+        return self.count(message["content"]) + MESSAGE_OVERHEAD
+
+class Prompt:
+    """Assembled messages plus the token accounting for one request"""
+
+    __slots__ = ("messages", "metrics")
+
+    def __init__(self, messages: List[Dict], metrics: Dict):
+        self.messages = messages
+        self.metrics = metrics
+
+def _cut_lines(counter: TokenCounter, text: str, max_tokens: int) -> Tuple[str, int]:
+    """Keep the leading lines of ``text`` that fit; returns (text, lines dropped).
+
+    Sums per-line counts (cached across requests) rather than re-counting
+    the joined text for every candidate cut.
+    """
+    if counter.count(text) <= max_tokens:
+        return text, 0
+    lines = text.split("\n")
+    used, kept = 8, 0  # 8: the omission marker
+    for line in lines:
+        used += counter.count(line) + 1
+        if used > max_tokens:
+            break
+        kept += 1
+    dropped = len(lines) - kept
+    if not kept:
+        return "", dropped
+    return "\n".join(lines[:kept] + [f"[{dropped} more lines omitted]"]), dropped
+
+def summarize_turns(counter: TokenCounter, turns: List[Dict], max_tokens: int) -> Optional[str]:
+    """Extractive summary of evicted turns: the opening words of each, newest kept when space runs out"""
+    header = f"Earlier in this conversation ({len(turns)} messages not shown):"
+    used = counter.count(header) + MESSAGE_OVERHEAD
+    snippets = []
+    for turn in reversed(turns):
+        words = turn["content"].split()
+        snippet = f"- {turn['role']}: " + " ".join(words[:SNIPPET_WORDS]) + (" ..." if len(words) > SNIPPET_WORDS else "")
+        used += counter.count(snippet) + 1
+        if used > max_tokens:
+            break
+        snippets.insert(0, snippet)
+    return "\n".join([header] + snippets) if snippets else None
+
+class PromptBuilder:
+    """Fits system sections and conversation history into a token budget"""
+
+    def __init__(self, counter: Optional[TokenCounter] = None, budget: int = PROMPT_BUDGET,
+                 summary_tokens: int = SUMMARY_TOKENS):
+        self.counter = counter or TokenCounter()
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+
+    def build(self, sections: List[Tuple[str, bool]], history: List[Dict]) -> Prompt:
+        """``sections``: (text, required) in prompt order; ``history``: oldest first, ending with the new user turn"""
+        start = time.perf_counter()
+        counter = self.counter
+        hits, misses = counter.hits, counter.misses
+        left = self.budget - REPLY_PRIMING - MESSAGE_OVERHEAD  # the system message
+
+        texts = [text for text, _ in sections]
+        required = sum(counter.count(text) for text, req in sections if req)
+        left -= required
+
+        # The new user turn comes before optional context and earlier turns, but leaves
+        # room for some of the context and for a summary of the turns it pushes out
+        latest = dict(history[-1]) if history else None
+        truncated = False
+        if latest is not None:
+            optional = sum(counter.count(text) for text, req in sections if not req)
+            reserve = min(optional, left // 4) + (self.summary_tokens if len(history) > 1 else 0)
+            room = max(left - reserve, left // 2) - MESSAGE_OVERHEAD
+            if counter.count(latest["content"]) > room:
+                latest["content"] = counter.truncate(latest["content"], max(room, 0))
+                truncated = True
+            left -= counter.message(latest)
+
+        context_lines_dropped = 0
+        summary_room = self.summary_tokens if len(history) > 1 else 0
+        for i, (text, req) in enumerate(sections):
+            if req:
+                continue
+            fitted, dropped = _cut_lines(counter, text, max(left - summary_room, 0))
+            texts[i] = fitted
+            context_lines_dropped += dropped
+            left -= counter.count(fitted)
+        texts = [t for t in texts if t]
+        system = "\n".join(texts)
+        # Counted by part: the parts' counts are cached, the joined text changes every request
+        system_tokens = sum(counter.count(t) for t in texts) + len(texts) - 1 + MESSAGE_OVERHEAD
+
+        # Earlier turns, newest first, keeping room for a summary of whatever gets evicted
+        earlier = history[:-1]
+        kept: List[Dict] = []
+        for i in range(len(earlier) - 1, -1, -1):
+            cost = counter.message(earlier[i])
+            reserve = self.summary_tokens if i > 0 else 0
+            if cost + reserve > left:
+                break
+            kept.insert(0, earlier[i])
+            left -= cost
+        evicted = earlier[:len(earlier) - len(kept)]
+        summary = summarize_turns(counter, evicted, min(self.summary_tokens, left))
+
+        messages = [{"role": "system", "content": system}]
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        messages.extend(kept)
+        if latest is not None:
+            messages.append(latest)
+
+        prompt_tokens = REPLY_PRIMING + system_tokens + sum(counter.message(m) for m in messages[1:])
+        return Prompt(messages, {
+            "prompt_tokens": prompt_tokens,
+            "budget": self.budget,
+            "system_tokens": system_tokens,
+            "history_messages": len(kept),
+            "evicted_messages": len(evicted),
+            "summarized": summary is not None,
+            "user_truncated": truncated,
+            "context_lines_dropped": context_lines_dropped,
+            "tokenizer": counter.name,
+            "count_cache_hits": counter.hits - hits,
+            "count_cache_misses": counter.misses - misses,
+            "assembly_ms": (time.perf_counter() - start) * 1e3
+        })
@@ -1,6 +1,7 @@
 # hub/saver.py
-import os, json, time, pathlib, sys
-import paho.mqtt.client as mqtt
+import os, time, pathlib, sys
+from hub.bus import Bus, MqttTransport
+from hub.telemetry import dumps
 
 BROKER = os.getenv("MQTT_BROKER", "localhost")
 TOPIC  = "lab/device/+/telemetry"
@@ -9,34 +10,35 @@ base = pathlib.Path("./data"); base.mkdir(exist_ok=True)
 def log(*a):
     print(*a, flush=True)
 
-def on_connect(client, userdata, flags, reason_code, properties=None):
-    log(f"[saver] Connected to {BROKER} rc={reason_code}")
-    client.subscribe(TOPIC)
-    log(f"[saver] Subscribed to {TOPIC}")
-
-def on_message(client, userdata, msg):
+def on_telemetry(topic, d):
+    # The bus hands over records already decoded and validated (hub.telemetry)
     try:
-        d = json.loads(msg.payload)
         day = time.strftime("%Y-%m-%d", time.localtime(d["ts"]))
         outdir = base / day
         outdir.mkdir(exist_ok=True)
         path = outdir / f"{d['device']}.ndjson"
-        with path.open("a") as f:
-            f.write(json.dumps(d)+"\n")
+        with path.open("ab") as f:
+            f.write(dumps(d) + b"\n")
         log(f"[saver] Saved {path}")
     except Exception as e:
-        log("[saver] ERROR parsing/saving:", e)
+        log("[saver] ERROR saving:", e)
 
-def on_log(client, userdata, level, buf):
-    # uncomment if you want MQTT client logs
-    # log("[mqtt]", buf)
-    pass
+def attach(bus: Bus):
+    """Archive every telemetry record published on ``bus``"""
+    log(f"[saver] Subscribed to {TOPIC}")
+    # Blocking: the archive keeps every record, so a slow disk holds up the publisher instead
+    return bus.subscribe(TOPIC, on_telemetry, block=True)
 
-c = mqtt.Client()
-c.on_connect = on_connect
-c.on_message = on_message
-c.on_log = on_log
+def main():
+    log(f"[saver] Connecting to {BROKER}…")
+    bus = Bus(MqttTransport(BROKER))
+    attach(bus)
+    try:
+        bus.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.close()
 
-log(f"[saver] Connecting to {BROKER}…")
-c.connect(BROKER, 1883, 60)
-c.loop_forever()
+if __name__ == "__main__":
+    main()
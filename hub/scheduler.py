@@ -0,0 +1,164 @@
+# hub/scheduler.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+class Job:
+    """A periodic job plus its timing metrics"""
+
+    def __init__(self, name: str, interval: float, fn: Callable,
+                 snapshot: Optional[Callable[[], Any]] = None, run_immediately: bool = False):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.snapshot = snapshot
+        self.run_immediately = run_immediately
+        self.next_run: Optional[float] = None
+        self.running = False
+        # Metrics
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.snapshot_duration = 0.0
+        self.last_run: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def metrics(self) -> Dict:
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'running': self.running,
+            'last_duration': self.last_duration,
+            'avg_duration': self.total_duration / self.runs if self.runs else 0.0,
+            'max_duration': self.max_duration,
+            'snapshot_duration': self.snapshot_duration,
+            'last_run': self.last_run,
+            'last_error': self.last_error,
+        }
+
+class JobScheduler:
+    """Runs heavy periodic jobs on fixed intervals, off the message path.
+
+    Each job may provide a ``snapshot`` callable; it is invoked on the worker
+    thread right before the job and its result is passed to ``fn``, so the job
+    works on a copy of shared state instead of the live structures.  A job that
+    is still running when it comes due again is skipped rather than queued.
+    """
+
+    def __init__(self, max_workers: int = 2, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.max_workers = max_workers
+        self.jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def add_job(self, name: str, interval: float, fn: Callable,
+                snapshot: Optional[Callable[[], Any]] = None, run_immediately: bool = False) -> Job:
+        """Register ``fn`` to run every ``interval`` seconds"""
+        job = Job(name, interval, fn, snapshot, run_immediately)
+        with self._lock:
+            self.jobs[name] = job
+        self._wakeup.set()
+        return job
+
+    def remove_job(self, name: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.pop(name, None)
+
+    def start(self):
+        """Start the background scheduling thread"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="lab-job")
+        self._thread = threading.Thread(target=self._loop, name="lab-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        """Stop scheduling; optionally wait for running jobs to finish"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def run_pending(self, now: Optional[float] = None) -> List[str]:
+        """Run due jobs inline on the calling thread (used without start())"""
+        ran = []
+        for job in self._due(self.clock() if now is None else now):
+            self._run(job)
+            ran.append(job.name)
+        return ran
+
+    def metrics(self) -> Dict[str, Dict]:
+        """Per-job timing metrics"""
+        with self._lock:
+            return {name: job.metrics() for name, job in self.jobs.items()}
+
+    def _due(self, now: float) -> List[Job]:
+        due = []
+        with self._lock:
+            for job in self.jobs.values():
+                if job.next_run is None:
+                    job.next_run = now if job.run_immediately else now + job.interval
+                if now < job.next_run:
+                    continue
+                # Fixed-rate schedule; if we fell behind, resync instead of bursting
+                job.next_run += job.interval
+                if job.next_run <= now:
+                    job.next_run = now + job.interval
+                if job.running:
+                    job.skipped += 1
+                    continue
+                job.running = True
+                due.append(job)
+        return due
+
+    def _next_deadline(self) -> Optional[float]:
+        with self._lock:
+            deadlines = [j.next_run for j in self.jobs.values() if j.next_run is not None]
+        return min(deadlines) if deadlines else None
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            for job in self._due(self.clock()):
+                self._executor.submit(self._run, job)
+            deadline = self._next_deadline()
+            timeout = 1.0 if deadline is None else min(1.0, max(0.0, deadline - self.clock()))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _run(self, job: Job):
+        start = time.perf_counter()
+        try:
+            if job.snapshot is not None:
+                state = job.snapshot()
+                job.snapshot_duration = time.perf_counter() - start
+                job.fn(state)
+            else:
+                job.fn()
+        except Exception as e:
+            job.errors += 1
+            job.last_error = str(e)
+            print(f"[scheduler] Job {job.name} failed: {e}")
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                job.runs += 1
+                job.last_duration = duration
+                job.total_duration += duration
+                job.max_duration = max(job.max_duration, duration)
+                job.last_run = time.time()
+                job.running = False
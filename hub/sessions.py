@@ -0,0 +1,258 @@
+# hub/sessions.py
+"""Per-session conversation history for the lab assistant.
+
+Each client keeps its own conversation, addressed by a session id.
+Sessions live in memory in least-recently-used order and are evicted when
+they have been idle for SESSION_TTL, when there are more than
+SESSION_LIMIT of them, or when their history together exceeds
+SESSION_MEMORY_MB (estimated from message sizes).  A single session is
+also trimmed, oldest messages first, to SESSION_MESSAGES and
+SESSION_MAX_BYTES.
+
+With SESSION_DB set, sessions are also written to SQLite (batched, no
+change left unwritten for more than SESSION_FLUSH seconds, and always
+before a changed session is evicted), so an evicted or pre-restart session
+is loaded again when its id comes back.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from hub.scheduler import JobScheduler
+
+SESSION_TTL = float(os.getenv("ASSISTANT_SESSION_TTL", str(24 * 3600)))        # idle seconds before expiry
+SESSION_LIMIT = int(os.getenv("ASSISTANT_SESSIONS", "10000"))                  # sessions kept in memory
+SESSION_MEMORY_MB = float(os.getenv("ASSISTANT_SESSION_MEMORY_MB", "64"))      # history kept in memory
+SESSION_DB = os.getenv("ASSISTANT_SESSION_DB", "")                             # SQLite path; empty: memory only
+SESSION_FLUSH = float(os.getenv("ASSISTANT_SESSION_FLUSH", "5"))               # max seconds a change waits unwritten
+SESSION_MESSAGES = 50               # messages kept per session
+SESSION_MAX_BYTES = 256 * 1024      # history kept per session
+MESSAGE_OVERHEAD_BYTES = 300        # a message dict and its strings beyond the text itself
+SESSION_OVERHEAD_BYTES = 1024       # a Session, its deque and its LRU entry
+
+_VALID_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id      TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    history TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+"""
+
+def _message_bytes(message: Dict) -> int:
+    return len(message.get("content") or "") + MESSAGE_OVERHEAD_BYTES
+
+class Session:
+    """One conversation: its history (oldest first) and bookkeeping for the store"""
+
+    __slots__ = ("id", "history", "created", "last_used", "bytes", "accounted", "dirty")
+
+    def __init__(self, session_id: str, history: Optional[List[Dict]] = None, created: Optional[float] = None):
+        self.id = session_id
+        self.history = deque()
+        self.created = time.time() if created is None else created
+        self.last_used = self.created
+        self.bytes = SESSION_OVERHEAD_BYTES
+        self.accounted = 0  # bytes the store has counted for this session
+        self.dirty = False  # changed since last written to the database
+        for message in history or ():
+            self.append(message)
+        self.dirty = False
+
+    def append(self, message: Dict):
+        """Add a message, dropping the oldest ones beyond the per-session limits"""
+        self.history.append(message)
+        self.bytes += _message_bytes(message)
+        while len(self.history) > 1 and (len(self.history) > SESSION_MESSAGES or self.bytes > SESSION_MAX_BYTES):
+            self.bytes -= _message_bytes(self.history.popleft())
+        self.dirty = True
+
+class SessionStore:
+    """LRU/TTL-bounded sessions, optionally persisted to SQLite"""
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = SESSION_LIMIT,
+                 max_bytes: int = int(SESSION_MEMORY_MB * 1024 * 1024), path: Optional[str] = SESSION_DB,
+                 batch_size: int = 20, flush_interval: float = SESSION_FLUSH):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()  # least recently used first
+        self._pending: Dict[str, Session] = {}  # changed sessions not yet written
+        self._pending_since: Optional[float] = None  # monotonic time the oldest of them was queued
+        self._scheduler: Optional[JobScheduler] = None
+        self._lock = threading.RLock()
+        self.bytes = 0
+        self.created = 0
+        self.loaded = 0
+        self.evicted = 0
+        self.expired = 0
+        self.path = path or None
+        self._conn = None
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def get(self, session_id: Optional[str] = None) -> Session:
+        """The session for ``session_id``; a new one (with a fresh id if none or invalid was given) otherwise"""
+        now = time.time()
+        if not session_id or not _VALID_ID.fullmatch(session_id):
+            session_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            else:
+                session = self._load(session_id, now)
+                if session is None:
+                    session = Session(session_id, created=now)
+                    self.created += 1
+                self._sessions[session_id] = session
+                self._account(session)
+            session.last_used = now
+            self._enforce(keep=session)
+        return session
+
+    def commit(self, session: Session):
+        """Record a changed session: update the memory count, queue it for writing, enforce the caps"""
+        with self._lock:
+            session.last_used = time.time()
+            if self._sessions.get(session.id) is not session:
+                # Evicted while a chat was using it; it is the newest copy, so it comes back
+                self._drop(self._sessions.get(session.id))
+                self._sessions[session.id] = session
+                session.accounted = 0
+            self._sessions.move_to_end(session.id)
+            self._account(session)
+            if self._conn is not None and session.dirty:
+                self._queue(session)
+            self._enforce(keep=session)
+            due = len(self._pending) >= self.batch_size or self._overdue()
+        if due:
+            self.flush()
+
+    def discard(self, session_id: str):
+        """Forget a session, in memory and in the database"""
+        with self._lock:
+            self._drop(self._sessions.pop(session_id, None))
+            self._pending.pop(session_id, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _queue(self, session: Session):
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending[session.id] = session
+
+    def _overdue(self) -> bool:
+        return bool(self._pending) and time.monotonic() - self._pending_since >= self.flush_interval
+
+    def _account(self, session: Session):
+        self.bytes += session.bytes - session.accounted
+        session.accounted = session.bytes
+
+    def _drop(self, session: Optional[Session]):
+        if session is not None:
+            self.bytes -= session.accounted
+            session.accounted = 0
+
+    def _expire(self, now: float):
+        # LRU order is last-used order, so idle sessions are at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._pending.pop(session.id, None)  # expired: not worth writing
+            self._drop(session)
+            self.expired += 1
+
+    def _enforce(self, keep: Session):
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self.bytes > self.max_bytes):
+            session_id, session = next(iter(self._sessions.items()))
+            if session is keep:
+                self._sessions.move_to_end(session_id)
+                continue
+            self._sessions.popitem(last=False)
+            self._drop(session)
+            self.evicted += 1
+            if self._conn is not None and session.dirty:
+                self._queue(session)  # written below before it is gone for good
+        if self._pending and len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _load(self, session_id: str, now: float) -> Optional[Session]:
+        if self._conn is None:
+            return None
+        pending = self._pending.get(session_id)
+        if pending is not None:
+            return pending  # evicted, not written yet
+        row = self._conn.execute("SELECT created, updated, history FROM sessions WHERE id = ?",
+                                 (session_id,)).fetchone()
+        if row is None or now - row[1] >= self.ttl:
+            return None
+        self.loaded += 1
+        session = Session(session_id, json.loads(row[2]), created=row[0])
+        session.last_used = row[1]
+        return session
+
+    def flush(self) -> int:
+        """Write every changed session in one transaction and drop expired rows; returns sessions written"""
+        if self._conn is None:
+            return 0
+        with self._lock:
+            sessions, self._pending = list(self._pending.values()), {}
+            self._pending_since = None
+            rows = [(s.id, s.created, s.last_used, json.dumps(list(s.history))) for s in sessions]
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO sessions (id, created, updated, history) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET updated = excluded.updated, history = excluded.history", rows)
+                self._conn.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            for s in sessions:
+                s.dirty = False
+        return len(rows)
+
+    def start(self):
+        """Write pending changes every ``flush_interval`` on a background scheduler, for quiet
+        spells with no commit to trigger it (only with a database)"""
+        if self._conn is None or self._scheduler is not None:
+            return
+        self._scheduler = JobScheduler(max_workers=1)
+        self._scheduler.add_job("session_flush", self.flush_interval, lambda: self._pending and self.flush())
+        self._scheduler.start()
+
+    def metrics(self) -> Dict:
+        return {"sessions": len(self._sessions), "memory_bytes": self.bytes, "max_bytes": self.max_bytes,
+                "max_sessions": self.max_sessions, "created": self.created, "loaded": self.loaded,
+                "evicted": self.evicted, "expired": self.expired, "unsaved": len(self._pending),
+                "persistent": self._conn is not None}
+
+    def close(self):
+        if self._scheduler is not None:
+            self._scheduler.stop()
+            self._scheduler = None
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,164 @@
+# hub/spectral.py
+"""Batched sliding-window spectra for every (device, metric) series.
+
+Samples land in one ring-buffer matrix (a row per series).  A scheduled job
+copies out the rows whose window is full and runs a single ``np.fft.rfft``
+over all of them, so cost is one vectorized call per pass rather than a
+Python loop per series.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAINS_HZ = (50.0, 60.0)
+
+class SpectralMonitor:
+    """Ring buffers per series plus the per-series noise-floor baselines.
+
+    ``analyze`` reports for each full series: the dominant frequency and its
+    prominence (peak bin power over the median bin power), the mains (50/60 Hz)
+    line-to-floor ratio when the series is sampled fast enough to see it, and
+    the noise floor relative to its slow-moving baseline.
+    """
+
+    def __init__(self, window: int = 128, floor_alpha: float = 0.1, min_bin: int = 2, max_gap: float = 3.0):
+        self.window = window
+        self.max_gap = max_gap  # skip windows with a sample gap above this many median steps
+        self.floor_alpha = floor_alpha
+        self.min_bin = min_bin  # skip DC and the slowest bin, where drift leaks in
+        self.keys: List[Tuple[str, int]] = []       # row -> (device, metric id)
+        self.rows: Dict[str, np.ndarray] = {}       # device -> metric id -> row (-1 if none)
+        self.values = np.zeros((0, window))
+        self.times = np.zeros((0, window))
+        self.count = np.zeros(0, dtype=np.int64)
+        self.floors: Dict[Tuple[str, int], float] = {}  # log noise-floor baseline per series
+        self._taper = np.hanning(window)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _rows_for(self, device: str, ids: np.ndarray) -> np.ndarray:
+        table = self.rows.get(device)
+        if table is None or ids[-1] >= len(table):
+            grown = np.full(max(int(ids[-1]) + 1, 8), -1, dtype=np.intp)
+            if table is not None:
+                grown[:len(table)] = table
+            table = self.rows[device] = grown
+        missing = ids[table[ids] < 0]
+        if len(missing):
+            start = len(self.keys)
+            table[missing] = np.arange(start, start + len(missing))
+            self.keys.extend((device, int(mid)) for mid in missing)
+            extra = len(missing)
+            self.values = np.vstack([self.values, np.zeros((extra, self.window))])
+            self.times = np.vstack([self.times, np.zeros((extra, self.window))])
+            self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        return table[ids]
+
+    def append(self, device: str, ids: np.ndarray, values: np.ndarray, ts: float):
+        """Add one sample's metric values to the device's series"""
+        if len(ids) == 0:
+            return
+        rows = self._rows_for(device, ids)
+        slot = self.count[rows] % self.window
+        self.values[rows, slot] = values
+        self.times[rows, slot] = ts
+        self.count[rows] += 1
+
+    def snapshot(self) -> Optional[Dict]:
+        """Copy the full windows out, oldest sample first (cheap; taken under the caller's lock)"""
+        ready = np.flatnonzero(self.count >= self.window)
+        if not len(ready):
+            return None
+        order = (self.count[ready, None] + np.arange(self.window)) % self.window
+        keys = [self.keys[r] for r in ready]
+        return {
+            'keys': keys,
+            'floors': [self.floors.get(key) for key in keys],
+            'values': np.take_along_axis(self.values[ready], order, axis=1),
+            'times': np.take_along_axis(self.times[ready], order, axis=1)
+        }
+
+    def analyze(self, snapshot: Optional[Dict]) -> List[Dict]:
+        """One batched FFT over every full, evenly sampled series; returns a finding per series.
+
+        Reads only the snapshot, so it runs outside the caller's lock; the
+        baselines move when the findings are passed to ``update_floors``.
+        """
+        if snapshot is None:
+            return []
+        # Windows spanning a gap (restart, paused sidecar) have no meaningful spectrum
+        steps = np.diff(snapshot['times'], axis=1)
+        median_step = np.median(steps, axis=1)
+        regular = (median_step > 0) & (steps.max(axis=1) <= self.max_gap * median_step)
+        if not regular.any():
+            return []
+        values, times = snapshot['values'][regular], snapshot['times'][regular]
+        keys = [key for key, ok in zip(snapshot['keys'], regular) if ok]
+        baselines = [b for b, ok in zip(snapshot['floors'], regular) if ok]
+        n = self.window
+        fs = (n - 1) / (times[:, -1] - times[:, 0])
+
+        detrended = values - values.mean(axis=1, keepdims=True)
+        power = np.abs(np.fft.rfft(detrended * self._taper, axis=1)) ** 2
+        band = power[:, self.min_bin:]
+        floor = np.median(band, axis=1)
+        safe_floor = np.where(floor > 0, floor, np.finfo(float).tiny)
+        peak = band.argmax(axis=1) + self.min_bin
+        prominence = power[np.arange(len(keys)), peak] / safe_floor
+        dominant_hz = peak * fs / n
+
+        # Mains line power (max of the nearest bin and its neighbours) where Nyquist allows
+        mains = {}
+        for hz in MAINS_HZ:
+            visible = fs > 2.0 * hz * 1.05
+            k = np.clip(np.rint(hz * n / fs).astype(int), 1, n // 2 - 1)
+            line = np.max([power[np.arange(len(keys)), np.clip(k + d, 0, n // 2)] for d in (-1, 0, 1)], axis=0)
+            mains[hz] = np.where(visible, line / safe_floor, np.nan)
+
+        findings = []
+        log_floor = np.log(safe_floor)
+        for i, key in enumerate(keys):
+            baseline = log_floor[i] if baselines[i] is None else baselines[i]
+            findings.append({
+                'device': key[0], 'metric_id': key[1],
+                'sample_rate_hz': float(fs[i]),
+                'dominant_hz': float(dominant_hz[i]),
+                'prominence': float(prominence[i]),
+                'noise_floor': float(floor[i]),
+                'log_floor': float(log_floor[i]),
+                'floor_ratio': float(np.exp(log_floor[i] - baseline)),
+                'mains': {hz: float(ratio[i]) for hz, ratio in mains.items() if not np.isnan(ratio[i])}
+            })
+        return findings
+
+    def update_floors(self, findings: List[Dict]):
+        """Move each series' noise-floor baseline toward its latest floor (under the caller's lock)"""
+        for f in findings:
+            key = (f['device'], f['metric_id'])
+            baseline = self.floors.get(key, f['log_floor'])
+            self.floors[key] = baseline + self.floor_alpha * (f['log_floor'] - baseline)
+
+    def drop(self, device: str):
+        """Stop analysing a device's series until it fills them again (rows are kept for reuse)"""
+        table = self.rows.get(device)
+        if table is None:
+            return
+        rows = table[table >= 0]
+        self.count[rows] = 0
+        for r in rows:
+            self.floors.pop(self.keys[r], None)
+
+    def get_state(self) -> Dict:
+        return {'keys': list(self.keys), 'values': self.values.copy(), 'times': self.times.copy(),
+                'count': self.count.copy(), 'floors': dict(self.floors)}
+
+    def set_state(self, state: Dict):
+        if state['values'].shape[1] != self.window:
+            return
+        for row, (device, mid) in enumerate(state['keys']):
+            r = self._rows_for(device, np.array([mid], dtype=np.intp))[0]
+            self.values[r] = state['values'][row]
+            self.times[r] = state['times'][row]
+            self.count[r] = state['count'][row]
+        self.floors.update(state['floors'])
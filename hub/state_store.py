@@ -0,0 +1,54 @@
+# hub/state_store.py
+import os
+import pickle
+import tempfile
+import time
+import zlib
+from typing import Any, Optional
+
+MAGIC = b"LABOS-STATE"
+
+def save_snapshot(path: str, state: Any, version: int) -> int:
+    """Atomically write a compressed, versioned state snapshot; returns bytes written"""
+    body = zlib.compress(pickle.dumps({
+        'version': version,
+        'saved_at': time.time(),
+        'state': state
+    }, protocol=pickle.HIGHEST_PROTOCOL), 6)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".state-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + version.to_bytes(4, "big") + body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)  # readers see the old or the new file, never half of one
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return len(MAGIC) + 4 + len(body)
+
+def load_snapshot(path: str, version: int) -> Optional[Any]:
+    """Load a snapshot written by save_snapshot, or None if missing/incompatible"""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+    header = len(MAGIC) + 4
+    if not raw.startswith(MAGIC):
+        print(f"[state] {path} is not a state snapshot, ignoring")
+        return None
+    found = int.from_bytes(raw[len(MAGIC):header], "big")
+    if found != version:
+        print(f"[state] {path} has version {found}, expected {version}, ignoring")
+        return None
+    try:
+        return pickle.loads(zlib.decompress(raw[header:]))['state']
+    except Exception as e:
+        print(f"[state] Failed to read {path}: {e}")
+        return None
@@ -0,0 +1,237 @@
+# hub/streaming.py
+"""O(1)-per-update streaming estimators for the analyzer.
+
+All kernels use ``__slots__`` and plain floats so an update is a few dozen
+bytecodes with no allocation; ``bench/streaming_kernels.py`` has the
+microbenchmarks.  ``DeviceStats`` in hub/metric_state.py applies the same
+windowed least-squares recurrence to every metric of a device (with NumPy
+for wide devices).
+"""
+import math
+from collections import deque
+from typing import Optional
+
+class WindowedSlope:
+    """Least-squares slope over the last ``window`` samples (x = sample index).
+
+    Keeps running sums S_y and S_iy over the window so each update is O(1):
+    sliding drops y_0 and re-indexes, giving S_iy' = S_iy - (S_y - y_0) + (n-1)*y.
+    The sums are rebuilt from the buffer every ``window`` updates to stop
+    floating-point error from accumulating.
+    """
+
+    __slots__ = ("window", "buf", "sum_y", "sum_iy", "_since_rebuild")
+
+    def __init__(self, window: int = 30):
+        self.window = window
+        self.buf = deque(maxlen=window)
+        self.sum_y = 0.0
+        self.sum_iy = 0.0
+        self._since_rebuild = 0
+
+    def update(self, y: float) -> float:
+        n = len(self.buf)
+        if n < self.window:
+            self.sum_iy += n * y
+            self.sum_y += y
+        else:
+            y0 = self.buf[0]
+            self.sum_iy += (n - 1) * y - (self.sum_y - y0)
+            self.sum_y += y - y0
+        self.buf.append(y)
+        self._since_rebuild += 1
+        if self._since_rebuild >= self.window:
+            self.sum_y = math.fsum(self.buf)
+            self.sum_iy = math.fsum(i * v for i, v in enumerate(self.buf))
+            self._since_rebuild = 0
+        return self.slope
+
+    @property
+    def slope(self) -> float:
+        n = len(self.buf)
+        if n < 2:
+            return 0.0
+        sum_i = n * (n - 1) / 2.0
+        sum_ii = (n - 1) * n * (2 * n - 1) / 6.0
+        return (n * self.sum_iy - sum_i * self.sum_y) / (n * sum_ii - sum_i * sum_i)
+
+class EWMAVariance:
+    """Exponentially weighted mean and variance (West's incremental form)"""
+
+    __slots__ = ("alpha", "mean", "var", "n")
+
+    def __init__(self, alpha: float = 0.05):
+        self.alpha = alpha
+        self.mean = 0.0
+        self.var = 0.0
+        self.n = 0
+
+    def update(self, x: float) -> float:
+        self.n += 1
+        if self.n == 1:
+            self.mean = x
+            return self.mean
+        diff = x - self.mean
+        incr = self.alpha * diff
+        self.mean += incr
+        self.var = (1.0 - self.alpha) * (self.var + diff * incr)
+        return self.mean
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.var)
+
+    def zscore(self, x: float) -> float:
+        std = self.std
+        return (x - self.mean) / std if std > 1e-12 else 0.0
+
+class P2Quantile:
+    """P-squared streaming quantile estimate (Jain & Chlamtac, 1985); five markers, no samples kept"""
+
+    __slots__ = ("p", "q", "pos", "desired", "incr", "n")
+
+    def __init__(self, p: float = 0.5):
+        self.p = p
+        self.q = []  # marker heights
+        self.pos = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.desired = [1.0, 1.0 + 2 * p, 1.0 + 4 * p, 3.0 + 2 * p, 5.0]
+        self.incr = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+        self.n = 0
+
+    def update(self, x: float) -> Optional[float]:
+        self.n += 1
+        q = self.q
+        if self.n <= 5:
+            q.append(x)
+            if self.n == 5:
+                q.sort()
+            return self.value
+
+        # Find the cell containing x and stretch the extreme markers
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        pos, desired = self.pos, self.desired
+        for i in range(k + 1, 5):
+            pos[i] += 1.0
+        for i in range(5):
+            desired[i] += self.incr[i]
+
+        # Nudge the three middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = desired[i] - pos[i]
+            if (d >= 1.0 and pos[i + 1] - pos[i] > 1.0) or (d <= -1.0 and pos[i - 1] - pos[i] < -1.0):
+                s = 1.0 if d > 0 else -1.0
+                candidate = self._parabolic(i, s)
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + s * (q[i + int(s)] - q[i]) / (pos[i + int(s)] - pos[i])
+                q[i] = candidate
+                pos[i] += s
+        return q[2]
+
+    def _parabolic(self, i: int, s: float) -> float:
+        q, n = self.q, self.pos
+        return q[i] + s / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    @property
+    def value(self) -> Optional[float]:
+        if self.n == 0:
+            return None
+        if self.n < 5:
+            ordered = sorted(self.q)
+            return ordered[min(len(ordered) - 1, int(round(self.p * (len(ordered) - 1))))]
+        return self.q[2]
+
+class PageHinkley:
+    """Page-Hinkley test for a sustained shift in the mean (both directions).
+
+    ``delta`` is the tolerated drift per sample and ``threshold`` the
+    cumulative deviation that raises a change; the test resets after firing.
+    """
+
+    __slots__ = ("delta", "threshold", "min_samples", "n", "mean", "up", "up_min", "down", "down_max")
+
+    def __init__(self, delta: float = 0.005, threshold: float = 50.0, min_samples: int = 30):
+        self.delta = delta
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self.up = self.up_min = 0.0
+        self.down = self.down_max = 0.0
+
+    def update(self, x: float) -> int:
+        """Returns +1 for an upward change, -1 for downward, 0 otherwise"""
+        self.n += 1
+        self.mean += (x - self.mean) / self.n
+        self.up += x - self.mean - self.delta
+        self.up_min = min(self.up_min, self.up)
+        self.down += x - self.mean + self.delta
+        self.down_max = max(self.down_max, self.down)
+        if self.n < self.min_samples:
+            return 0
+        if self.up - self.up_min > self.threshold:
+            self.reset()
+            return 1
+        if self.down_max - self.down > self.threshold:
+            self.reset()
+            return -1
+        return 0
+
+class Cusum:
+    """Two-sided tabular CUSUM on standardized values.
+
+    ``k`` (slack) and ``h`` (decision interval) are in standard deviations of
+    the reference; pass ``mean``/``std`` or let it learn them from the first
+    ``warmup`` samples.
+    """
+
+    __slots__ = ("k", "h", "warmup", "mean", "std", "pos", "neg", "n", "_learned", "_m2")
+
+    def __init__(self, k: float = 0.5, h: float = 5.0, mean: Optional[float] = None,
+                 std: Optional[float] = None, warmup: int = 30):
+        self.k = k
+        self.h = h
+        self.warmup = warmup
+        self.mean = mean
+        self.std = std
+        self.pos = 0.0
+        self.neg = 0.0
+        self.n = 0
+        self._learned = 0.0
+        self._m2 = 0.0
+
+    def update(self, x: float) -> int:
+        """Returns +1/-1 when the upper/lower statistic crosses h, else 0"""
+        if self.mean is None or self.std is None:
+            # Learn the reference with Welford, then freeze it
+            self.n += 1
+            delta = x - self._learned
+            self._learned += delta / self.n
+            self._m2 += delta * (x - self._learned)
+            if self.n >= self.warmup:
+                self.mean = self._learned
+                self.std = math.sqrt(self._m2 / (self.n - 1)) or 1e-12
+            return 0
+        z = (x - self.mean) / self.std
+        self.pos = max(0.0, self.pos + z - self.k)
+        self.neg = max(0.0, self.neg - z - self.k)
+        if self.pos > self.h:
+            self.pos = 0.0
+            return 1
+        if self.neg > self.h:
+            self.neg = 0.0
+            return -1
+        return 0
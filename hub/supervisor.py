@@ -0,0 +1,415 @@
+# hub/supervisor.py
+"""Sharded analyzer: one MQTT subscriber routing devices to N worker processes.
+
+The supervisor subscribes to raw payloads on the bus (hub/bus.py) and reads
+the device from the topic, so routing does not decode the payload. It then
+hands the raw payload to the worker that owns the device on a
+consistent-hash ring. Each worker is a full analyzer pipeline
+(hub/analyzer.py) in its own process, with its own state snapshot. Every
+``summary_interval`` it sends compact per-device summaries back. The
+supervisor acts as coordinator: it runs the cross-device correlation job on
+those summaries and publishes the combined status.
+
+When a worker dies, its ring points are removed, so only its devices move to
+the survivors.  The replacement is added back once it reports ready, and
+those devices move back.  Every ring change is announced to the workers,
+which drop the state of devices they no longer own.  A worker handed a
+device catches it up from the archive tail before analysing it, whether it
+has no state for it or stale state from its snapshot.
+
+    PYTHONPATH=. python hub/supervisor.py --workers 4
+"""
+import argparse
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from hub import telemetry
+from hub.bus import Bus, MqttTransport
+from hub.scheduler import JobScheduler
+
+WORKERS = int(os.getenv("ANALYZER_WORKERS", str(os.cpu_count() or 2)))
+SUMMARY_INTERVAL = 10.0   # seconds between worker -> coordinator summaries
+RESTART_BACKOFF = 2.0     # seconds before a dead worker is replaced
+MONITOR_INTERVAL = 1.0
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes (stable across processes and runs)"""
+
+    def __init__(self, nodes=(), replicas: int = 64):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[int] = []
+        self._lock = threading.Lock()
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    @property
+    def nodes(self) -> List[int]:
+        return sorted(set(self._owners))
+
+    def add(self, node: int):
+        with self._lock:
+            if node in self._owners:
+                return
+            for i in range(self.replicas):
+                point = self._hash(f"worker-{node}#{i}")
+                at = bisect.bisect(self._points, point)
+                self._points.insert(at, point)
+                self._owners.insert(at, node)
+
+    def remove(self, node: int):
+        with self._lock:
+            keep = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+            self._points = [p for p, _ in keep]
+            self._owners = [o for _, o in keep]
+
+    def node_for(self, key: str) -> Optional[int]:
+        with self._lock:
+            if not self._points:
+                return None
+            at = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+            return self._owners[at]
+
+def _exit_with_parent():
+    """Training-process initializer: exit when the worker owning the pool dies (even if killed)"""
+    parent = multiprocessing.parent_process()
+    def watch():
+        parent.join()
+        os._exit(0)
+    threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+
+def _worker_main(worker_id: int, inbox, outbox, config: Dict):
+    """Worker process: one analyzer pipeline over the devices routed to it"""
+    from hub import analyzer
+    from hub.alert_store import AlertStore
+    from hub.ingest import IngestQueue
+
+    analyzer.STATE_PATH = f"{config['state_path']}.{worker_id}"
+    analyzer.alerts_dir = config['alerts_dir']
+    analyzer.alert_store = AlertStore(config['alerts_db'])
+    analyzer.ingest = IngestQueue(analyzer.INGEST_CAPACITY, analyzer.INGEST_POLICY)
+    # Models train in a process of their own, as in the single-process analyzer: fitting
+    # inline would hold the state lock for the whole fit
+    analyzer.anomaly_detector.executor = ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=_exit_with_parent)
+    # Cross-device jobs and the status message belong to the coordinator
+    for name in ("correlation", "status"):
+        analyzer.scheduler.remove_job(name)
+    if config.get('broker'):
+        # Publish-only connection for this worker's alerts; telemetry arrives on the inbox
+        analyzer.bus = Bus(MqttTransport(config['broker']))
+    analyzer.restore_state(replay_archive=False)
+
+    seen: Dict[str, float] = {}  # device -> last time a record was routed here
+    processed = [0]
+    ring = [None]  # HashRing last announced by the supervisor; None: every routed device is ours
+    rebalanced = threading.Event()
+    warmed = set()  # devices caught up from the archive since this worker took them on
+
+    def owns(dev):
+        current = ring[0]
+        return current is None or current.node_for(dev) == worker_id
+
+    def hand_off(devices):
+        analyzer.drop_devices(devices)
+        for dev in devices:
+            warmed.discard(dev)
+            seen.pop(dev, None)
+
+    def summarize():
+        cutoff = time.time() - 3 * config['summary_interval']
+        devices = [dev for dev, t in list(seen.items()) if t >= cutoff]
+        return {
+            'devices': analyzer.device_summaries(devices),
+            'processed': processed[0],
+            'ingest': analyzer.ingest.metrics(),
+            'detection': analyzer.anomaly_detector.tier_metrics(),
+            'alerts': dict(analyzer.alert_counts),
+            'held': sorted(analyzer.held_devices())
+        }
+    analyzer.scheduler.add_job("summary", config['summary_interval'],
+                               lambda summary: outbox.put(("summary", worker_id, summary)), snapshot=summarize)
+    analyzer.scheduler.start()
+
+    def feed():
+        # Decode on this thread; the overload policy applies before analysis
+        parent = multiprocessing.parent_process()
+        while True:
+            try:
+                item = inbox.get(timeout=1.0)
+            except queue.Empty:
+                if parent.is_alive():
+                    continue
+                item = None  # supervisor gone without stopping us: drain and exit
+            if item is None:
+                break
+            if isinstance(item, dict):  # ring change: {'ring': worker ids, 'replicas': n}
+                ring[0] = HashRing(item['ring'], item['replicas'])
+                rebalanced.set()
+                continue
+            topic, payload = item
+            try:
+                d = telemetry.decode_telemetry(payload, topic)
+            except telemetry.DecodeError as e:
+                print(f"[worker {worker_id}] Rejected payload on {topic}: {e}")
+                continue
+            seen[d["device"]] = time.time()
+            analyzer.ingest.put(d["device"], d)
+        analyzer.ingest.close()
+    feeder = threading.Thread(target=feed, name="feeder", daemon=True)
+    feeder.start()
+    outbox.put(("ready", worker_id, os.getpid()))
+
+    try:
+        while True:
+            if rebalanced.is_set():
+                rebalanced.clear()
+                lost = [dev for dev in analyzer.held_devices() if not owns(dev)]
+                if lost:
+                    hand_off(lost)
+                    print(f"[worker {worker_id}] Handed off {len(lost)} devices")
+            item = analyzer.ingest.get(timeout=1.0)
+            if item is None:
+                if analyzer.ingest.closed:
+                    break
+                continue
+            dev, d = item
+            try:
+                if dev not in warmed:
+                    warmed.add(dev)
+                    replayed = analyzer.warm_device(dev, config['data_dir'], before=d['ts'])
+                    if replayed:
+                        print(f"[worker {worker_id}] Caught {dev} up on {replayed} archived records")
+                analyzer.process_record(d)
+                processed[0] += 1
+                if not owns(dev):
+                    hand_off([dev])  # routed here just before the ring moved it
+            except Exception as e:
+                print(f"[worker {worker_id}] Error processing record from {dev}: {e}")
+    finally:
+        analyzer.scheduler.stop()
+        # Waits for a fit in progress only; without waiting, the exiting worker blocks joining the pool
+        analyzer.anomaly_detector.executor.shutdown(wait=True, cancel_futures=True)
+        outbox.put(("summary", worker_id, summarize()))
+        analyzer.write_state(analyzer.capture_state())
+        analyzer.alert_store.close()
+        if analyzer.bus is not None:
+            analyzer.bus.close()
+        outbox.put(("stopped", worker_id, os.getpid()))
+
+class Supervisor:
+    """Starts, routes to, monitors and restarts the analyzer workers; coordinates cross-device jobs"""
+
+    def __init__(self, n_workers: int = WORKERS, broker: Optional[str] = None, data_dir: str = "data",
+                 alerts_dir: str = "data", alerts_db: str = os.path.join("data", "alerts.db"),
+                 state_path: str = os.path.join("data", "analyzer_state.bin"),
+                 summary_interval: float = SUMMARY_INTERVAL, restart_backoff: float = RESTART_BACKOFF):
+        self.n_workers = n_workers
+        self.config = {'broker': broker, 'data_dir': data_dir, 'alerts_dir': alerts_dir,
+                       'alerts_db': alerts_db, 'state_path': state_path, 'summary_interval': summary_interval}
+        self.restart_backoff = restart_backoff
+        self.ctx = multiprocessing.get_context("spawn")
+        self.ring = HashRing()
+        self.outbox = self.ctx.Queue()
+        self.workers: Dict[int, Dict] = {}  # id -> {process, inbox, restarts, died_at}
+        self.summaries: Dict[int, Dict] = {}  # worker id -> latest summary
+        self.routed = 0
+        self.unrouted = 0
+        self.bus = None
+        self.scheduler = JobScheduler(max_workers=1)
+        self._stopping = threading.Event()
+        self._draining = threading.Event()  # set by stop(): workers that exit are not replaced
+        self._threads: List[threading.Thread] = []
+        self._alert_store = None  # coordinator alerts (correlations), opened by start()
+
+    # ---------- worker lifecycle ----------
+    def _spawn(self, worker_id: int):
+        inbox = self.ctx.Queue()
+        # Not a daemon: daemonic processes may not start the worker's training process
+        process = self.ctx.Process(target=_worker_main, args=(worker_id, inbox, self.outbox, self.config),
+                                   name=f"analyzer-worker-{worker_id}")
+        process.start()
+        entry = self.workers.setdefault(worker_id, {'restarts': -1})
+        entry.update(process=process, inbox=inbox, died_at=None, ready=False)
+        entry['restarts'] += 1
+
+    def start(self):
+        from hub import analyzer
+        from hub.alert_store import AlertStore
+        # Coordinator alerts go through the analyzer's alert log and store, at this supervisor's paths
+        analyzer.alerts_dir = self.config['alerts_dir']
+        self._alert_store = analyzer.alert_store = AlertStore(self.config['alerts_db'])
+        for worker_id in range(self.n_workers):
+            self._spawn(worker_id)
+        for target in (self._coordinate, self._monitor):
+            thread = threading.Thread(target=target, name=target.__name__.strip("_"), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.scheduler.add_job("correlation", 30.0, self.run_correlation, snapshot=self.correlation_snapshot)
+        self.scheduler.add_job("status", 60.0, self.publish_status)
+        self.scheduler.start()
+
+    def wait_ready(self, timeout: float = 60.0) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if len(self.ring.nodes) == self.n_workers:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def _monitor(self):
+        """Take dead workers off the ring at once; replace them after the backoff"""
+        while not self._stopping.wait(MONITOR_INTERVAL):
+            if self._draining.is_set():
+                continue
+            now = time.time()
+            for worker_id, entry in list(self.workers.items()):
+                if entry['process'].is_alive():
+                    continue
+                if entry['died_at'] is None:
+                    entry['died_at'] = now
+                    entry['ready'] = False
+                    # Survivors learn the new ring before any of the dead worker's devices reach them
+                    self._announce_ring([n for n in self.ring.nodes if n != worker_id])
+                    self.ring.remove(worker_id)
+                    print(f"[supervisor] Worker {worker_id} exited ({entry['process'].exitcode}); "
+                          f"its devices move to workers {self.ring.nodes}")
+                elif now - entry['died_at'] >= self.restart_backoff:
+                    print(f"[supervisor] Restarting worker {worker_id}")
+                    self._spawn(worker_id)
+
+    def _coordinate(self):
+        """Handle worker messages: readiness (joins the ring) and summaries"""
+        while not self._stopping.is_set():
+            try:
+                kind, worker_id, body = self.outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if kind == "ready":
+                self.workers[worker_id]['ready'] = True
+                self.ring.add(worker_id)
+                self._announce_ring(self.ring.nodes)
+                print(f"[supervisor] Worker {worker_id} ready (pid {body})")
+            elif kind == "summary":
+                self.summaries[worker_id] = body
+
+    def _announce_ring(self, nodes: List[int]):
+        """Tell every ready worker the ring, so each drops the devices it no longer owns"""
+        message = {'ring': nodes, 'replicas': self.ring.replicas}
+        for entry in list(self.workers.values()):
+            if entry['ready'] and entry['process'].is_alive():
+                entry['inbox'].put(message)
+
+    # ---------- routing ----------
+    def route(self, topic: str, payload: bytes) -> Optional[int]:
+        """Send one raw payload to the worker owning its device; returns the worker id"""
+        device = telemetry.device_from_topic(topic)
+        worker_id = self.ring.node_for(device) if device else None
+        if worker_id is None:
+            self.unrouted += 1
+            return None
+        self.workers[worker_id]['inbox'].put((topic, payload))
+        self.routed += 1
+        return worker_id
+
+    def assignment(self, devices) -> Dict[str, Optional[int]]:
+        return {dev: self.ring.node_for(dev) for dev in devices}
+
+    def attach(self, bus: Bus):
+        """Route telemetry from ``bus`` (raw payloads, blocking when the hand-off backs up)"""
+        from hub.analyzer import SUB_TOPIC
+        self.bus = bus
+        return bus.subscribe(SUB_TOPIC, self.route, block=True, raw=True)
+
+    # ---------- coordinator jobs ----------
+    def correlation_snapshot(self):
+        return {dev: summary['recent'] for s in list(self.summaries.values()) for dev, summary in s['devices'].items()}
+
+    def run_correlation(self, snapshot):
+        from hub import analyzer
+        analyzer.run_correlation_job(snapshot)
+
+    def status(self) -> Dict:
+        return {
+            "ts": time.time(),
+            "workers": {
+                worker_id: {
+                    "pid": entry['process'].pid, "alive": entry['process'].is_alive(), "ready": entry['ready'],
+                    "restarts": entry['restarts'],
+                    "devices": sorted(self.summaries.get(worker_id, {}).get('devices', {})),
+                    "processed": self.summaries.get(worker_id, {}).get('processed', 0),
+                    "ingest": self.summaries.get(worker_id, {}).get('ingest'),
+                    "alerts": self.summaries.get(worker_id, {}).get('alerts', {})
+                }
+                for worker_id, entry in self.workers.items()
+            },
+            "ring": self.ring.nodes,
+            "routed": self.routed,
+            "unrouted": self.unrouted,
+            "jobs": self.scheduler.metrics()
+        }
+
+    def publish_status(self):
+        if self.bus is not None:
+            from hub.analyzer import STATUS_TOPIC
+            self.bus.publish(STATUS_TOPIC, self.status(), retain=True)
+
+    def stop(self, timeout: float = 15.0):
+        """Ask every worker to drain and snapshot, then stop"""
+        self._draining.set()
+        self.scheduler.stop()
+        for entry in self.workers.values():
+            if entry['process'].is_alive():
+                entry['inbox'].put(None)
+        deadline = time.time() + timeout
+        for entry in self.workers.values():
+            entry['process'].join(max(0.0, deadline - time.time()))
+            if entry['process'].is_alive():
+                entry['process'].terminate()
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        if self._alert_store is not None:
+            from hub import analyzer
+            self._alert_store.close()
+            if analyzer.alert_store is self._alert_store:
+                analyzer.alert_store = None
+            self._alert_store = None
+
+def run(n_workers: int = WORKERS):
+    """Live mode: subscribe once and fan telemetry out to the workers"""
+    from hub import analyzer
+    from hub.alert_store import ALERTS_DB
+    supervisor = Supervisor(n_workers, broker=analyzer.BROKER, alerts_dir=analyzer.alerts_dir, alerts_db=ALERTS_DB,
+                            state_path=analyzer.STATE_PATH)
+    supervisor.start()
+    supervisor.wait_ready()
+    bus = Bus(MqttTransport(analyzer.BROKER))
+    supervisor.attach(bus)
+    analyzer.bus = bus
+    print(f"[supervisor] {n_workers} workers; subscribing to {analyzer.SUB_TOPIC}")
+    try:
+        bus.run_forever()
+    finally:
+        supervisor.stop()
+        bus.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lab-OS sharded analyzer")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Analyzer worker processes")
+    args = parser.parse_args(argv)
+    run(args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# hub/telemetry.py
+"""Shared decoding for telemetry and alert payloads.
+
+One schema for every consumer (saver, analyzer, dashboard): a telemetry
+record is a flat JSON object with a numeric ``ts``, a ``device`` (taken from
+the MQTT topic when the sidecar leaves it out), numeric metric fields, an
+optional ``units`` map and optional scalar annotations such as ``idn``.
+Anything else is rejected with DecodeError before it reaches the pipeline.
+
+msgspec validates while it parses when installed; otherwise orjson, then the
+stdlib json module, parse and the schema is checked in Python.  Every path
+rejects NaN/Infinity, which are not JSON and would poison running stats.
+``dumps`` also accepts numpy scalars and non-string keys, which analyzer
+alerts and status messages carry.
+``bench/codec_decode.py`` compares their throughput.
+"""
+import json
+from typing import Dict, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TELEMETRY_TOPIC_PREFIX = "lab/device/"
+MAX_PAYLOAD_BYTES = 64 * 1024
+
+class DecodeError(ValueError):
+    """Payload is not a well-formed telemetry or alert record"""
+
+def _reject_constant(name):
+    raise ValueError(f"non-finite number {name}")
+
+if msgspec is not None:
+    BACKEND = "msgspec"
+    # Flat object of scalars; only ``units`` may nest, as a str -> str map
+    _telemetry_decoder = msgspec.json.Decoder(Dict[str, Union[float, str, bool, None, Dict[str, str]]])
+    _object_decoder = msgspec.json.Decoder(dict)
+    _encoder = msgspec.json.Encoder(enc_hook=lambda obj: obj.item())  # numpy scalars in alerts
+
+    def loads(data: Union[bytes, str]):
+        try:
+            return _object_decoder.decode(data)
+        except (msgspec.DecodeError, msgspec.ValidationError) as e:
+            raise DecodeError(str(e)) from None
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj)
+
+    def _decode_telemetry_object(data: Union[bytes, str]) -> Dict:
+        try:
+            d = _telemetry_decoder.decode(data)
+        except (msgspec.DecodeError, msgspec.ValidationError) as e:
+            raise DecodeError(str(e)) from None
+        for key, value in d.items():
+            if type(value) is dict and key != "units":
+                raise DecodeError(f"field {key!r} must be a scalar")
+        return d
+elif orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data: Union[bytes, str]):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise DecodeError(str(e)) from None
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+else:
+    BACKEND = "json"
+    _json_decoder = json.JSONDecoder(parse_constant=_reject_constant)
+
+    def loads(data: Union[bytes, str]):
+        try:
+            return _json_decoder.decode(data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else data)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise DecodeError(str(e)) from None
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, allow_nan=False, default=lambda o: o.item()).encode("utf-8")
+
+if BACKEND != "msgspec":
+    def _decode_telemetry_object(data: Union[bytes, str]) -> Dict:
+        d = loads(data)
+        if not isinstance(d, dict):
+            raise DecodeError("telemetry payload is not a JSON object")
+        for key, value in d.items():
+            if isinstance(value, dict):
+                if key != "units" or not all(isinstance(u, str) for u in value.values()):
+                    raise DecodeError(f"field {key!r} must be a scalar")
+            elif not (value is None or isinstance(value, (int, float, str))):
+                raise DecodeError(f"field {key!r} must be a scalar")
+        return d
+
+def device_from_topic(topic: Optional[str]) -> Optional[str]:
+    """``lab/device/<name>/telemetry`` -> ``<name>``"""
+    if not topic or not topic.startswith(TELEMETRY_TOPIC_PREFIX):
+        return None
+    name = topic[len(TELEMETRY_TOPIC_PREFIX):].split("/", 1)[0]
+    return name or None
+
+def decode_telemetry(data: Union[bytes, str], topic: Optional[str] = None) -> Dict:
+    """Decode and validate one telemetry payload; raises DecodeError"""
+    if len(data) > MAX_PAYLOAD_BYTES:
+        raise DecodeError(f"payload of {len(data)} bytes exceeds {MAX_PAYLOAD_BYTES}")
+    d = _decode_telemetry_object(data)
+    ts = d.get("ts")
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)):
+        raise DecodeError("telemetry needs a numeric 'ts'")
+    if "units" in d and not isinstance(d["units"], dict):
+        raise DecodeError("'units' must be an object")
+    device = d.get("device")
+    if device is None:
+        device = device_from_topic(topic)
+        if device is None:
+            raise DecodeError("no 'device' in payload or topic")
+        d["device"] = device
+    elif not isinstance(device, str) or "/" in device or not device:
+        raise DecodeError("'device' must be a non-empty name without '/'")
+    return d
+
+def decode_alert(data: Union[bytes, str]) -> Dict:
+    """Decode one alert from the alert topic; raises DecodeError"""
+    if len(data) > MAX_PAYLOAD_BYTES:
+        raise DecodeError(f"payload of {len(data)} bytes exceeds {MAX_PAYLOAD_BYTES}")
+    alert = loads(data)
+    if not isinstance(alert, dict) or not isinstance(alert.get("type"), str):
+        raise DecodeError("alert must be a JSON object with a string 'type'")
+    return alert